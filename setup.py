@@ -24,12 +24,12 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
     ],
     keywords='collisions morphology fcl',  # Optional
     packages=find_packages("src", exclude=['contrib', 'docs', 'src/tests']),  # Required
     package_dir={"": "src"},
+    python_requires='>=3.8',
     py_modules=[path.splitext(path.basename(p))[0] for p in glob("src/*.py")],
     install_requires=['matplotlib > 3',
                       'numpy > 1.17',
@@ -61,10 +61,12 @@ def plot_colls_distance_correlation(folder: pathlib.Path, neuron_name: str) -> C
     g : CollisionsDistNaive
         Graph object of the neuron
     """
+    # Loads the graph's .npz file, or converts the .gml one if there's no .npz
     fname = folder / f"graph_{neuron_name}_with_collisions.gml"
-    if not fname.exists():
+    try:
+        g = CollisionsDistNaive.from_graph(fname, neuron_name)
+    except FileNotFoundError:
         return
-    g = CollisionsDistNaive.from_graph(fname, neuron_name)
     g.run()
     g.all_colls["dist_to_origin"] = compute_dist_to_origin(g.all_colls)
     g.all_colls["z_abs"] = g.all_colls["z"].abs()
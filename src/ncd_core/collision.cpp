@@ -4,11 +4,15 @@
 
 
 int Collision::check_a_collision(FclModelCPtr fm1, FclModelCPtr fm2, int x_translation, int y_translation, int z_translation, int x_rot, int y_rot, int z_rot, int num_of_col, PointsVector *collisions)
+{
+	return check_a_collision(fm1, fm2, x_translation, y_translation, z_translation, calc_matrix(x_rot, y_rot, z_rot), num_of_col, collisions);
+}
+
+int Collision::check_a_collision(FclModelCPtr fm1, FclModelCPtr fm2, int x_translation, int y_translation, int z_translation, const Matrix3f& rotation, int num_of_col, PointsVector *collisions)
 {
 	Transform3f tf1 = Transform3<float>::Identity();
 	Transform3f tf2 = Transform3<float>::Identity();
-	Matrix3f m = calc_matrix(x_rot, y_rot, z_rot);
-	tf2.linear() = m;
+	tf2.linear() = rotation;
 	tf2.translation() = Vec3f(x_translation, y_translation, z_translation);
 
 	bool should_get_collisions = (collisions != NULL);
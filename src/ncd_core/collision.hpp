@@ -8,9 +8,10 @@ class Collision
 {
 public:
 	static int check_a_collision(FclModelCPtr fm1, std::shared_ptr<const FclModel> fm2, int x_translation, int y_translation, int z_translation, int x_rot, int y_rot, int z_rot, int num_of_col, PointsVector * collisions);
+	static int check_a_collision(FclModelCPtr fm1, std::shared_ptr<const FclModel> fm2, int x_translation, int y_translation, int z_translation, const Matrix3f& rotation, int num_of_col, PointsVector * collisions);
 	static NativeMatrix calc_native_matrix(double x_rot, double y_rot, double z_rot);
-private:
 	static Matrix3f calc_matrix(double x_rot, double y_rot, double z_rot);
+private:
 	static double angle_to_rad(double angle);
 };
 
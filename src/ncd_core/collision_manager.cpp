@@ -1,129 +1,224 @@
 #include "collision_manager.hpp"
 #include "collision.hpp"
 #include "trace.hpp"
-#include <pthread.h>
+#include <algorithm>
 #include <memory>
 
-static void* thread_main_impl(thread_params_t* params);
-static void* thread_main(void* arg);
-
 CollisionManager::CollisionManager(const Model* m1, const Model* m2, const std::string& neuron_filename, int num_of_threads, int max_num_of_collisions,
 									const std::string& output_directory, bool minimal_only, bool bound_checks, bool should_output_collisions,
 									bool should_rotate)
 {
 	_m1 = m1;
-	_m2 = m2;
 	_num_of_threads = num_of_threads;
 	_max_num_of_collisions = max_num_of_collisions;
-	_neuron_filename = neuron_filename;
 	_output_directory = output_directory;
 	_minimal_only = minimal_only;
 	_bound_checks = bound_checks;
 	_should_output_collision_files = should_output_collisions;
 	_should_rotate = should_rotate;
+	_next_item = 0;
+	_job.items = NULL;
+	pthread_mutex_init(&_job_lock, NULL);
+	pthread_mutex_init(&_pool_lock, NULL);
+	pthread_cond_init(&_job_ready, NULL);
+	pthread_cond_init(&_job_done, NULL);
 
 	LOG_INFO("Creating model1...\n");
 	_fm1 = _m1->fcl_model();
 	_fm1_bounding_box = _m1->get_bounding_box();
 	LOG_INFO("\tDone.\n");
+	set_neuron(m2, neuron_filename);
+}
+
+CollisionManager::~CollisionManager()
+{
+	stop_workers();
+	pthread_cond_destroy(&_job_done);
+	pthread_cond_destroy(&_job_ready);
+	pthread_mutex_destroy(&_pool_lock);
+	pthread_mutex_destroy(&_job_lock);
+}
+
+// Replaces the neuron, keeping the vascular FCL model, which is by far the
+// more expensive one to build
+void CollisionManager::set_neuron(const Model* m2, const std::string& neuron_filename)
+{
+	_m2 = m2;
+	_neuron_filename = neuron_filename;
+
 	LOG_INFO("Creating model2...\n");
 	_fm2 = _m2->fcl_model();
 	_fm2_cube = Cube(_m2->get_bounding_box());
+	// Holds the rotated cube of the previous neuron
+	_rotation_table.reset();
+	if (_metrics != NULL)
+		_metrics->set_neuron(_neuron_filename);
 	LOG_INFO("\tDone.\n");
 }
 
-CollisionManager::~CollisionManager()
+
+void* CollisionManager::worker_main(void* arg)
 {
+	thread_params_t* params = (thread_params_t*)arg;
+	params->collision_manager->worker_loop(params->thread_id);
+	return NULL;
 }
 
-
-static void* thread_main(void* arg)
+void CollisionManager::worker_loop(int thread_id)
 {
-	thread_params_t* params = (thread_params_t*)arg;
-	try
-	{
-		thread_main_impl(params);
-	}
-	catch(const Exception& exp)
+	LOG_TRACE("Thread #%i started\n", thread_id);
+	unsigned last_generation = 0;
+	for(;;)
 	{
-		LOG_ERROR("Exception in thread #%i: %s\n", params->thread_id, exp.msg().c_str());
+		pthread_mutex_lock(&_pool_lock);
+		while (!_stop && _job_generation == last_generation)
+			pthread_cond_wait(&_job_ready, &_pool_lock);
+		if (_stop)
+		{
+			pthread_mutex_unlock(&_pool_lock);
+			break;
+		}
+		last_generation = _job_generation;
+		pthread_mutex_unlock(&_pool_lock);
+
+		for(;;)
+		{
+			long item = _next_item.fetch_add(1);
+			if (item >= _job.total_items)
+				break;
+			try
+			{
+				check_rotation(item);
+			}
+			catch(const Exception& exp)
+			{
+				LOG_ERROR("Exception in thread #%i: %s\n", thread_id, exp.msg().c_str());
+			}
+			catch(...)
+			{
+				LOG_ERROR("Unknown exception in thread #%i\n", thread_id);
+			}
+			if (_metrics != NULL)
+				_metrics->maybe_report();
+		}
+
+		pthread_mutex_lock(&_pool_lock);
+		if (--_busy_workers == 0)
+			pthread_cond_signal(&_job_done);
+		pthread_mutex_unlock(&_pool_lock);
 	}
-	catch(...)
+	LOG_TRACE("Thread #%i Finished\n", thread_id);
+}
+
+void CollisionManager::start_workers()
+{
+	if (!_workers.empty())
+		return;
+
+	_workers = std::vector<pthread_t>(_num_of_threads);
+	_workers_params = std::vector<thread_params_t>(_num_of_threads);
+	for (int i = 0; i < _num_of_threads; ++i)
 	{
-		LOG_ERROR("Unknown exception in thread #%i\n", params->thread_id);
+		_workers_params[i].collision_manager = this;
+		_workers_params[i].thread_id = i;
+		LOG_TRACE("About to create thread #%i...\n", i);
+		int ret = pthread_create(&_workers[i], NULL, worker_main, &_workers_params[i]);
+		if (ret != 0)
+		{
+			_workers.resize(i);
+			stop_workers();
+			throw Exception("Error in pthread_create");
+		}
 	}
 }
 
-static void report_progress(ResultObject* res)
+void CollisionManager::stop_workers()
 {
-	static int last_percentage = 0;
-	int cur_percentage = (int)(res->get_percentage() * 100);
-	if (cur_percentage == last_percentage)
+	pthread_mutex_lock(&_pool_lock);
+	_stop = true;
+	pthread_cond_broadcast(&_job_ready);
+	pthread_mutex_unlock(&_pool_lock);
+
+	for (size_t i = 0; i < _workers.size(); ++i)
 	{
-		return;
+		pthread_join(_workers[i], NULL);
 	}
+	_workers.clear();
+	_stop = false;
+}
 
-	if (cur_percentage % 10 == 0)
-		LOG_INFO("\tCompleted %i%\n", cur_percentage);
-	else
-		LOG_TRACE("\tCompleted %i%\n", cur_percentage);
-	last_percentage = cur_percentage;
+// Hands _job to the workers and waits for all of its items to be checked
+void CollisionManager::run_job()
+{
+	start_workers();
+
+	if (_metrics != NULL)
+		_metrics->start_stage(_job.total_items);
+
+	pthread_mutex_lock(&_pool_lock);
+	_next_item = 0;
+	_busy_workers = _workers.size();
+	_job_generation++;
+	pthread_cond_broadcast(&_job_ready);
+	while (_busy_workers > 0)
+		pthread_cond_wait(&_job_done, &_pool_lock);
+	pthread_mutex_unlock(&_pool_lock);
 }
 
-static void* thread_main_impl(thread_params_t* params)
+void CollisionManager::check_rotation(long item)
 {
-	LOG_TRACE("Thread main #%i! min_x -> max_x: %i -> %i. Creating models...\n",
-					params->thread_id, params->min_x, params->max_x);
-	FclModelCPtr fm1 = params->fm1;
-	const BoundingBox * fm1_bounding_box = params->fm1_bounding_box;
-	FclModelCPtr fm2 = params->fm2;
-	const Cube * fm2_cube = params->fm2_cube;
-	int id = params->thread_id;
-	
-	for(int x = params->min_x; x <= params->max_x; ++x)
+	static PointsVector* IGNORE_COLLISIONS_LOCATIONS = NULL;
+	int location_index, x, y, z;
+	if (_job.items != NULL)
 	{
-		for(int y = params->min_y; y <= params->max_y; ++y)
-		{
-			for(int z = params->min_z; z <= params->max_z; ++z)
-			{
-				static PointsVector* IGNORE_COLLISIONS_LOCATIONS = NULL;
-				int num_of_collisions = 0;
-
-				bool is_contained = true;
-				if (fm1_bounding_box != NULL && fm2_cube != NULL)
-				{
-					NativeMatrix mat = Collision::calc_native_matrix(x, y, z);
-					Cube c = fm2_cube->rotate_and_transform(mat, params->x_pos, params->y_pos, params->z_pos);
-					is_contained = c.is_contained(fm1_bounding_box);
-				}
-				if (!is_contained)
-				{
-					num_of_collisions = 3333333; // should be big enough
-				}
-				else
-				{
-					num_of_collisions = 
-						Collision::check_a_collision(fm1,
-													 fm2,
-													 params->x_pos,
-													 params->y_pos,
-													 params->z_pos,
-													 x,
-													 y,
-													 z,
-													 params->num_of_col,
-													 IGNORE_COLLISIONS_LOCATIONS);
-				}
+		const WorkItem& work_item = _job.items[item];
+		location_index = work_item.location_index;
+		x = work_item.rotation.x;
+		y = work_item.rotation.y;
+		z = work_item.rotation.z;
+	}
+	else
+	{
+		location_index = item / _job.rotations_per_location;
+		int rotation_index = item % _job.rotations_per_location;
+		z = _job.min_z + rotation_index % _job.z_size;
+		rotation_index /= _job.z_size;
+		y = _job.min_y + rotation_index % _job.y_size;
+		x = _job.min_x + rotation_index / _job.y_size;
+	}
+	const Location& loc = _job.locations[location_index];
+	ResultObject* res = _job.result_objects[location_index];
 
-				LOG_DEBUG("(%i):\t(%i,\t%i,\t%i)\t=\t%i\n", id, x, y, z, num_of_collisions);
-				params->result_object->add_result(x, y, z, num_of_collisions);
-				if (id == 0)
-					report_progress(params->result_object);
-			} 
-		}
+	int num_of_collisions = 0;
+	bool is_contained = true;
+	if (_bound_checks)
+	{
+		is_contained = _rotation_table->is_contained(x, y, z, loc.x, loc.y, loc.z, _fm1_bounding_box);
 	}
-	LOG_TRACE("Thread #%i Finished\n", id);
-	return NULL;
+	if (!is_contained)
+	{
+		num_of_collisions = 3333333; // should be big enough
+	}
+	else
+	{
+		// When only the minimal rotations are written, FCL can stop as soon as
+		// a rotation has more collisions than the current minimal ones
+		int max_num_of_collisions = _minimal_only ? res->collision_limit(_max_num_of_collisions) : _max_num_of_collisions;
+		num_of_collisions =
+			Collision::check_a_collision(_fm1,
+										 _fm2,
+										 loc.x,
+										 loc.y,
+										 loc.z,
+										 _rotation_table->matrix(x, y, z),
+										 max_num_of_collisions,
+										 IGNORE_COLLISIONS_LOCATIONS);
+	}
+
+	if (_metrics != NULL)
+		_metrics->rotation_checked(is_contained);
+	LOG_DEBUG("(%i,%i,%i):\t(%i,\t%i,\t%i)\t=\t%i\n", loc.x, loc.y, loc.z, x, y, z, num_of_collisions);
+	res->add_result(x, y, z, num_of_collisions);
 }
 
 
@@ -230,103 +325,251 @@ void single_result_callback(void* arg, SingleResultCallbackParam * params)
 
 	if (!cm->should_output_collisions())
 	{
-		strncpy(params->single_result->output_filename, "<no file created>", OUTPUT_FILENAME_LENGTH);
+		params->single_result->output_filename = "<no file created>";
 		return;
 	}
 
-	std::string filename =
+	params->single_result->output_filename =
 			cm->output_collision_points_single_collision(params->x, params->y, params->z, params->r_x, params->r_y, params->r_z);
-	strncpy(params->single_result->output_filename, filename.c_str(), OUTPUT_FILENAME_LENGTH);
 }
 
-void CollisionManager::check_all_collisions_at_location(int x_pos, int y_pos, int z_pos, char main_axis, const std::string& output_filename)
+std::unique_ptr<ResultObject> CollisionManager::compute_location(int x_pos, int y_pos, int z_pos, char main_axis)
+{
+	Location loc = {x_pos, y_pos, z_pos};
+	std::vector<std::unique_ptr<ResultObject>> results = compute_locations(std::vector<Location>(1, loc), main_axis);
+	return std::move(results[0]);
+}
+
+// Checks all rotations at all of the given locations. The rotations of all the
+// locations are scheduled together, so no thread waits for the others before
+// the whole batch is done.
+std::vector<std::unique_ptr<ResultObject>> CollisionManager::compute_locations(const std::vector<Location>& locations, char main_axis)
 {
-	LOG_INFO("Checking collisions at (%i, %i, %i), using %i threads\n", x_pos, y_pos, z_pos, _num_of_threads);
 	int min_x, max_x, min_y, max_y, min_z, max_z;
 	calc_ranges(main_axis, &min_x, &max_x, &min_y, &max_y, &min_z, &max_z, _should_rotate);
-	ResultObject res(min_x, max_x, min_y, max_y, min_z, max_z, x_pos, y_pos, z_pos);
 
-	auto thread_ids = std::vector<pthread_t>(_num_of_threads);
-	auto all_params = std::vector<thread_params>(_num_of_threads);
-	int z_range = max_z - min_z + 1;
-	int next_z = min_z;
-	for (int i = 0; i < _num_of_threads; ++i)
+	std::vector<std::unique_ptr<ResultObject>> results;
+	std::vector<ResultObject*> result_ptrs;
+	for (size_t i = 0; i < locations.size(); ++i)
 	{
-		LOG_TRACE("Preparing thread #%i\n", i);
-		thread_params_t* params = &all_params[i];
-		params->thread_id = i;
-		params->result_object = &res;
-		params->fm1 = _fm1;
-		params->fm2 = _fm2;
-		if (_bound_checks)
+		const Location& loc = locations[i];
+		LOG_INFO("Checking collisions at (%i, %i, %i), using %i threads\n", loc.x, loc.y, loc.z, _num_of_threads);
+		results.emplace_back(new ResultObject(min_x, max_x, min_y, max_y, min_z, max_z, loc.x, loc.y, loc.z));
+		if (_minimal_only)
 		{
-			params->fm1_bounding_box = &_fm1_bounding_box;
-			params->fm2_cube = &_fm2_cube;
+			// The coarse to fine search also needs the exact order of its candidates
+			int tracked = _rotation_steps.empty() ? MINIMAL_RESULTS : std::max(MINIMAL_RESULTS, _num_of_candidates);
+			results.back()->track_best(tracked);
 		}
-		else
+		result_ptrs.push_back(results.back().get());
+	}
+	if (locations.empty())
+		return results;
+
+	pthread_mutex_lock(&_job_lock);
+	_job.result_objects = result_ptrs.data();
+	_job.locations = locations.data();
+	_job.num_of_locations = locations.size();
+	_job.min_x = min_x;
+	_job.max_x = max_x;
+	_job.min_y = min_y;
+	_job.max_y = max_y;
+	_job.min_z = min_z;
+	_job.max_z = max_z;
+	_job.y_size = max_y - min_y + 1;
+	_job.z_size = max_z - min_z + 1;
+	_job.rotations_per_location = (max_x - min_x + 1) * _job.y_size * _job.z_size;
+	try
+	{
+		if (!_rotation_table || !_rotation_table->matches(min_x, max_x, min_y, max_y, min_z, max_z))
 		{
-			params->fm1_bounding_box = NULL;
-			params->fm2_cube = NULL;
+			LOG_TRACE("Building rotation table\n");
+			_rotation_table.reset(new RotationTable(min_x, max_x, min_y, max_y, min_z, max_z, _fm2_cube));
 		}
-		params->x_pos = x_pos;
-		params->y_pos = y_pos;
-		params->z_pos = z_pos;
-		params->num_of_col = _max_num_of_collisions;;
-
-		params->min_z = next_z;
-		params->max_z = next_z + z_range / _num_of_threads - 1;
-		if (i == _num_of_threads - 1)
-			params->max_z = max_z;
-		next_z = params->max_z + 1;
-
-		params->min_x = min_x;
-		params->max_x = max_x;
-		params->min_y = min_y;
-		params->max_y = max_y;
+		if (_metrics != NULL)
+			_metrics->start_batch(locations.size(), _rotation_steps.empty() ? 1 : _rotation_steps.size());
+		if (_rotation_steps.empty())
+			run_all_rotations(locations.size());
+		else
+			run_coarse_to_fine(locations.size());
 	}
+	catch(...)
+	{
+		pthread_mutex_unlock(&_job_lock);
+		throw;
+	}
+	pthread_mutex_unlock(&_job_lock);
+	if (_metrics != NULL)
+		_metrics->locations_done(locations.size());
 
-	for (int i = 0; i < _num_of_threads; ++i)\
+	for (size_t i = 0; i < results.size(); ++i)
 	{
-		thread_params_t* params = &all_params[i];
-		LOG_TRACE("About to create thread #%i...\n", i);
-		int ret = pthread_create(&thread_ids[i], NULL, thread_main, params);
-		if (ret < 0)
-		{
-			throw Exception("Error in pthread_create");
-		}
-		LOG_TRACE(" > Thread created\n");
+		ResultObject& res = *results[i];
+		int min_results = res.mark_mins(MINIMAL_RESULTS, _max_num_of_collisions);
+
+		int total_results = 0, oob_results = 0, too_many_collisions_results = 0, valid_results = 0;
+		res.get_statistics(_max_num_of_collisions, total_results, oob_results,
+												   too_many_collisions_results, valid_results);
+		LOG_INFO("> Summary for location (%i,%i,%i)\n", locations[i].x, locations[i].y, locations[i].z);
+		LOG_INFO("\tTotal of %i positions were tested\n", total_results);
+		LOG_INFO("\t%i positions were discarded due to out of bound checks\n", oob_results);
+		LOG_INFO("\t%i positions were discarded due to too many collisions\n", too_many_collisions_results);
+		LOG_INFO("\t%i positions were valid, %i of them marked as minimal\n", valid_results, min_results);
 	}
 
-	void* ignores_res;
+	return results;
+}
+
+void CollisionManager::run_all_rotations(int num_of_locations)
+{
+	_job.items = NULL;
+	_job.total_items = (long)_job.rotations_per_location * num_of_locations;
+	run_job();
+}
+
+void CollisionManager::run_items(const std::vector<WorkItem>& items)
+{
+	_job.items = items.data();
+	_job.total_items = items.size();
+	run_job();
+	_job.items = NULL;
+}
 
-	for(int i = 0; i < _num_of_threads; ++i)
+// All multiples of step in [min_angle, max_angle]
+static std::vector<int> grid_angles(int min_angle, int max_angle, int step)
+{
+	std::vector<int> angles;
+	int first = min_angle >= 0 ? (min_angle + step - 1) / step * step : -(-min_angle / step * step);
+	for (int angle = first; angle <= max_angle; angle += step)
 	{
-		LOG_TRACE("============ About to join thread #%i ============\n", i);
-		int ret = pthread_join(thread_ids[i], &ignores_res);
-		if (ret != 0)
+		angles.push_back(angle);
+	}
+	return angles;
+}
+
+// Angles around center, at most max_distance away, in steps of step. A full
+// circle range wraps around, other ranges are clipped.
+static std::vector<int> refined_angles(int center, int max_distance, int step, int min_angle, int max_angle)
+{
+	bool is_circle = max_angle - min_angle + 1 == 360;
+	std::vector<int> angles;
+	for (int offset = -(max_distance / step) * step; offset <= max_distance; offset += step)
+	{
+		int angle = center + offset;
+		if (is_circle)
+			angle = min_angle + ((angle - min_angle) % 360 + 360) % 360;
+		else if (angle < min_angle || angle > max_angle)
+			continue;
+		angles.push_back(angle);
+	}
+	return angles;
+}
+
+// Checks a coarse grid of rotations, then repeatedly checks finer grids around
+// the best rotations found so far. Each level only checks the neighbourhood
+// between the best rotations and the previous level's grid points around them.
+void CollisionManager::run_coarse_to_fine(int num_of_locations)
+{
+	std::vector<WorkItem> items;
+	int step = _rotation_steps[0];
+	std::vector<int> xs = grid_angles(_job.min_x, _job.max_x, step);
+	std::vector<int> ys = grid_angles(_job.min_y, _job.max_y, step);
+	std::vector<int> zs = grid_angles(_job.min_z, _job.max_z, step);
+	for (int i = 0; i < num_of_locations; ++i)
+	{
+		for (size_t a = 0; a < xs.size(); ++a)
+			for (size_t b = 0; b < ys.size(); ++b)
+				for (size_t c = 0; c < zs.size(); ++c)
+				{
+					WorkItem item = {i, {xs[a], ys[b], zs[c]}};
+					items.push_back(item);
+				}
+	}
+	LOG_TRACE("Rotation search level 0 (step %i): %i rotations\n", step, (int)items.size());
+	run_items(items);
+
+	for (size_t level = 1; level < _rotation_steps.size(); ++level)
+	{
+		int max_distance = _rotation_steps[level - 1] - 1;
+		step = _rotation_steps[level];
+		items.clear();
+		for (int i = 0; i < num_of_locations; ++i)
 		{
-			throw Exception("Error in pthread_join");
+			ResultObject* res = _job.result_objects[i];
+			std::vector<bool> queued(_job.rotations_per_location, false);
+			std::vector<Rotation> best = res->get_best(_num_of_candidates);
+			for (size_t j = 0; j < best.size(); ++j)
+			{
+				xs = refined_angles(best[j].x, max_distance, step, _job.min_x, _job.max_x);
+				ys = refined_angles(best[j].y, max_distance, step, _job.min_y, _job.max_y);
+				zs = refined_angles(best[j].z, max_distance, step, _job.min_z, _job.max_z);
+				for (size_t a = 0; a < xs.size(); ++a)
+					for (size_t b = 0; b < ys.size(); ++b)
+						for (size_t c = 0; c < zs.size(); ++c)
+						{
+							int index = ((xs[a] - _job.min_x) * _job.y_size + (ys[b] - _job.min_y)) * _job.z_size + (zs[c] - _job.min_z);
+							if (queued[index] || res->is_checked(xs[a], ys[b], zs[c]))
+								continue;
+							queued[index] = true;
+							WorkItem item = {i, {xs[a], ys[b], zs[c]}};
+							items.push_back(item);
+						}
+			}
 		}
-		LOG_TRACE("pthread_join #%i returned\n", i);
+		LOG_TRACE("Rotation search level %i (step %i): %i rotations\n", (int)level, step, (int)items.size());
+		run_items(items);
 	}
+}
 
-	int min_results = res.mark_mins(10, _max_num_of_collisions);
-
-	int total_results = 0, oob_results = 0, too_many_collisions_results = 0, valid_results = 0;
-	res.get_statistics(_max_num_of_collisions, total_results, oob_results,
-											   too_many_collisions_results, valid_results);
-	LOG_INFO("> Summary for location (%i,%i,%i)\n", x_pos, y_pos, z_pos);
-	LOG_INFO("\tTotal of %i positions were tested\n", total_results);
-	LOG_INFO("\t%i positions were discarded due to out of bound checks\n", oob_results);
-	LOG_INFO("\t%i positions were discarded due to too many collisions\n", too_many_collisions_results);
-	LOG_INFO("\t%i positions were valid, %i of them marked as minimal\n", valid_results, min_results);
+void CollisionManager::set_rotation_search(const std::vector<int>& steps, int num_of_candidates)
+{
+	for (size_t i = 0; i < steps.size(); ++i)
+	{
+		if (steps[i] <= 0 || (i > 0 && steps[i] >= steps[i - 1]))
+			throw Exception("Rotation steps must be positive and decreasing");
+	}
+	if (num_of_candidates <= 0)
+		throw Exception("Number of refined rotations must be positive");
+	_rotation_steps = steps;
+	_num_of_candidates = num_of_candidates;
+}
 
-	res.for_each_result(single_result_callback, (void*)this);
+void CollisionManager::set_vascular_name(const std::string& vascular_name)
+{
+	_vascular_name = vascular_name;
+}
 
-	res.write_to_file(output_filename, _neuron_filename, _minimal_only);
+void CollisionManager::set_metrics(RunMetrics* metrics)
+{
+	_metrics = metrics;
+	if (_metrics != NULL)
+		_metrics->set_neuron(_neuron_filename);
 }
 
+void CollisionManager::check_all_collisions_at_locations(const std::vector<Location>& locations, char main_axis, ResultWriter& writer)
+{
+	std::vector<std::unique_ptr<ResultObject>> results = compute_locations(locations, main_axis);
+
+	for (size_t i = 0; i < results.size(); ++i)
+	{
+		results[i]->for_each_result(single_result_callback, (void*)this);
+		writer.write(*results[i]);
+	}
+}
 
+BinaryResultsHeader CollisionManager::results_header(char main_axis) const
+{
+	BinaryResultsHeader header = {};
+	strncpy(header.magic, BINARY_RESULTS_MAGIC, sizeof(header.magic));
+	header.version = BINARY_RESULTS_VERSION;
+	header.record_size = sizeof(BinaryResultRecord);
+	calc_ranges(main_axis, &header.min_x, &header.max_x, &header.min_y, &header.max_y, &header.min_z, &header.max_z, _should_rotate);
+	header.max_num_of_collisions = _max_num_of_collisions;
+	header.minimal_only = _minimal_only;
+	strncpy(header.neuron_name, _neuron_filename.c_str(), BINARY_RESULTS_NAME_LENGTH - 1);
+	strncpy(header.vascular_name, _vascular_name.c_str(), BINARY_RESULTS_NAME_LENGTH - 1);
+	return header;
+}
 
 void CollisionManager::check_all_collisions(const std::string& locations_filename, char main_axis, const std::string& output_filename)
 {
@@ -336,23 +579,32 @@ void CollisionManager::check_all_collisions(const std::string& locations_filenam
 		throw Exception("failed opening locations file");
 	}
 
+	ResultWriter writer(output_filename, results_header(main_axis));
 	const char* line_template = "%i,%i,%i\n";
-	char buff[1024];
-	int x, y, z;
+	std::vector<Location> locations;
+	Location loc;
 
 	for(;;)
 	{
-		int ret = fscanf(f, line_template, &x, &y, &z);
+		int ret = fscanf(f, line_template, &loc.x, &loc.y, &loc.z);
 		if (ret <= 0)
 			break;
-		check_all_collisions_at_location(x, y, z, main_axis, output_filename);
+		locations.push_back(loc);
+		if (locations.size() == LOCATIONS_PER_BATCH)
+		{
+			check_all_collisions_at_locations(locations, main_axis, writer);
+			locations.clear();
+		}
 	}
 	fclose(f);
+	check_all_collisions_at_locations(locations, main_axis, writer);
 }
 
 void CollisionManager::check_all_collisions(int x_pos, int y_pos, int z_pos, char main_axis, const std::string& output_filename)
 {
-	check_all_collisions_at_location(x_pos, y_pos, z_pos, main_axis, output_filename);
+	ResultWriter writer(output_filename, results_header(main_axis));
+	Location loc = {x_pos, y_pos, z_pos};
+	check_all_collisions_at_locations(std::vector<Location>(1, loc), main_axis, writer);
 }
 
 
@@ -3,7 +3,63 @@
 #include "model.hpp"
 #include "result_object.hpp"
 #include "cube.hpp"
+#include "rotation_table.hpp"
+#include "metrics.hpp"
+#include "result_writer.hpp"
 #include "exception.hpp"
+#include <atomic>
+#include <pthread.h>
+#include <vector>
+
+// Number of locations whose rotations are scheduled together on the worker pool
+#define LOCATIONS_PER_BATCH 16
+// Number of rotations marked as minimal at each location
+#define MINIMAL_RESULTS 10
+
+typedef struct Location_s
+{
+	int x;
+	int y;
+	int z;
+} Location;
+
+class CollisionManager;
+
+typedef struct thread_params
+{
+	CollisionManager* collision_manager;
+	int thread_id;
+} thread_params_t;
+
+// A single rotation to check at one of the job's locations
+typedef struct WorkItem_s
+{
+	int location_index;
+	Rotation rotation;
+} WorkItem;
+
+// A batch of locations, all checked with the same rotation ranges. If items is
+// NULL, all rotations are checked, and work items are numbered location-major,
+// so item i is rotation (i % rotations_per_location) of location
+// (i / rotations_per_location). Otherwise, only the listed items are checked.
+typedef struct WorkerJob_s
+{
+	ResultObject* const* result_objects;
+	const Location* locations;
+	int num_of_locations;
+	const WorkItem* items;
+	long total_items;
+	int rotations_per_location;
+
+	int min_x;
+	int max_x;
+	int min_y;
+	int max_y;
+	int min_z;
+	int max_z;
+	int y_size;
+	int z_size;
+} WorkerJob;
 
 class CollisionManager
 {
@@ -11,17 +67,35 @@ public:
 	CollisionManager(const Model* m1, const Model* m2, const std::string& neuron_filename, int num_of_threads, int max_num_of_collisions,
 				   	 const std::string& output_directory, bool minimal_only, bool bound_checks, bool should_output_collisions,
 					 bool should_rotate);
+	CollisionManager(const CollisionManager&) = delete;
+	CollisionManager& operator=(const CollisionManager&) = delete;
 	~CollisionManager();
+	void set_neuron(const Model* m2, const std::string& neuron_filename);
+	void set_rotation_search(const std::vector<int>& steps, int num_of_candidates);
+	void set_metrics(RunMetrics* metrics);
+	void set_vascular_name(const std::string& vascular_name);
 	void check_all_collisions(int x_pos, int y_pos, int z_pos, char main_axis, const std::string& output_filename);
 	void check_all_collisions(const std::string& locations_filename, char main_axis, const std::string& output_filename);
 	void check_single_collision(int x_pos, int y_pos, int z_pos, int x_r, int y_r, int z_r);
+	std::unique_ptr<ResultObject> compute_location(int x_pos, int y_pos, int z_pos, char main_axis);
+	std::vector<std::unique_ptr<ResultObject>> compute_locations(const std::vector<Location>& locations, char main_axis);
 	const Model* m1() const;
 	const Model* m2() const;
 	std::string output_collision_points_single_collision(int x_pos, int y_pos, int z_pos, int x_r, int y_r, int z_r);
 	bool should_output_collisions() const;
 
 private:
-	void check_all_collisions_at_location(int x_pos, int y_pos, int z_pos, char main_axis, const std::string& output_filename);
+	void check_all_collisions_at_locations(const std::vector<Location>& locations, char main_axis, ResultWriter& writer);
+	BinaryResultsHeader results_header(char main_axis) const;
+	void start_workers();
+	void stop_workers();
+	void run_job();
+	void run_all_rotations(int num_of_locations);
+	void run_items(const std::vector<WorkItem>& items);
+	void run_coarse_to_fine(int num_of_locations);
+	void check_rotation(long item);
+	static void* worker_main(void* arg);
+	void worker_loop(int thread_id);
 
 private:
 	const Model * _m1;
@@ -31,7 +105,9 @@ private:
 	BoundingBox _fm1_bounding_box;
 	FclModelCPtr _fm2; // Neuron
 	Cube _fm2_cube;
+	std::unique_ptr<RotationTable> _rotation_table;
 	std::string _neuron_filename;
+	std::string _vascular_name;
 	std::string _output_directory;;
 	int _num_of_threads;
 	int _max_num_of_collisions;;
@@ -39,28 +115,24 @@ private:
 	bool _bound_checks = true;
 	bool _should_output_collision_files = true;
 	bool _should_rotate = true;
-};
-
-
-typedef struct thread_params
-{
-	ResultObject* result_object;
-	CollisionManager* collision_manager;
-	FclModelCPtr fm1; // Vascular
-	const BoundingBox* fm1_bounding_box;
-	FclModelCPtr fm2; // Neuron
-	const Cube * fm2_cube;
-	int x_pos;
-	int y_pos;
-	int z_pos;
-	int num_of_col;
-
-	int min_x;
-	int max_x;
-	int min_y;
-	int max_y;
-	int min_z;
-	int max_z;
+	// Coarse to fine rotation search: the angle steps of each level, and the
+	// number of best rotations refined in each level. No steps means checking
+	// all rotations.
+	std::vector<int> _rotation_steps;
+	int _num_of_candidates = 10;
+	RunMetrics* _metrics = NULL;
 
-	int thread_id;
-} thread_params_t;
+	// Worker pool, started on the first job and kept until destruction. Every
+	// job is split to single rotations, which the workers take from _next_item.
+	std::vector<pthread_t> _workers;
+	std::vector<thread_params_t> _workers_params;
+	pthread_mutex_t _job_lock;
+	pthread_mutex_t _pool_lock;
+	pthread_cond_t _job_ready;
+	pthread_cond_t _job_done;
+	unsigned _job_generation = 0;
+	int _busy_workers = 0;
+	bool _stop = false;
+	WorkerJob _job;
+	std::atomic<long> _next_item;
+};
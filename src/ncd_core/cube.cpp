@@ -1,4 +1,5 @@
 #include "cube.hpp"
+#include <math.h>
 
 Cube::Cube()
 {
@@ -41,6 +42,31 @@ Cube Cube::rotate_and_transform(const NativeMatrix& mat, int x, int y, int z) co
 	return c;
 }
 
+// Bounds of the rotated vertices, computed like rotate_and_transform does
+void Cube::rotated_bounds(const NativeMatrix& mat, double min[3], double max[3]) const
+{
+	for(int axis = 0; axis < 3; ++axis)
+	{
+		min[axis] = INFINITY;
+		max[axis] = -INFINITY;
+	}
+
+	for(int i = 0; i < _vertices.size(); ++i)
+	{
+		const Vec3f& vertex = _vertices[i];
+		for(int axis = 0; axis < 3; ++axis)
+		{
+			double value = mat.values[axis][0] * vertex[0] +
+						   mat.values[axis][1] * vertex[1] +
+						   mat.values[axis][2] * vertex[2];
+			if (value < min[axis])
+				min[axis] = value;
+			if (value > max[axis])
+				max[axis] = value;
+		}
+	}
+}
+
 bool Cube::is_contained(const BoundingBox* bb) const
 {
 	for(int i = 0; i < _vertices.size(); ++i)
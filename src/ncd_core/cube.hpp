@@ -11,6 +11,7 @@ public:
 	Cube(const BoundingBox& bb);
 
 	Cube rotate_and_transform(const NativeMatrix& mat, int x, int y, int z) const;
+	void rotated_bounds(const NativeMatrix& mat, double min[3], double max[3]) const;
 	bool is_contained(const BoundingBox* bb) const;
 
 private:
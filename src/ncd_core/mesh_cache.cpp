@@ -0,0 +1,156 @@
+#include "mesh_cache.hpp"
+#include "exception.hpp"
+#include "trace.hpp"
+#include <fcntl.h>
+#include <stdio.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+static const uint64_t FNV_OFFSET = 14695981039346656037ULL;
+static const uint64_t FNV_PRIME = 1099511628211ULL;
+
+// Maps a whole file read-only. Returns NULL for empty files.
+static const char* map_file(const std::string& filename, size_t* size)
+{
+	int fd = open(filename.c_str(), O_RDONLY);
+	if (fd < 0)
+		return NULL;
+	struct stat st;
+	if (fstat(fd, &st) != 0 || st.st_size == 0)
+	{
+		close(fd);
+		return NULL;
+	}
+	void* data = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+	close(fd);
+	if (data == MAP_FAILED)
+		return NULL;
+	*size = st.st_size;
+	return (const char*)data;
+}
+
+// FNV-1a over 64 bit words, which is fast enough to hash a few hundred MB
+// .obj file in well under a second.
+uint64_t hash_file(const std::string& filename)
+{
+	size_t size = 0;
+	const char* data = map_file(filename, &size);
+	if (data == NULL)
+		throw Exception("failed opening file for hashing");
+	madvise((void*)data, size, MADV_SEQUENTIAL);
+
+	uint64_t hash = FNV_OFFSET ^ size;
+	size_t i = 0;
+	for (; i + sizeof(uint64_t) <= size; i += sizeof(uint64_t))
+	{
+		uint64_t word;
+		memcpy(&word, data + i, sizeof(word));
+		hash = (hash ^ word) * FNV_PRIME;
+	}
+	for (; i < size; ++i)
+	{
+		hash = (hash ^ (unsigned char)data[i]) * FNV_PRIME;
+	}
+	munmap((void*)data, size);
+	return hash;
+}
+
+std::string mesh_cache_path(const std::string& cache_dir, uint64_t source_hash)
+{
+	char name[64];
+	snprintf(name, sizeof(name), "%016llx%s", (unsigned long long)source_hash, MESH_CACHE_SUFFIX);
+	return cache_dir + "/" + name;
+}
+
+bool load_mesh_cache(const std::string& cache_path, uint64_t source_hash,
+					 vector<Vec3f>& vertices, vector<Triangle>& triangles)
+{
+	size_t size = 0;
+	const char* data = map_file(cache_path, &size);
+	if (data == NULL)
+		return false;
+
+	MeshCacheHeader header;
+	bool valid = size >= sizeof(header);
+	if (valid)
+	{
+		memcpy(&header, data, sizeof(header));
+		valid = strncmp(header.magic, MESH_CACHE_MAGIC, sizeof(header.magic)) == 0 &&
+				header.version == MESH_CACHE_VERSION &&
+				header.source_hash == source_hash &&
+				size == sizeof(header) + header.num_of_vertices * 3 * sizeof(float) +
+						header.num_of_triangles * 3 * sizeof(int32_t);
+	}
+	if (!valid)
+	{
+		LOG_INFO("Ignoring invalid mesh cache %s\n", cache_path.c_str());
+		munmap((void*)data, size);
+		return false;
+	}
+
+	const float* v = (const float*)(data + sizeof(header));
+	const int32_t* t = (const int32_t*)(v + header.num_of_vertices * 3);
+	vertices.clear();
+	vertices.reserve(header.num_of_vertices);
+	for (uint64_t i = 0; i < header.num_of_vertices; ++i)
+	{
+		vertices.push_back(Vec3f(v[3 * i], v[3 * i + 1], v[3 * i + 2]));
+	}
+	triangles.clear();
+	triangles.reserve(header.num_of_triangles);
+	for (uint64_t i = 0; i < header.num_of_triangles; ++i)
+	{
+		triangles.push_back(Triangle(t[3 * i], t[3 * i + 1], t[3 * i + 2]));
+	}
+	munmap((void*)data, size);
+	return true;
+}
+
+void save_mesh_cache(const std::string& cache_path, uint64_t source_hash,
+					 const vector<Vec3f>& vertices, const vector<Triangle>& triangles)
+{
+	// Written to a temporary file and renamed, so concurrent runs never see
+	// a partial cache
+	std::string tmp_path = cache_path + ".tmp." + std::to_string(getpid());
+	FILE* f = fopen(tmp_path.c_str(), "wb");
+	if (f == NULL)
+	{
+		LOG_INFO("Can't create mesh cache %s, continuing without it\n", cache_path.c_str());
+		return;
+	}
+
+	MeshCacheHeader header = {};
+	strncpy(header.magic, MESH_CACHE_MAGIC, sizeof(header.magic));
+	header.version = MESH_CACHE_VERSION;
+	header.source_hash = source_hash;
+	header.num_of_vertices = vertices.size();
+	header.num_of_triangles = triangles.size();
+	bool ok = fwrite(&header, sizeof(header), 1, f) == 1;
+
+	vector<float> v_buff(vertices.size() * 3);
+	for (size_t i = 0; i < vertices.size(); ++i)
+	{
+		v_buff[3 * i] = vertices[i][0];
+		v_buff[3 * i + 1] = vertices[i][1];
+		v_buff[3 * i + 2] = vertices[i][2];
+	}
+	ok = ok && fwrite(v_buff.data(), sizeof(float), v_buff.size(), f) == v_buff.size();
+
+	vector<int32_t> t_buff(triangles.size() * 3);
+	for (size_t i = 0; i < triangles.size(); ++i)
+	{
+		t_buff[3 * i] = triangles[i][0];
+		t_buff[3 * i + 1] = triangles[i][1];
+		t_buff[3 * i + 2] = triangles[i][2];
+	}
+	ok = ok && fwrite(t_buff.data(), sizeof(int32_t), t_buff.size(), f) == t_buff.size();
+
+	ok = (fclose(f) == 0) && ok;
+	if (!ok || rename(tmp_path.c_str(), cache_path.c_str()) != 0)
+	{
+		LOG_INFO("Failed writing mesh cache %s, continuing without it\n", cache_path.c_str());
+		unlink(tmp_path.c_str());
+	}
+}
@@ -0,0 +1,34 @@
+#pragma once
+
+#include <stdint.h>
+#include <string>
+
+#include "fcl.hpp"
+
+// A binary copy of a parsed .obj file, so that big meshes (mainly the
+// vasculature) are only parsed once. The cache file is named after the hash
+// of the .obj file's contents, so an edited .obj file never hits a stale cache.
+//
+// File layout: MeshCacheHeader, then num_of_vertices * 3 floats, then
+// num_of_triangles * 3 int32 vertex indices.
+
+#define MESH_CACHE_MAGIC "NCDMESH"
+#define MESH_CACHE_VERSION 1
+#define MESH_CACHE_SUFFIX ".ncdmesh"
+
+typedef struct MeshCacheHeader_s
+{
+	char magic[8];
+	uint32_t version;
+	uint32_t reserved;
+	uint64_t source_hash;
+	uint64_t num_of_vertices;
+	uint64_t num_of_triangles;
+} MeshCacheHeader;
+
+uint64_t hash_file(const std::string& filename);
+std::string mesh_cache_path(const std::string& cache_dir, uint64_t source_hash);
+bool load_mesh_cache(const std::string& cache_path, uint64_t source_hash,
+					 vector<Vec3f>& vertices, vector<Triangle>& triangles);
+void save_mesh_cache(const std::string& cache_path, uint64_t source_hash,
+					 const vector<Vec3f>& vertices, const vector<Triangle>& triangles);
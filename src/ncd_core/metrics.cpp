@@ -0,0 +1,196 @@
+#include "metrics.hpp"
+#include "trace.hpp"
+#include <stdio.h>
+#include <unistd.h>
+#include <algorithm>
+
+RunMetrics::RunMetrics(const std::string& metrics_filename)
+:_metrics_filename(metrics_filename),
+_expected_locations(0),
+_locations_done(0),
+_rotations_checked(0),
+_collide_calls(0),
+_oob_culled(0),
+_batch_locations(0),
+_batch_stages(0),
+_stages_done(0),
+_stage_items(0),
+_stage_items_done(0),
+_last_fraction(0),
+_next_report_sec(METRICS_REPORT_INTERVAL)
+{
+	clock_gettime(CLOCK_MONOTONIC, &_start_time);
+	pthread_mutex_init(&_report_lock, NULL);
+}
+
+RunMetrics::~RunMetrics()
+{
+	pthread_mutex_destroy(&_report_lock);
+}
+
+void RunMetrics::expect_locations(long amount)
+{
+	_expected_locations += amount;
+}
+
+// Called between batches, when no worker reports
+void RunMetrics::set_neuron(const std::string& neuron_name)
+{
+	pthread_mutex_lock(&_report_lock);
+	_neuron_name = neuron_name;
+	pthread_mutex_unlock(&_report_lock);
+}
+
+void RunMetrics::start_batch(int num_of_locations, int num_of_stages)
+{
+	_stage_items = 0;
+	_stage_items_done = 0;
+	_stages_done = 0;
+	_batch_stages = num_of_stages;
+	_batch_locations = num_of_locations;
+}
+
+// Called between stages, so the previous stage, if any, is done
+void RunMetrics::start_stage(long num_of_items)
+{
+	if (_stage_items.load() > 0)
+		_stages_done++;
+	_stage_items_done = 0;
+	_stage_items = num_of_items;
+}
+
+void RunMetrics::rotation_checked(bool is_contained)
+{
+	_rotations_checked++;
+	if (is_contained)
+		_collide_calls++;
+	else
+		_oob_culled++;
+	_stage_items_done++;
+}
+
+void RunMetrics::locations_done(int amount)
+{
+	_batch_locations = 0;
+	_locations_done += amount;
+}
+
+// Reports if the report interval passed. Only the thread which moves the next
+// report time reports, the others return at once.
+void RunMetrics::maybe_report()
+{
+	long next_report_sec = _next_report_sec.load();
+	double now = elapsed();
+	if (now < next_report_sec)
+		return;
+	if (!_next_report_sec.compare_exchange_strong(next_report_sec, (long)now + METRICS_REPORT_INTERVAL))
+		return;
+	report(false);
+}
+
+double RunMetrics::elapsed() const
+{
+	struct timespec now;
+	clock_gettime(CLOCK_MONOTONIC, &now);
+	return (now.tv_sec - _start_time.tv_sec) + (now.tv_nsec - _start_time.tv_nsec) / 1e9;
+}
+
+// Done locations, plus the done part of the current batch
+double RunMetrics::fraction_done() const
+{
+	long expected_locations = _expected_locations.load();
+	if (expected_locations <= 0)
+		return 0;
+	double locations = _locations_done.load();
+	int batch_stages = _batch_stages.load();
+	long stage_items = _stage_items.load();
+	if (batch_stages > 0)
+	{
+		double stages = _stages_done.load();
+		if (stage_items > 0)
+			stages += std::min(1.0, (double)_stage_items_done.load() / stage_items);
+		locations += _batch_locations.load() * std::min(1.0, stages / batch_stages);
+	}
+	return std::min(1.0, locations / expected_locations);
+}
+
+void RunMetrics::report(bool is_done)
+{
+	double elapsed_sec = std::max(elapsed(), 1e-3);
+	long rotations = _rotations_checked.load();
+	long collide_calls = _collide_calls.load();
+	long oob_culled = _oob_culled.load();
+
+	pthread_mutex_lock(&_report_lock);
+	double fraction = is_done ? 1 : std::max(fraction_done(), _last_fraction);
+	_last_fraction = fraction;
+	double eta_sec = fraction > 0 ? elapsed_sec / fraction - elapsed_sec : -1;
+	char eta[32];
+	if (eta_sec < 0)
+		snprintf(eta, sizeof(eta), "unknown");
+	else
+		snprintf(eta, sizeof(eta), "%lim%02lis", (long)eta_sec / 60, (long)eta_sec % 60);
+	LOG_INFO("Progress: %.1f%% (%li/%li locations), %.0f rotations/s, %.0f collide calls/s, %.1f%% culled by bounds, ETA %s\n",
+			 fraction * 100, _locations_done.load(), _expected_locations.load(),
+			 rotations / elapsed_sec, collide_calls / elapsed_sec,
+			 rotations > 0 ? 100.0 * oob_culled / rotations : 0.0, eta);
+	if (!_metrics_filename.empty())
+		write_metrics_file(is_done, fraction, elapsed_sec, eta_sec);
+	pthread_mutex_unlock(&_report_lock);
+}
+
+// Escapes a string for a JSON string literal
+static std::string json_escape(const std::string& str)
+{
+	std::string escaped;
+	for (size_t i = 0; i < str.size(); ++i)
+	{
+		unsigned char c = str[i];
+		if (c == '"' || c == '\\')
+		{
+			escaped += '\\';
+			escaped += c;
+		}
+		else if (c < 0x20)
+		{
+			char code[8];
+			snprintf(code, sizeof(code), "\\u%04x", c);
+			escaped += code;
+		}
+		else
+		{
+			escaped += c;
+		}
+	}
+	return escaped;
+}
+
+// Written to a temporary file and renamed, so a poller never reads a partial file
+void RunMetrics::write_metrics_file(bool is_done, double fraction, double elapsed_sec, double eta_sec)
+{
+	std::string tmp_filename = _metrics_filename + ".tmp";
+	FILE* f = fopen(tmp_filename.c_str(), "w");
+	if (f == NULL)
+	{
+		LOG_ERROR("Failed opening metrics file %s\n", tmp_filename.c_str());
+		return;
+	}
+
+	long rotations = _rotations_checked.load();
+	fprintf(f, "{\"done\": %s, \"neuron\": \"%s\", \"pid\": %i, "
+			   "\"locations_done\": %li, \"locations_expected\": %li, \"fraction_done\": %.4f, "
+			   "\"rotations\": %li, \"collide_calls\": %li, \"oob_culled\": %li, "
+			   "\"rotations_per_sec\": %.1f, \"collide_calls_per_sec\": %.1f, \"oob_ratio\": %.4f, "
+			   "\"elapsed_sec\": %.1f, \"eta_sec\": %.1f}\n",
+			is_done ? "true" : "false", json_escape(_neuron_name).c_str(), (int)getpid(),
+			_locations_done.load(), _expected_locations.load(), fraction,
+			rotations, _collide_calls.load(), _oob_culled.load(),
+			rotations / elapsed_sec, _collide_calls.load() / elapsed_sec,
+			rotations > 0 ? (double)_oob_culled.load() / rotations : 0.0,
+			elapsed_sec, eta_sec);
+	bool ok = fclose(f) == 0;
+	if (!ok || rename(tmp_filename.c_str(), _metrics_filename.c_str()) != 0)
+	{
+		LOG_ERROR("Failed writing metrics file %s\n", _metrics_filename.c_str());
+	}
+}
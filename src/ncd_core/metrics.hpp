@@ -0,0 +1,60 @@
+#pragma once
+
+#include <atomic>
+#include <pthread.h>
+#include <string>
+#include <time.h>
+
+// Seconds between progress reports
+#define METRICS_REPORT_INTERVAL 10
+
+// Progress and throughput of a run, updated by all worker threads. Counters are
+// atomic, and one of the workers reports them every METRICS_REPORT_INTERVAL
+// seconds: to the log, and optionally to a JSON file which a scheduler can poll.
+class RunMetrics
+{
+public:
+	RunMetrics(const std::string& metrics_filename);
+	~RunMetrics();
+
+	void expect_locations(long amount);
+	void set_neuron(const std::string& neuron_name);
+	void start_batch(int num_of_locations, int num_of_stages);
+	void start_stage(long num_of_items);
+	void rotation_checked(bool is_contained);
+	void locations_done(int amount);
+	void maybe_report();
+	void report(bool is_done);
+
+private:
+	double elapsed() const;
+	double fraction_done() const;
+	void write_metrics_file(bool is_done, double fraction, double elapsed_sec, double eta_sec);
+
+private:
+	std::string _metrics_filename;
+	std::string _neuron_name;
+	struct timespec _start_time;
+
+	std::atomic<long> _expected_locations;
+	std::atomic<long> _locations_done;
+	std::atomic<long> _rotations_checked;
+	std::atomic<long> _collide_calls;
+	std::atomic<long> _oob_culled;
+
+	// Progress within the batch of locations which is being checked. A batch is
+	// checked in stages - one, or one per level of the coarse to fine search -
+	// and each stage counts for an equal part of the batch.
+	std::atomic<int> _batch_locations;
+	std::atomic<int> _batch_stages;
+	std::atomic<int> _stages_done;
+	std::atomic<long> _stage_items;
+	std::atomic<long> _stage_items_done;
+
+	// Guarded by _report_lock. Keeps the reported progress from going back when
+	// a report reads the counters while a stage starts.
+	double _last_fraction;
+
+	std::atomic<long> _next_report_sec;
+	pthread_mutex_t _report_lock;
+};
@@ -1,4 +1,5 @@
 #include "model.hpp"
+#include "mesh_cache.hpp"
 #include "exception.hpp"
 #include "trace.hpp"
 
@@ -11,11 +12,48 @@ Model::Model(const std::string& obj_filename)
 	read_from_file(obj_filename);
 }
 
+// Same as Model(obj_filename), but goes through a binary copy of the parsed
+// file in cache_dir, creating it if needed. An empty cache_dir disables the cache.
+std::shared_ptr<Model> Model::load_obj(const std::string& obj_filename, const std::string& cache_dir)
+{
+	if (cache_dir.empty())
+	{
+		return std::shared_ptr<Model>(new Model(obj_filename));
+	}
+
+	std::shared_ptr<Model> model(new Model());
+	uint64_t source_hash = hash_file(obj_filename);
+	std::string cache_path = mesh_cache_path(cache_dir, source_hash);
+	if (load_mesh_cache(cache_path, source_hash, model->_vertices, model->_triangles))
+	{
+		LOG_TRACE("Loaded %s from mesh cache %s\n", obj_filename.c_str(), cache_path.c_str());
+		return model;
+	}
+	model->read_from_file(obj_filename);
+	save_mesh_cache(cache_path, source_hash, model->_vertices, model->_triangles);
+	return model;
+}
+
 Model::Model(const std::string& vertices_filename, const std::string& triangles_filename)
 {
 	read_from_file(vertices_filename, triangles_filename);
 }
 
+// vertices and triangles are row-major (N, 3) buffers, e.g. NumPy arrays
+Model::Model(const float* vertices, size_t num_of_vertices, const int* triangles, size_t num_of_triangles)
+{
+	_vertices.reserve(num_of_vertices);
+	for(size_t i = 0; i < num_of_vertices; ++i)
+	{
+		add_ver(vertices[3 * i], vertices[3 * i + 1], vertices[3 * i + 2]);
+	}
+	_triangles.reserve(num_of_triangles);
+	for(size_t i = 0; i < num_of_triangles; ++i)
+	{
+		add_triangle(triangles[3 * i], triangles[3 * i + 1], triangles[3 * i + 2]);
+	}
+}
+
 Model::Model(const Model& other)
 {
 	for(int i = 0; i < other._vertices.size(); ++i)
@@ -281,6 +319,16 @@ BoundingBox Model::get_bounding_box() const
 	return res;
 }
 
+const vector<Vec3f>& Model::vertices() const
+{
+	return _vertices;
+}
+
+const vector<Triangle>& Model::triangles() const
+{
+	return _triangles;
+}
+
 Model Model::get_sub_model(const BoundingBox& bb) const
 {
 	Model res;
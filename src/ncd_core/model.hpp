@@ -12,8 +12,11 @@ public:
 	Model();
 	Model(const std::string& vertices_filename, const std::string& triangles_filename);
 	Model(const std::string& obj_filename);
+	// Copies the (num_of_vertices, 3) and (num_of_triangles, 3) buffers
+	Model(const float* vertices, size_t num_of_vertices, const int* triangles, size_t num_of_triangles);
 	Model(const Model& other);
 	~Model();
+	static std::shared_ptr<Model> load_obj(const std::string& obj_filename, const std::string& cache_dir);
 
 	FclModelCPtr fcl_model() const;
 	void dump_to_file(const std::string& output_filename) const;
@@ -24,6 +27,8 @@ public:
 	BoundingBox get_bounding_box() const;
 	Model get_bounding_cube() const;
 	Model get_sub_model(const BoundingBox& bb) const;
+	const vector<Vec3f>& vertices() const;
+	const vector<Triangle>& triangles() const;
 
 private:
 	void read_from_file(const std::string& vertices_filename, const std::string& triangles_filename);
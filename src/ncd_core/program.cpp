@@ -1,6 +1,7 @@
 #include "program.hpp"
 #include "model.hpp"
 #include "collision_manager.hpp"
+#include "metrics.hpp"
 #include "exception.hpp"
 #include "trace.hpp"
 #include <getopt.h>
@@ -21,9 +22,9 @@ Program::~Program()
 }
 
 
-ModelPtr create_obj_model(char* path)
+ModelPtr create_obj_model(char* path, char* cache_dir)
 {
-	return ModelPtr(new Model(path));
+	return Model::load_obj(path, cache_dir);
 }
 
 std::string get_file_name_from_path(const std::string& path)
@@ -36,15 +37,123 @@ std::string get_file_name_from_path(const std::string& path)
 }
 
 
+typedef struct ManifestEntry_s
+{
+	std::string neural_path;
+	std::string input_file;
+	std::string output_file;
+} ManifestEntry;
+
+// Each line of a manifest is "<neuron .obj>,<locations file>,<output file>".
+// Empty lines and lines starting with '#' are skipped.
+static std::vector<ManifestEntry> read_manifest(const char* manifest_path)
+{
+	FILE* f = fopen(manifest_path, "r");
+	if (f == NULL)
+	{
+		throw Exception("failed opening manifest file");
+	}
+
+	std::vector<ManifestEntry> entries;
+	char line[3 * PATH_MAX + 8];
+	while (fgets(line, sizeof(line), f) != NULL)
+	{
+		line[strcspn(line, "\r\n")] = '\0';
+		if (line[0] == '\0' || line[0] == '#')
+			continue;
+
+		char* first_coma = strchr(line, ',');
+		char* second_coma = first_coma == NULL ? NULL : strchr(first_coma + 1, ',');
+		if (second_coma == NULL)
+		{
+			fclose(f);
+			throw Exception("Invalid manifest line format");
+		}
+		*first_coma = '\0';
+		*second_coma = '\0';
+
+		ManifestEntry entry;
+		entry.neural_path = line;
+		entry.input_file = first_coma + 1;
+		entry.output_file = second_coma + 1;
+		entries.push_back(entry);
+	}
+	fclose(f);
+
+	if (entries.empty())
+		throw Exception("Manifest file is empty");
+	return entries;
+}
+
+static long count_locations(const char* locations_filename)
+{
+	FILE * f = fopen(locations_filename, "r");
+	if (f == NULL)
+	{
+		throw Exception("failed opening locations file");
+	}
+
+	long num_of_locations = 0;
+	int x, y, z;
+	while (fscanf(f, "%i,%i,%i\n", &x, &y, &z) > 0)
+	{
+		num_of_locations++;
+	}
+	fclose(f);
+	return num_of_locations;
+}
+
+// Runs batch mode for every neuron in the manifest, against a single vascular
+// model, so that the vascular model is loaded and its BVH built only once
+void Program::run_manifest(const Model* vascular_model, RunMetrics* metrics)
+{
+	std::vector<ManifestEntry> entries = read_manifest(_input_file);
+	for (size_t i = 0; i < entries.size(); ++i)
+	{
+		metrics->expect_locations(count_locations(entries[i].input_file.c_str()));
+	}
+	// The manager keeps a raw pointer to the current neuron, so the neuron is
+	// declared first, to outlive the manager, and is only replaced after the
+	// manager moved on to the next one
+	ModelPtr neural_model;
+	std::unique_ptr<CollisionManager> collision_manager;
+	for (size_t i = 0; i < entries.size(); ++i)
+	{
+		const ManifestEntry& entry = entries[i];
+		LOG_INFO("Neuron %i/%i: %s\n", (int)i + 1, (int)entries.size(), entry.neural_path.c_str());
+		ModelPtr next_neural_model = Model::load_obj(entry.neural_path, _mesh_cache_dir);
+		next_neural_model->print_stats();
+
+		std::string neuron_name = get_file_name_from_path(entry.neural_path);
+		if (!collision_manager)
+		{
+			collision_manager.reset(new CollisionManager(vascular_model, &*next_neural_model, neuron_name, _num_of_threads, _num_of_collisions, _output_directory, _minimal_only, _bound_checks, _should_output_collisions, _should_rotate));
+			collision_manager->set_rotation_search(_rotation_steps, _num_of_candidates);
+			collision_manager->set_metrics(metrics);
+			collision_manager->set_vascular_name(get_file_name_from_path(_vascular_path));
+		}
+		else
+		{
+			collision_manager->set_neuron(&*next_neural_model, neuron_name);
+		}
+		neural_model = next_neural_model;
+
+		// Ignore ret value
+		unlink(entry.output_file.c_str());
+		collision_manager->check_all_collisions(entry.input_file, _main_axis, entry.output_file);
+	}
+}
+
 void Program::logic()
 {
 	ModelPtr vascular_model;
 	ModelPtr neural_model;
-	vascular_model = create_obj_model(_vascular_path);
-	neural_model = create_obj_model(_neural_path);
-
+	if (strlen(_mesh_cache_dir) > 0)
+	{
+		mkdir(_mesh_cache_dir, 0700);
+	}
+	vascular_model = create_obj_model(_vascular_path, _mesh_cache_dir);
 	vascular_model->print_stats();
-	neural_model->print_stats();
 
 	struct stat st = {0};
 	if (stat(_output_directory, &st) == -1)
@@ -52,7 +161,23 @@ void Program::logic()
 		LOG_INFO("Creating output directory\n");
 		mkdir(_output_directory, 0700);
 	}
+
+	RunMetrics metrics(_metrics_file);
+	if (_mode == MODE__MANIFEST)
+	{
+		run_manifest(&*vascular_model, &metrics);
+		metrics.report(true);
+		LOG_INFO("Total run time: %i minutes\n", (time(NULL) - _start_time) / 60);
+		return;
+	}
+
+	neural_model = create_obj_model(_neural_path, _mesh_cache_dir);
+	neural_model->print_stats();
+
 	CollisionManager collision_manager(&*vascular_model, &*neural_model, get_file_name_from_path(_neural_path), _num_of_threads, _num_of_collisions, _output_directory, _minimal_only, _bound_checks, _should_output_collisions, _should_rotate);
+	collision_manager.set_rotation_search(_rotation_steps, _num_of_candidates);
+	collision_manager.set_metrics(&metrics);
+	collision_manager.set_vascular_name(get_file_name_from_path(_vascular_path));
 	if (_mode == MODE__VERIFY)
 	{
 		collision_manager.check_single_collision(_x, _y, _z, _r_x, _r_y, _r_z);
@@ -63,12 +188,15 @@ void Program::logic()
 		unlink(_output_file);
 		if (_mode == MODE__REGULAR)
 		{
+			metrics.expect_locations(1);
 			collision_manager.check_all_collisions(_x, _y, _z, _main_axis, _output_file);
 		}
 		else if (_mode == MODE__BATCH)
 		{
+			metrics.expect_locations(count_locations(_input_file));
 			collision_manager.check_all_collisions(_input_file, _main_axis, _output_file);
 		}
+		metrics.report(true);
 	}
 
 	LOG_INFO("Total run time: %i minutes\n", (time(NULL) - _start_time) / 60);
@@ -78,7 +206,7 @@ void Program::verify_args()
 {
 	if (strlen(_vascular_path) == 0)
 		throw Exception("Vascular path must be set");
-	if (strlen(_neural_path) == 0)
+	if (strlen(_neural_path) == 0 && _mode != MODE__MANIFEST)
 		throw Exception("Neural path must be set");
 	switch(_mode)
 	{
@@ -109,6 +237,17 @@ void Program::verify_args()
 			throw Exception("-l can't be used in batch mode");
 		break;
 
+	case MODE__MANIFEST:
+		if (strlen(_input_file) == 0)
+			throw Exception("Manifest file path (-i) must be set in manifest mode");
+		if (strlen(_neural_path) != 0)
+			throw Exception("-N can't be used in manifest mode, neurons are read from the manifest");
+		if (strlen(_output_file) != 0)
+			throw Exception("-f can't be used in manifest mode, output files are read from the manifest");
+		if (_x != 0 || _y != 0 || _z != 0)
+			throw Exception("-l can't be used in manifest mode");
+		break;
+
 	default:
 		throw Exception("Unknown mode");
 	}
@@ -121,6 +260,14 @@ void Program::verify_args()
 
 	if (_main_axis != 'x' && _main_axis != 'y' && _main_axis != 'z')
 		throw Exception("Main axis must be one of x, y, z");
+
+	for (size_t i = 0; i < _rotation_steps.size(); ++i)
+	{
+		if (_rotation_steps[i] <= 0 || (i > 0 && _rotation_steps[i] >= _rotation_steps[i - 1]))
+			throw Exception("Rotation steps must be positive and decreasing");
+	}
+	if (_num_of_candidates <= 0)
+		throw Exception("Number of refined rotations must be positive");
 }
 
 void Program::parse_args(int argc, char** argv)
@@ -144,10 +291,14 @@ void Program::parse_args(int argc, char** argv)
 			{"minimal-only", required_argument, 0, 'z'},
 			{"bound-checks", required_argument, 0, 'b'},
 			{"should-output-collisions", required_argument, 0, 's'},
+			{"mesh-cache-dir", required_argument, 0, 'k'},
+			{"rotation-steps", required_argument, 0, 'g'},
+			{"refine-candidates", required_argument, 0, 'K'},
+			{"progress-file", required_argument, 0, 'p'},
 			{0, 0, 0, 0}
 		};
 
-		c = getopt_long(argc, argv, "f:V:N:t:i:c:qzbsvnl:m:r:o:h", long_options, &option_index);
+		c = getopt_long(argc, argv, "f:V:N:t:i:c:k:g:K:p:qzbsvnl:m:r:o:h", long_options, &option_index);
 		if (c == -1)
 			break;
 
@@ -171,6 +322,18 @@ void Program::parse_args(int argc, char** argv)
 		case 'i':
 			strncpy(_input_file, optarg, PATH_MAX);
 			break;
+		case 'k':
+			strncpy(_mesh_cache_dir, optarg, PATH_MAX);
+			break;
+		case 'g':
+			parse_steps(optarg);
+			break;
+		case 'K':
+			_num_of_candidates = atoi(optarg);
+			break;
+		case 'p':
+			strncpy(_metrics_file, optarg, PATH_MAX);
+			break;
 		case 'l':
 			parse_triplet(optarg, &_x, &_y, &_z);
 			break;
@@ -181,6 +344,8 @@ void Program::parse_args(int argc, char** argv)
 				_mode = MODE__VERIFY;
 			else if (strcmp(optarg, "batch") == 0)
 				_mode = MODE__BATCH;
+			else if (strcmp(optarg, "manifest") == 0)
+				_mode = MODE__MANIFEST;
 			break;
 		case 'a':
 			_main_axis = optarg[0];
@@ -237,25 +402,43 @@ void Program::parse_triplet(char* optarg, int* a, int* b, int* c)
 	*c = atoi(second_coma + 1);
 }
 
+void Program::parse_steps(char* optarg)
+{
+	char param[128];
+	strncpy(param, optarg, sizeof(param) - 1);
+	param[sizeof(param) - 1] = '\0';
+	_rotation_steps.clear();
+	for (char* step = strtok(param, ","); step != NULL; step = strtok(NULL, ","))
+	{
+		_rotation_steps.push_back(atoi(step));
+	}
+	if (_rotation_steps.empty())
+		throw Exception("Invalid rotation steps format");
+}
+
 void Program::print_usage()
 {
 	printf("Usage: ./ncd [OPTIONS]\n");
 	printf("\t-h, --help\t\tPrint this help and exit\n");
-	printf("\t-m, --mode\t\tRunning mode [regular, verify, batch]\n");
+	printf("\t-m, --mode\t\tRunning mode [regular, verify, batch, manifest]\n");
 	printf("\t-V, --vascular-path\tPath to vascular data directory\n");
 	printf("\t-N, --neural-path\tPath to neural data directory\n");
 	printf("\t-t, --threads\t\tNumber of threads to use, between 1-360 [default - 10]\n");
 	printf("\t-a, --main-axis\t\tMain axis for rotation [default - z]\n");
 	printf("\t-o, --output-directory\tOutput directory\n");
-	printf("\t-f, --output-file\tOutput filename [Regular/Batch mode]\n");
+	printf("\t-f, --output-file\tOutput filename, binary if it ends with .ncdr [Regular/Batch mode]\n");
 	printf("\t-r, --rotation\t\tRotation [x,y,z] [Verify mode]\n");
-	printf("\t-i, --input-file\tInput file of locations [Batch mode]\n");
+	printf("\t-i, --input-file\tInput file of locations [Batch mode], or manifest of neuron,locations,output lines [Manifest mode]\n");
 	printf("\t-l, --location\t\tLocation of neuron [Regular/Verify mode]\n");
 	printf("\t-c, --collisions\tNumber of maximum collisions to check [default - 2000]\n");
 	printf("\t-z, --minimal-only\tStore only minimal rotations in output file [Regular/Batch mode]\n");
 	printf("\t-b, --bound-checks\tDon't eliminate results with bounds violation [Regular/Batch mode] [default - eliminate]\n");
 	printf("\t-s, --output-collisions\tOutput files containing the collision points [Regular/Batch mode] [default - don't output]\n");
 	printf("\t-n, --no-rotation\tDon't rotate the neuron [default - rotate]\n");
+	printf("\t-g, --rotation-steps\tCoarse to fine rotation search with these angle steps, e.g. 10,3,1 [default - check all rotations]\n");
+	printf("\t-K, --refine-candidates\tNumber of best rotations refined in each level of the rotation search [default - 10]\n");
+	printf("\t-p, --progress-file\tKeep a JSON file with the progress and throughput of the run updated [Regular/Batch/Manifest mode]\n");
+	printf("\t-k, --mesh-cache-dir\tKeep binary copies of the parsed .obj files in this directory [default - no cache]\n");
 	printf("\t-v\t\t\tverbose (can use multiple times)\n");
 	printf("\t-q\t\t\tquiet\n");
 }
@@ -2,6 +2,10 @@
 
 #include <linux/limits.h>
 #include <time.h>
+#include <vector>
+
+class Model;
+class RunMetrics;
 
 
 typedef enum RunningMode_e
@@ -9,6 +13,7 @@ typedef enum RunningMode_e
 	MODE__REGULAR,
 	MODE__VERIFY,
 	MODE__BATCH,
+	MODE__MANIFEST,
 	MODE__NOMODE,
 } RunningMode;
 
@@ -25,6 +30,8 @@ private:
 	void verify_args();
 	void print_usage();
 	void parse_triplet(char* optarg, int* a, int* b, int* c);
+	void parse_steps(char* optarg);
+	void run_manifest(const Model* vascular_model, RunMetrics* metrics);
 
 private:
 	char _vascular_path[PATH_MAX] = {0};
@@ -32,6 +39,8 @@ private:
 	char _output_file[PATH_MAX] = {0};
 	char _output_directory[PATH_MAX] = {0};
 	char _input_file[PATH_MAX] = {0};
+	char _mesh_cache_dir[PATH_MAX] = {0};
+	char _metrics_file[PATH_MAX] = {0};
 	int _x = 0;
 	int _y = 0;
 	int _z = 0;
@@ -46,6 +55,8 @@ private:
 	bool _bound_checks = true;
 	bool _should_output_collisions = false;
 	bool _should_rotate = true;
+	std::vector<int> _rotation_steps;
+	int _num_of_candidates = 10;
 	RunningMode _mode = MODE__NOMODE;
 
 	time_t _start_time;
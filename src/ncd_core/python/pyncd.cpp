@@ -0,0 +1,185 @@
+// Python bindings for the ncd collision engine.
+//
+// Exposes Model, CollisionManager and Collision::check_a_collision so that
+// the Python pipeline can run collision checks in-process, on NumPy arrays,
+// instead of running the ncd binary and parsing its text output.
+
+#include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
+#include <pybind11/stl.h>
+
+#include "../model.hpp"
+#include "../collision.hpp"
+#include "../collision_manager.hpp"
+#include "../exception.hpp"
+#include "../trace.hpp"
+
+namespace py = pybind11;
+
+typedef py::array_t<float, py::array::c_style | py::array::forcecast> FloatArray;
+typedef py::array_t<int, py::array::c_style | py::array::forcecast> IntArray;
+
+// FCL models are immutable once built, so they're shared between Python objects.
+struct PyFclModel
+{
+	FclModelCPtr model;
+};
+
+static void check_shape(const py::buffer_info& info, const char* name)
+{
+	if (info.ndim != 2 || info.shape[1] != 3)
+	{
+		throw std::invalid_argument(std::string(name) + " must be an (N, 3) array");
+	}
+}
+
+static Model* model_from_arrays(FloatArray vertices, IntArray triangles)
+{
+	py::buffer_info v_info = vertices.request();
+	py::buffer_info t_info = triangles.request();
+	check_shape(v_info, "vertices");
+	check_shape(t_info, "triangles");
+	// FCL doesn't check the indices, so a bad one would read out of bounds
+	const int* indices = static_cast<const int*>(t_info.ptr);
+	for (py::ssize_t i = 0; i < 3 * t_info.shape[0]; ++i)
+	{
+		if (indices[i] < 0 || indices[i] >= v_info.shape[0])
+		{
+			throw py::value_error("triangles index " + std::to_string(indices[i]) + " is out of range for " +
+								  std::to_string(v_info.shape[0]) + " vertices");
+		}
+	}
+	// The mesh is copied twice: Model copies the arrays into its own vectors,
+	// and FCL copies those when it builds the BVH. Only the conversion to
+	// contiguous float32/int32 arrays is skipped when they already are.
+	return new Model(static_cast<const float*>(v_info.ptr), v_info.shape[0],
+					 static_cast<const int*>(t_info.ptr), t_info.shape[0]);
+}
+
+static py::array_t<float> points_to_array(const PointsVector& points, size_t num_of_points)
+{
+	py::array_t<float> res({num_of_points, (size_t)3});
+	auto view = res.mutable_unchecked<2>();
+	for (size_t i = 0; i < num_of_points; ++i)
+	{
+		view(i, 0) = points[i][0];
+		view(i, 1) = points[i][1];
+		view(i, 2) = points[i][2];
+	}
+	return res;
+}
+
+static void collect_result(void* arg, SingleResultCallbackParam* params)
+{
+	std::vector<int>* rows = (std::vector<int>*)arg;
+	rows->push_back(params->r_x);
+	rows->push_back(params->r_y);
+	rows->push_back(params->r_z);
+	rows->push_back(params->single_result->num_of_collisions);
+	rows->push_back(params->single_result->is_min);
+}
+
+// Runs all rotations at a location and returns an (N, 5) int32 array of
+// r_x, r_y, r_z, num_of_collisions, is_min - the same values the ncd binary
+// writes for each rotation.
+static py::array_t<int> check_location(CollisionManager& cm, int x, int y, int z, char main_axis)
+{
+	std::vector<int> rows;
+	{
+		py::gil_scoped_release release;
+		std::unique_ptr<ResultObject> res = cm.compute_location(x, y, z, main_axis);
+		res->for_each_result(collect_result, (void*)&rows);
+	}
+	py::array_t<int> arr({rows.size() / 5, (size_t)5});
+	std::copy(rows.begin(), rows.end(), arr.mutable_data());
+	return arr;
+}
+
+static py::object check_a_collision(const PyFclModel& vascular, const PyFclModel& neuron,
+									std::array<int, 3> location, std::array<int, 3> rotation,
+									int max_num_of_collisions, bool return_points)
+{
+	PointsVector points;
+	int num_of_collisions;
+	{
+		py::gil_scoped_release release;
+		num_of_collisions = Collision::check_a_collision(vascular.model, neuron.model,
+														 location[0], location[1], location[2],
+														 rotation[0], rotation[1], rotation[2],
+														 max_num_of_collisions, return_points ? &points : NULL);
+	}
+	if (!return_points)
+		return py::int_(num_of_collisions);
+	return py::make_tuple(num_of_collisions, points_to_array(points, num_of_collisions));
+}
+
+PYBIND11_MODULE(pyncd, m)
+{
+	m.doc() = "In-process bindings for the ncd collision engine";
+
+	py::register_exception_translator([](std::exception_ptr p) {
+		try
+		{
+			if (p) std::rethrow_exception(p);
+		}
+		catch (const Exception& exp)
+		{
+			PyErr_SetString(PyExc_RuntimeError, exp.msg().c_str());
+		}
+	});
+
+	m.def("set_verbosity", &set_verbosity, py::arg("verbose"));
+
+	py::class_<PyFclModel>(m, "FclModel");
+
+	py::class_<Model, std::shared_ptr<Model>>(m, "Model")
+		.def(py::init(&Model::load_obj), py::arg("obj_filename"), py::arg("cache_dir") = "")
+		.def(py::init(&model_from_arrays), py::arg("vertices"), py::arg("triangles"),
+			 "A model of (N, 3) vertices and (M, 3) triangle indices. The arrays are copied, "
+			 "so they can be changed or freed afterwards.")
+		.def("fcl_model", [](const Model& self) {
+			py::gil_scoped_release release;
+			return PyFclModel{self.fcl_model()};
+		})
+		.def("translate", &Model::translate)
+		.def("get_longest_axis", &Model::get_longest_axis)
+		.def("get_bounding_box", [](const Model& self) {
+			BoundingBox bb = self.get_bounding_box();
+			return py::make_tuple(py::make_tuple(bb.min_x, bb.min_y, bb.min_z),
+								  py::make_tuple(bb.max_x, bb.max_y, bb.max_z));
+		})
+		.def("dump_to_file", &Model::dump_to_file)
+		.def_property_readonly("vertices", [](const Model& self) {
+			const vector<Vec3f>& vertices = self.vertices();
+			py::array_t<float> res({vertices.size(), (size_t)3});
+			auto view = res.mutable_unchecked<2>();
+			for (size_t i = 0; i < vertices.size(); ++i)
+			{
+				view(i, 0) = vertices[i][0];
+				view(i, 1) = vertices[i][1];
+				view(i, 2) = vertices[i][2];
+			}
+			return res;
+		})
+		.def_property_readonly("num_of_triangles", [](const Model& self) { return self.triangles().size(); });
+
+	py::class_<CollisionManager>(m, "CollisionManager")
+		.def(py::init([](const Model& vascular, const Model& neuron, const std::string& neuron_name,
+						 int num_of_threads, int max_num_of_collisions, bool bound_checks, bool should_rotate) {
+				py::gil_scoped_release release;
+				return new CollisionManager(&vascular, &neuron, neuron_name, num_of_threads, max_num_of_collisions,
+											"", false, bound_checks, false, should_rotate);
+			}),
+			py::arg("vascular"), py::arg("neuron"), py::arg("neuron_name") = "",
+			py::arg("num_of_threads") = 10, py::arg("max_num_of_collisions") = 2000,
+			py::arg("bound_checks") = true, py::arg("should_rotate") = true,
+			// The manager keeps pointers to both models
+			py::keep_alive<1, 2>(), py::keep_alive<1, 3>())
+		.def("check_location", &check_location, py::arg("x"), py::arg("y"), py::arg("z"), py::arg("main_axis") = 'z')
+		.def("set_rotation_search", &CollisionManager::set_rotation_search,
+			 py::arg("steps"), py::arg("num_of_candidates") = 10);
+
+	m.def("check_a_collision", &check_a_collision,
+		  py::arg("vascular"), py::arg("neuron"), py::arg("location"), py::arg("rotation"),
+		  py::arg("max_num_of_collisions") = 2000, py::arg("return_points") = false);
+}
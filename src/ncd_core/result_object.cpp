@@ -2,52 +2,48 @@
 #include "exception.hpp"
 #include "trace.hpp"
 #include <string.h>
+#include <limits.h>
+#include <algorithm>
 
 ResultObject::ResultObject(int min_x, int max_x, int min_y, int max_y, int min_z, int max_z, int x_loc, int y_loc, int z_loc)
-:_x_min(min_x),
+:_current_elements(0),
+_x_loc(x_loc),
+_y_loc(y_loc),
+_z_loc(z_loc),
+_x_min(min_x),
 _x_max(max_x),
 _y_min(min_y),
 _y_max(max_y),
 _z_min(min_z),
 _z_max(max_z),
-_x_loc(x_loc),
-_y_loc(y_loc),
-_z_loc(z_loc),
-_current_elements(0)
+_tracked_amount(0),
+_kth_best(INT_MAX)
 {
+	pthread_mutex_init(&_best_lock, NULL);
 	_x_size = _x_max - _x_min + 1;
 	_y_size = _y_max - _y_min + 1;
 	_z_size = _z_max - _z_min + 1;
-	_result_array = new SingleResult**[_x_size];
-	for(int i = 0; i < _x_size; ++i)
-	{
-		_result_array[i] = new SingleResult*[_y_size];
-		for(int j = 0; j < _y_size; ++j)
-		{
-			_result_array[i][j] = new SingleResult[_z_size];
-			for(int k = 0; k < _z_size; ++k)
-			{
-				_result_array[i][j][k].num_of_collisions = -1;
-				_result_array[i][j][k].is_min = false;
-				_result_array[i][j][k].output_filename[0] = '\0';
-			}
-		}
-	}
-
 	_total_elements = _x_size * _y_size * _z_size;
+	_num_of_collisions.assign(_total_elements, RESULT_NOT_CHECKED);
+	_is_min.assign(_total_elements, 0);
 }
 
 ResultObject::~ResultObject()
 {
-	for(int i = 0; i < _x_size; ++i)
-	{
-		for(int j = 0; j < _y_size; ++j)
-		{
-			delete[] _result_array[i][j];
-		}
-		delete[] _result_array[i];
-	}
-	delete[] _result_array;
+	pthread_mutex_destroy(&_best_lock);
+}
+
+int ResultObject::index(int x, int y, int z) const
+{
+	return ((x - _x_min) * _y_size + (y - _y_min)) * _z_size + (z - _z_min);
+}
+
+void ResultObject::index_to_rotation(int index, int& x, int& y, int& z) const
+{
+	z = _z_min + index % _z_size;
+	index /= _z_size;
+	y = _y_min + index % _y_size;
+	x = _x_min + index / _y_size;
 }
 
 void ResultObject::add_result(int x, int y, int z, int res)
@@ -60,108 +56,139 @@ void ResultObject::add_result(int x, int y, int z, int res)
 				  x, y, z, _x_min, _y_min, _z_min, _x_max, _y_max, _z_max);
 		throw Exception("add_result got wrong indices");
 	}
-	_result_array[x - _x_min][y - _y_min][z - _z_min].num_of_collisions = res;
-	_current_elements++; // Not thread safe!
-}
+	_num_of_collisions[index(x, y, z)] = res;
+	_current_elements++;
 
-void ResultObject::write_to_file(const std::string& filename, const std::string& prefix, bool minimal_only)
-{
-	FILE* f = fopen(filename.c_str(), "a");
-	if (f == NULL)
+	if (_tracked_amount > 0 && res < _kth_best.load())
 	{
-		throw Exception("Failed opening output file");
+		pthread_mutex_lock(&_best_lock);
+		_best.push_back(res);
+		std::push_heap(_best.begin(), _best.end());
+		if ((int)_best.size() > _tracked_amount)
+		{
+			std::pop_heap(_best.begin(), _best.end());
+			_best.pop_back();
+		}
+		if ((int)_best.size() == _tracked_amount)
+			_kth_best = _best.front();
+		pthread_mutex_unlock(&_best_lock);
 	}
+}
 
-	for(int x = _x_min; x <= _x_max; ++x)
+// Starts tracking the amount best results, for collision_limit
+void ResultObject::track_best(int amount)
+{
+	_tracked_amount = amount;
+}
+
+// The number of collisions above which a rotation can't be one of the tracked
+// best results, plus one. Checking a rotation with this limit gives its exact
+// number of collisions whenever it can still be one of the best.
+int ResultObject::collision_limit(int max_col) const
+{
+	int kth_best = _kth_best.load();
+	return kth_best < max_col ? kth_best + 1 : max_col;
+}
+
+void ResultObject::write_to_file(FILE* f, const std::string& prefix, bool minimal_only) const
+{
+	for(int i = 0; i < _total_elements; ++i)
 	{
-		for(int y = _y_min; y <= _y_max; ++y)
-		{
-			for(int z = _z_min; z <= _z_max; ++z)
-			{
-				char str[1024];
-				SingleResult* cur_result = &_result_array[x - _x_min][y - _y_min][z - _z_min];
-				if (minimal_only && !cur_result->is_min)
-					continue;
-				snprintf(str, 1024, "%s,%i,%i,%i,%i,%i,%i,%i,%i,%s\n", prefix.c_str(), _x_loc, _y_loc, _z_loc,
-											x, y, z,
-											cur_result->num_of_collisions, cur_result->is_min, cur_result->output_filename);
-				fwrite(str, strlen(str), 1, f);
-			}
-		}
+		if (minimal_only && !_is_min[i])
+			continue;
+		if (_num_of_collisions[i] == RESULT_NOT_CHECKED)
+			continue;
+		int x, y, z;
+		index_to_rotation(i, x, y, z);
+		std::map<int, std::string>::const_iterator filename = _output_filenames.find(i);
+		fprintf(f, "%s,%i,%i,%i,%i,%i,%i,%i,%i,%s\n", prefix.c_str(), _x_loc, _y_loc, _z_loc,
+				x, y, z, _num_of_collisions[i], _is_min[i],
+				filename == _output_filenames.end() ? "" : filename->second.c_str());
 	}
-	fclose(f);
 }
 
 float ResultObject::get_percentage() const
 {
-	return (_current_elements*1.0) / _total_elements;
+	return (_current_elements.load() * 1.0) / _total_elements;
 }
 
-bool ResultObject::mark_min(int max_col)
+// The indices of the (up to) amount checked results with less than max_col
+// collisions, best first. Ties are broken by rotation, in x, y, z order.
+std::vector<int> ResultObject::best_indices(int amount, int max_col) const
 {
-	int min_x = 0;
-	int min_y = 0;
-	int min_z = 0;
-	int min_res = max_col + 10;
+	std::vector<std::pair<int, int> > candidates;
+	for(int i = 0; i < _total_elements; ++i)
+	{
+		int col_num = _num_of_collisions[i];
+		if (col_num != RESULT_NOT_CHECKED && col_num < max_col)
+			candidates.push_back(std::make_pair(col_num, i));
+	}
 
-	for(int x = _x_min; x <= _x_max; ++x)
+	size_t num_of_best = std::min((size_t)std::max(amount, 0), candidates.size());
+	std::partial_sort(candidates.begin(), candidates.begin() + num_of_best, candidates.end());
+	std::vector<int> best;
+	for (size_t i = 0; i < num_of_best; ++i)
 	{
-		for(int y = _y_min; y <= _y_max; ++y)
-		{
-			for(int z = _z_min; z <= _z_max; ++z)
-			{
-				SingleResult* cur_result = &_result_array[x - _x_min][y - _y_min][z - _z_min];
-				if (!cur_result->is_min && cur_result->num_of_collisions < min_res)
-				{
-					min_res = cur_result->num_of_collisions;
-					min_x = x;
-					min_y = y;
-					min_z = z;
-				}
-			}
-		}
+		best.push_back(candidates[i].second);
 	}
+	return best;
+}
 
-	if (_result_array[min_x - _x_min][min_y - _y_min][min_z - _z_min].num_of_collisions < max_col)
+int ResultObject::mark_mins(int amount, int max_col)
+{
+	std::vector<int> best = best_indices(amount, max_col);
+	for (size_t i = 0; i < best.size(); ++i)
 	{
-		_result_array[min_x - _x_min][min_y - _y_min][min_z - _z_min].is_min = true;
-		return true;
+		_is_min[best[i]] = 1;
 	}
-	return false;
+	return best.size();
 }
 
+bool ResultObject::is_checked(int x, int y, int z) const
+{
+	return _num_of_collisions[index(x, y, z)] != RESULT_NOT_CHECKED;
+}
 
-int ResultObject::mark_mins(int amount, int max_col)
+// The checked rotations with the least collisions, best first
+std::vector<Rotation> ResultObject::get_best(int amount) const
 {
-	for(int i = 0; i < amount; ++i)
+	std::vector<int> best = best_indices(amount, INT_MAX);
+	std::vector<Rotation> rotations;
+	for (size_t i = 0; i < best.size(); ++i)
 	{
-		if (!mark_min(max_col))
-			return i;
+		Rotation rot;
+		index_to_rotation(best[i], rot.x, rot.y, rot.z);
+		rotations.push_back(rot);
 	}
-	return amount;
+	return rotations;
 }
 
-void ResultObject::for_each_result(result_callback_t callback, void* arg)
+void ResultObject::for_each_result(result_callback_t callback, void* arg, bool minimal_only)
 {
-	for(int x = _x_min; x <= _x_max; ++x)
+	for(int i = 0; i < _total_elements; ++i)
 	{
-		for(int y = _y_min; y <= _y_max; ++y)
-		{
-			for(int z = _z_min; z <= _z_max; ++z)
-			{
-				SingleResult* cur_result = &_result_array[x - _x_min][y - _y_min][z - _z_min];
-
-				SingleResultCallbackParam params;
-				params.x = _x_loc;
-				params.y = _y_loc;
-				params.z = _z_loc;
-				params.r_x = x;
-				params.r_y = y;
-				params.r_z = z;
-				params.single_result = cur_result;
-				callback(arg, &params);
-			}
-		}
+		if (_num_of_collisions[i] == RESULT_NOT_CHECKED)
+			continue;
+		if (minimal_only && !_is_min[i])
+			continue;
+
+		SingleResult result;
+		result.num_of_collisions = _num_of_collisions[i];
+		result.is_min = _is_min[i];
+		std::map<int, std::string>::const_iterator filename = _output_filenames.find(i);
+		if (filename != _output_filenames.end())
+			result.output_filename = filename->second;
+
+		SingleResultCallbackParam params;
+		params.x = _x_loc;
+		params.y = _y_loc;
+		params.z = _z_loc;
+		index_to_rotation(i, params.r_x, params.r_y, params.r_z);
+		params.single_result = &result;
+		callback(arg, &params);
+
+		if (!result.output_filename.empty())
+			_output_filenames[i] = result.output_filename;
 	}
 }
 
@@ -172,24 +199,17 @@ void ResultObject::get_statistics(int max_col, int& total_results, int& oob_res,
 	oob_res = 0;
 	too_many_collisions_res = 0;
 	valid_res = 0;
-	for(int x = _x_min; x <= _x_max; ++x)
+	for(int i = 0; i < _total_elements; ++i)
 	{
-		for(int y = _y_min; y <= _y_max; ++y)
-		{
-			for(int z = _z_min; z <= _z_max; ++z)
-			{
-				SingleResult* cur_result = &_result_array[x - _x_min][y - _y_min][z - _z_min];
-				int col_num = cur_result->num_of_collisions;
-				if (col_num < max_col)
-					valid_res++;
-				else if (col_num == max_col)
-					too_many_collisions_res++;
-				else
-					oob_res++;
-				total_results++;
-			}
-		}
+		int col_num = _num_of_collisions[i];
+		if (col_num == RESULT_NOT_CHECKED)
+			continue;
+		if (col_num < max_col)
+			valid_res++;
+		else if (col_num == max_col)
+			too_many_collisions_res++;
+		else
+			oob_res++;
+		total_results++;
 	}
-
-
 }
@@ -1,14 +1,30 @@
 #pragma once
 
+#include <atomic>
+#include <map>
+#include <pthread.h>
+#include <stdint.h>
+#include <stdio.h>
 #include <string>
+#include <vector>
 
-#define OUTPUT_FILENAME_LENGTH 256
+// num_of_collisions of a rotation which wasn't checked (yet)
+#define RESULT_NOT_CHECKED -1
 
+typedef struct Rotation_s
+{
+	int x;
+	int y;
+	int z;
+} Rotation;
+
+// A copy of a single rotation's result, handed to a result_callback_t. A
+// callback may set output_filename, which is kept by the ResultObject.
 typedef struct SingleResult_s
 {
 	int num_of_collisions;
 	bool is_min;
-	char output_filename[OUTPUT_FILENAME_LENGTH];
+	std::string output_filename;
 } SingleResult;
 
 typedef struct SingleResultCallbackParam_s
@@ -31,21 +47,31 @@ class ResultObject
 		~ResultObject();
 
 		void add_result(int x, int y, int z, int res);
-		void write_to_file(const std::string& filename, const std::string& prefix, bool minimal_only = false);
+		void track_best(int amount);
+		int collision_limit(int max_col) const;
+		void write_to_file(FILE* f, const std::string& prefix, bool minimal_only = false) const;
 		float get_percentage() const;
 		int mark_mins(int amount, int max_col);
-		void for_each_result(result_callback_t callback, void* arg);
+		bool is_checked(int x, int y, int z) const;
+		std::vector<Rotation> get_best(int amount) const;
+		void for_each_result(result_callback_t callback, void* arg, bool minimal_only = false);
 		void get_statistics(int max_col, int& total_results, int& oob_res,
 							int& too_many_collisions_res, int& valid_res);
 
 
 	private:
-		bool mark_min(int max_col);
+		int index(int x, int y, int z) const;
+		void index_to_rotation(int index, int& x, int& y, int& z) const;
+		std::vector<int> best_indices(int amount, int max_col) const;
 
 	private:
-		SingleResult*** _result_array;
+		// The results are kept flat, indexed by index(), since only the
+		// few minimal results ever get an output filename
+		std::vector<int32_t> _num_of_collisions;
+		std::vector<uint8_t> _is_min;
+		std::map<int, std::string> _output_filenames;
 		int _total_elements;
-		int _current_elements;
+		std::atomic<int> _current_elements;
 
 		int _x_loc;
 		int _y_loc;
@@ -63,4 +89,11 @@ class ResultObject
 		int _x_size;
 		int _y_size;
 		int _z_size;
+
+		// The best _tracked_amount results so far, as a max heap, and the
+		// worst of them once there are enough
+		int _tracked_amount;
+		std::vector<int> _best;
+		std::atomic<int> _kth_best;
+		pthread_mutex_t _best_lock;
 };
@@ -0,0 +1,73 @@
+#include "result_writer.hpp"
+#include "exception.hpp"
+#include "trace.hpp"
+#include <string.h>
+
+ResultWriter::ResultWriter(const std::string& filename, const BinaryResultsHeader& header)
+:_is_binary(is_binary_filename(filename)),
+_minimal_only(header.minimal_only != 0),
+_neuron_name(header.neuron_name)
+{
+	// Text output is appended, like it always was
+	_file = fopen(filename.c_str(), _is_binary ? "wb" : "a");
+	if (_file == NULL)
+	{
+		throw Exception("Failed opening output file");
+	}
+	_buffer = new char[RESULT_WRITER_BUFFER_SIZE];
+	setvbuf(_file, _buffer, _IOFBF, RESULT_WRITER_BUFFER_SIZE);
+
+	if (_is_binary && fwrite(&header, sizeof(header), 1, _file) != 1)
+	{
+		fclose(_file);
+		delete[] _buffer;
+		throw Exception("Failed writing output file");
+	}
+}
+
+ResultWriter::~ResultWriter()
+{
+	if (fclose(_file) != 0)
+	{
+		LOG_ERROR("Failed closing output file\n");
+	}
+	delete[] _buffer;
+}
+
+bool ResultWriter::is_binary_filename(const std::string& filename)
+{
+	size_t suffix_length = strlen(BINARY_RESULTS_SUFFIX);
+	return filename.size() >= suffix_length &&
+		   filename.compare(filename.size() - suffix_length, suffix_length, BINARY_RESULTS_SUFFIX) == 0;
+}
+
+static void add_record(void* arg, SingleResultCallbackParam* params)
+{
+	std::vector<BinaryResultRecord>* records = (std::vector<BinaryResultRecord>*)arg;
+	BinaryResultRecord record = {};
+	record.x = params->x;
+	record.y = params->y;
+	record.z = params->z;
+	record.r_x = params->r_x;
+	record.r_y = params->r_y;
+	record.r_z = params->r_z;
+	record.is_min = params->single_result->is_min;
+	record.num_of_collisions = params->single_result->num_of_collisions;
+	records->push_back(record);
+}
+
+void ResultWriter::write(ResultObject& res)
+{
+	if (!_is_binary)
+	{
+		res.write_to_file(_file, _neuron_name, _minimal_only);
+		return;
+	}
+
+	_records.clear();
+	res.for_each_result(add_record, (void*)&_records, _minimal_only);
+	if (fwrite(_records.data(), sizeof(BinaryResultRecord), _records.size(), _file) != _records.size())
+	{
+		throw Exception("Failed writing output file");
+	}
+}
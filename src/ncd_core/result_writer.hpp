@@ -0,0 +1,73 @@
+#pragma once
+
+#include <stdint.h>
+#include <stdio.h>
+#include <string>
+
+#include "result_object.hpp"
+
+// Writes the results of all locations of a run to a single output file, which
+// stays open and buffered until the writer is destroyed.
+//
+// Output files ending with BINARY_RESULTS_SUFFIX are binary: a
+// BinaryResultsHeader followed by a BinaryResultRecord for every rotation.
+// Other files get the text format, a line per rotation:
+// neuron,x,y,z,r_x,r_y,r_z,num_of_collisions,is_min,collisions_filename
+
+#define BINARY_RESULTS_MAGIC "NCDRES"
+#define BINARY_RESULTS_VERSION 1
+#define BINARY_RESULTS_SUFFIX ".ncdr"
+#define BINARY_RESULTS_NAME_LENGTH 256
+#define RESULT_WRITER_BUFFER_SIZE (1 << 20)
+
+typedef struct BinaryResultsHeader_s
+{
+	char magic[8];
+	uint32_t version;
+	uint32_t record_size;
+	// The angle grid of the rotations
+	int32_t min_x;
+	int32_t max_x;
+	int32_t min_y;
+	int32_t max_y;
+	int32_t min_z;
+	int32_t max_z;
+	int32_t max_num_of_collisions;
+	uint32_t minimal_only;
+	char neuron_name[BINARY_RESULTS_NAME_LENGTH];
+	char vascular_name[BINARY_RESULTS_NAME_LENGTH];
+} BinaryResultsHeader;
+
+// The collisions filename isn't kept, as it can be built from the other fields
+typedef struct BinaryResultRecord_s
+{
+	int32_t x;
+	int32_t y;
+	int32_t z;
+	int16_t r_x;
+	int16_t r_y;
+	int16_t r_z;
+	uint8_t is_min;
+	uint8_t reserved;
+	int32_t num_of_collisions;
+} BinaryResultRecord;
+
+class ResultWriter
+{
+public:
+	ResultWriter(const std::string& filename, const BinaryResultsHeader& header);
+	ResultWriter(const ResultWriter&) = delete;
+	ResultWriter& operator=(const ResultWriter&) = delete;
+	~ResultWriter();
+
+	static bool is_binary_filename(const std::string& filename);
+	void write(ResultObject& res);
+
+private:
+	FILE* _file;
+	bool _is_binary;
+	bool _minimal_only;
+	std::string _neuron_name;
+	char* _buffer;
+	std::vector<BinaryResultRecord> _records;
+};
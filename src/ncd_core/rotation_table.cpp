@@ -0,0 +1,60 @@
+#include "rotation_table.hpp"
+#include "collision.hpp"
+#include "exception.hpp"
+
+RotationTable::RotationTable(int min_x, int max_x, int min_y, int max_y, int min_z, int max_z, const Cube& neuron_cube)
+:_min_x(min_x),
+_max_x(max_x),
+_min_y(min_y),
+_max_y(max_y),
+_min_z(min_z),
+_max_z(max_z)
+{
+	_y_size = _max_y - _min_y + 1;
+	_z_size = _max_z - _min_z + 1;
+	int total_elements = (_max_x - _min_x + 1) * _y_size * _z_size;
+	_matrices.reserve(total_elements);
+	_bounds.reserve(total_elements);
+
+	for(int x = _min_x; x <= _max_x; ++x)
+	{
+		for(int y = _min_y; y <= _max_y; ++y)
+		{
+			for(int z = _min_z; z <= _max_z; ++z)
+			{
+				NativeMatrix mat = Collision::calc_native_matrix(x, y, z);
+				RotatedBounds bounds;
+				neuron_cube.rotated_bounds(mat, bounds.min, bounds.max);
+				_matrices.push_back(Collision::calc_matrix(x, y, z));
+				_bounds.push_back(bounds);
+			}
+		}
+	}
+}
+
+bool RotationTable::matches(int min_x, int max_x, int min_y, int max_y, int min_z, int max_z) const
+{
+	return min_x == _min_x && max_x == _max_x && min_y == _min_y && max_y == _max_y &&
+		   min_z == _min_z && max_z == _max_z;
+}
+
+int RotationTable::index(int x, int y, int z) const
+{
+	if (x < _min_x || y < _min_y || z < _min_z || x > _max_x || y > _max_y || z > _max_z)
+		throw Exception("Rotation is out of the rotation table's range");
+	return ((x - _min_x) * _y_size + (y - _min_y)) * _z_size + (z - _min_z);
+}
+
+const Matrix3f& RotationTable::matrix(int x, int y, int z) const
+{
+	return _matrices[index(x, y, z)];
+}
+
+// Same as checking that all vertices of the rotated and translated cube are in
+// bb, as the cube's vertices are contained iff its bounds are
+bool RotationTable::is_contained(int x, int y, int z, int x_pos, int y_pos, int z_pos, const BoundingBox& bb) const
+{
+	const RotatedBounds& bounds = _bounds[index(x, y, z)];
+	return bb.contains(bounds.min[0] + x_pos, bounds.min[1] + y_pos, bounds.min[2] + z_pos) &&
+		   bb.contains(bounds.max[0] + x_pos, bounds.max[1] + y_pos, bounds.max[2] + z_pos);
+}
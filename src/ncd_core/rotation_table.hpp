@@ -0,0 +1,41 @@
+#pragma once
+
+#include "fcl.hpp"
+#include "cube.hpp"
+#include "bounding_box.hpp"
+
+// Bounds of the neuron's bounding cube after a rotation, before translation
+typedef struct RotatedBounds_s
+{
+	double min[3];
+	double max[3];
+} RotatedBounds;
+
+// The rotation matrices of all rotations in a range, and the bounds of the
+// rotated neuron cube for each of them. Built once and then shared, read only,
+// by all threads and locations, so the innermost loop does no trigonometry.
+class RotationTable
+{
+public:
+	RotationTable(int min_x, int max_x, int min_y, int max_y, int min_z, int max_z, const Cube& neuron_cube);
+
+	bool matches(int min_x, int max_x, int min_y, int max_y, int min_z, int max_z) const;
+	const Matrix3f& matrix(int x, int y, int z) const;
+	bool is_contained(int x, int y, int z, int x_pos, int y_pos, int z_pos, const BoundingBox& bb) const;
+
+private:
+	int index(int x, int y, int z) const;
+
+private:
+	int _min_x;
+	int _max_x;
+	int _min_y;
+	int _max_y;
+	int _min_z;
+	int _max_z;
+	int _y_size;
+	int _z_size;
+
+	vector<Matrix3f> _matrices;
+	vector<RotatedBounds> _bounds;
+};
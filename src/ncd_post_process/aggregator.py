@@ -1,238 +1,119 @@
 #!/state/partition1/apps/python/anaconda2/bin/python
 from __future__ import print_function
 import sys, os
-import math
 import numpy as np
 import time
-import bisect
+import functools
 
-def create_collision_str(collisions):
-    res = ""
-    for c in collisions:
-        x, y, z, _ = [str(a) for a in c]
-        col = " ".join([x, y, z])
-        res += col + "|"
-    return res[:-1]
+from ncd_post_process.vascular_index import VascularIndex
 
-def read_balls(fname):
-    res = []
+BALL_DTYPE = np.float32
+# Neurons are placed in float64, so the collision coordinates written to the
+# CSV DB have the same precision as the ones of earlier runs
+NEURON_DTYPE = np.float64
+CUT_VASCULAR_MARGIN = 5
 
-    for line in open(fname, "r"):
-        if len(line) <= 1:
-            pass
-        x, y, z, r = [float(a) for a in line.split(",")]
-        res.append([x, y, z, r])
-    return res
+def read_balls_array(fname, dtype=BALL_DTYPE):
+    """Reads an (x, y, z, r) balls CSV into a contiguous (N, 4) array, float32
+    by default."""
+    balls = np.loadtxt(fname, delimiter=",", dtype=dtype, ndmin=2)
+    return np.ascontiguousarray(balls)
 
 
-def swap_x_y(obj):
-    for i in range(len(obj)):
-        x, y, z, r = obj[i]
-        obj[i] = [y, x, z, r]
+@functools.lru_cache(maxsize=32)
+def load_neuron_balls(fname):
+    """Cached, read-only version of read_balls_array for neurons, which are
+    re-read for every placement of the same neuron."""
+    balls = read_balls_array(fname, NEURON_DTYPE)
+    balls.setflags(write=False)
+    return balls
 
 
-def rotate(neuron, rotation):
-    x_deg, y_deg, z_deg = rotation
-    x_rad = math.radians(x_deg)
-    y_rad = math.radians(y_deg)
-    z_rad = math.radians(z_deg)
+def rotation_matrix(rotation):
+    """The Rx * Ry * Rz rotation matrix of (x, y, z) angles in degrees, as a
+    (3, 3) array which rotates column vectors."""
+    x_rad, y_rad, z_rad = np.radians(np.asarray(rotation, dtype=np.float64))
+    cos_x, sin_x = np.cos(x_rad), np.sin(x_rad)
+    cos_y, sin_y = np.cos(y_rad), np.sin(y_rad)
+    cos_z, sin_z = np.cos(z_rad), np.sin(z_rad)
+    m_x = np.array([[1, 0, 0], [0, cos_x, -sin_x], [0, sin_x, cos_x]])
+    m_y = np.array([[cos_y, 0, sin_y], [0, 1, 0], [-sin_y, 0, cos_y]])
+    m_z = np.array([[cos_z, -sin_z, 0], [sin_z, cos_z, 0], [0, 0, 1]])
+    return m_x @ m_y @ m_z
 
-    cos_x = math.cos(x_rad)
-    sin_x = math.sin(x_rad)
-    cos_y = math.cos(y_rad)
-    sin_y = math.sin(y_rad)
-    cos_z = math.cos(z_rad)
-    sin_z = math.sin(z_rad)
 
-    m_x = [[1, 0, 0],
-            [ 0, cos_x, -1*sin_x],
-            [0, sin_x, cos_x]]
+def rotate_array(balls, rotation):
+    """Returns a rotated float64 copy of an (N, 4) balls array. Radii are
+    untouched."""
+    rotated = np.array(balls, dtype=NEURON_DTYPE, order="C")
+    rotated[:, :3] = balls[:, :3] @ rotation_matrix(rotation).T
+    return rotated
 
-    m_y = [[cos_y, 0, sin_y],
-            [0, 1, 0],
-            [-1 * sin_y, 0, cos_y]]
 
-    m_z = [[cos_z, -1 * sin_z, 0],
-            [sin_z, cos_z, 0],
-            [0, 0, 1]]
+def translate_array(balls, location):
+    """Translates an (N, 4) balls array in place and returns it."""
+    balls[:, :3] += np.asarray(location, dtype=balls.dtype)
+    return balls
 
-    mx = np.matrix(m_x)
-    my = np.matrix(m_y)
-    mz = np.matrix(m_z)
 
-    m = mx * my * mz
-    for i in range(len(neuron)):
-        x, y, z, r = neuron[i]
-        v = np.matrix([x, y, z]).transpose()
-        rotated_v = m * v
-        x, y, z = rotated_v.transpose().tolist()[0]
-        neuron[i] = [x, y, z, r]
+def find_bounding_box_array(balls):
+    """Returns the (min_xyz, max_xyz) corners of the balls' centers."""
+    return balls[:, :3].min(axis=0), balls[:, :3].max(axis=0)
 
 
-def translate(obj, location):
-    x_l, y_l, z_l = location
-    for i in range(len(obj)):
-        x, y, z, r = obj[i]
-        obj[i] = [x + x_l, y + y_l, z + z_l, r]
-
-def find_bounding_box(obj):
-    min_x = max_x = obj[0][0]
-    min_y = max_y = obj[0][1]
-    min_z = max_z = obj[0][2]
-
-    for i in range(len(obj)):
-        x, y, z = obj[i][:3]
-        if x < min_x:
-            min_x = x
-        if x > max_x:
-            max_x = x
-        if y < min_y:
-            min_y = y
-        if y > max_y:
-            max_y = y
-        if z < min_z:
-            min_z = z
-        if z > max_z:
-            max_z = z
-
-    return min_x, max_x, min_y, max_y, min_z, max_z
-
-def cut_vascular(vascular, neuron):
-    min_x, max_x, min_y, max_y, min_z, max_z = find_bounding_box(neuron)
-    min_x -= 5
-    min_y -= 5
-    min_z -= 5
-
-    max_x += 5
-    max_y += 5
-    max_z += 5
-
-    cut_vascular = []
-    for el in vascular:
-        x, y, z, _ = el
-        if x < min_x or x > max_x:
-            continue
-        if y < min_y or y > max_y:
-            continue
-        if z < min_z or z > max_z:
-            continue
-        cut_vascular.append(el)
-    return cut_vascular
-
-def distance(n, v):
-    a = np.array(n[:3])
-    b = np.array(v[:3])
-    d = np.linalg.norm(a - b)
-    return d
-
-def sort_vascular(vascular):
-    vascular.sort(key = lambda v:v[0])
-
-def collide(n, v, threshold_distance):
-        rsum = n[3] + v[3] + threshold_distance
-        if abs(n[0] - v[0]) > rsum:
-            return False
-        if abs(n[1] - v[1]) > rsum:
-            return False
-        if abs(n[2] - v[2]) > rsum:
-            return False
-        if distance(n, v) <= rsum:
-            return True
-        return False
-
-def separate_vascular(vascular, threshold):
-    small_vascular = []
-    big_vascular = []
-    for v in vascular:
-        if v[3] < threshold:
-            small_vascular.append(v)
-        else:
-            big_vascular.append(v)
-    return small_vascular, big_vascular
-
-def find_nearest_points(vascular, neuron, threshold_distance):
-    collisions = []
-
-    BIG_VASCULAR_R = 3
-    sort_vascular(vascular)
-    vascular, big_vascular_nodes = separate_vascular(vascular, BIG_VASCULAR_R)
-    #print ("Small: %i, Big: %i" % (len(vascular), len(big_vascular_nodes)))
-
-    for n in neuron:
-        found = False
-        for v in big_vascular_nodes:
-            if collide(n, v, threshold_distance):
-                collisions.append(n)
-                found = True
-                break
-        if found:
-            continue
-        base_idx = bisect.bisect(vascular, n)
-        max_x_distance = BIG_VASCULAR_R + n[3] + threshold_distance
-        cur_idx = base_idx
-        while cur_idx < len(vascular) and abs(vascular[cur_idx][0]-n[0]) < max_x_distance:
-            v = vascular[cur_idx]
-            if collide(n, v, threshold_distance):
-                collisions.append(n)
-                found = True
-                break
-            cur_idx += 1
-        if found:
-            continue
-        cur_idx = base_idx - 1
-        while cur_idx >= 0 and abs(vascular[cur_idx][0] - n[0]) < max_x_distance:
-            v = vascular[cur_idx]
-            if collide(n, v, threshold_distance):
-                collisions.append(n)
-                break
-            cur_idx -= 1
-
-    return collisions
+def create_collision_str_array(collisions):
+    """The collisions' x, y, z coordinates as "x y z|x y z|..."."""
+    return "|".join(" ".join(str(c) for c in row[:3]) for row in collisions)
 
 
 def get_vascular(vascular_filename):
     print("Read vascular data...")
-    vascular = read_balls(vascular_filename)
-    # translate(vascular, [1, -15, 19])
-    #swap_x_y(vascular)
+    vascular = read_balls_array(vascular_filename)
 
-    return vascular
+    print("Index vascular data...")
+    return VascularIndex.from_balls(vascular)
 
 
-def aggregate(vascular_filename, neuron_filename, location, rotation, results_filename, threshold_distance, vascular):
-    if vascular is None:
-        vascular = get_vascular(vascular_filename)
-    #max_r = max(vascular, key=lambda x : x[3])
-    #print max_r
-    # print("Read neuron data...")
-    neuron = read_balls(neuron_filename)
+def find_placement_collisions(neuron_filename, location, rotation, threshold_distance, vascular):
+    """Returns the balls of the neuron, placed at the given location and
+    rotation, which collide with the vasculature."""
+    neuron = load_neuron_balls(neuron_filename)
+    neuron = translate_array(rotate_array(neuron, rotation), location)
+    mins, maxs = find_bounding_box_array(neuron)
+    box = (mins - CUT_VASCULAR_MARGIN, maxs + CUT_VASCULAR_MARGIN)
+    return neuron[vascular.find_colliding_balls(neuron, threshold_distance, box)]
 
-    #print find_bounding_box(vascular)
-    #print find_bounding_box(neuron)
 
-    # print("Swap x y...")
-    #swap_x_y(neuron)
-    # print("Rotate neuron...")
-    rotate(neuron, rotation)
-    # print("Translate neuron...")
-    translate(neuron, location)
+def format_db_line(neuron_id, vascular_id, location, rotation, collisions):
+    """A single line of the aggregator's CSV DB."""
+    run_id = "run_1"
+    neuron_location = "{0} {1} {2}".format(*location)
+    neuron_rotation = "{0} {1} {2}".format(*rotation)
+    collisions_count = len(collisions)
+    collisions_str = create_collision_str_array(collisions)
+    return "{run_id},{neuron_id},{vascular_id},{neuron_location},{neuron_rotation},{collisions_count},{collisions_str}\n".format(**locals())
 
-    # print("Cut vascular data...")
-    vascular = cut_vascular(vascular, neuron)
 
-    # print("Find nearest points...")
-    collisions = find_nearest_points(vascular, neuron, threshold_distance)
+def aggregate(vascular_filename, neuron_filename, location, rotation, results_filename, threshold_distance, vascular,
+              sink=None):
+    """
+    Finds the collisions of a single placement of the neuron and writes them
+    as a line of the DB. If a result sink is given (see result_sink.py) the
+    result is handed to it instead of being appended to results_filename.
+    """
+    if vascular is None:
+        vascular = get_vascular(vascular_filename)
+    elif not isinstance(vascular, VascularIndex):
+        vascular = VascularIndex.from_balls(np.asarray(vascular))
+    collisions = find_placement_collisions(neuron_filename, location, rotation, threshold_distance, vascular)
 
-    collisions_str = create_collision_str(collisions)
-    run_id = "run_1"
     neuron_id = os.path.basename(neuron_filename)
     vascular_id = os.path.basename(vascular_filename)
-    neuron_location = "{0} {1} {2}".format(*location)
-    neuron_rotation = "{0} {1} {2}".format(*rotation)
-    collisions_count = len(collisions)
-    line = "{run_id},{neuron_id},{vascular_id},{neuron_location},{neuron_rotation},{collisions_count},{collisions_str}\n".format(**locals())
-    with open(results_filename, "a") as f:
-        f.write(line)
+    if sink is not None:
+        sink.add(neuron_id, vascular_id, location, rotation, collisions[:, :3])
+    else:
+        with open(results_filename, "a") as f:
+            f.write(format_db_line(neuron_id, vascular_id, location, rotation, collisions))
 
     print("Done!")
     return 0
@@ -249,7 +130,7 @@ def main(argv):
     threshold_distance = 0
     if len(argv) >= 7:
         threshold_distance = int(argv[6])
-    aggregate(vascular_filename, neuron_filename, location, rotation, results_filename, threshold_distance)
+    aggregate(vascular_filename, neuron_filename, location, rotation, results_filename, threshold_distance, None)
 
 
 if __name__ == "__main__":
@@ -42,19 +42,18 @@ def plot_alpha_vs_density(points, name):
     ax.figure.savefig(f'results/with_alpha/alpha_vs_u(r)_{name}.pdf', transparent=True, dpi=300)
 
 
-def main(neuron_fname: pathlib.Path, neuron_name: str, py3dn_folder: pathlib.Path, graph_fname: pathlib.Path):
+def main(neuron_fname: pathlib.Path, neuron_name: str, graph_fname: pathlib.Path):
     try:
         points, g = generate_df_from_neuron(graph_fname, neuron_name)
     except FileNotFoundError:
         raise
-    bdens = find_branching_density.BranchDensity(neuron_fname, py3dn_folder)
+    bdens = find_branching_density.BranchDensity(neuron_fname)
     counts = bdens.main()
     points.loc[:, "U(r=10)"] = counts.loc[:, 10].to_numpy()
     return points, g
 
 
 if __name__ == '__main__':
-    py3dn_folder = pathlib.Path('/data/neural_collision_detection') / "py3DN"
     for neuron_name in neuron_names:
         neuron_fname = (
             pathlib.Path('/data/neural_collision_detection')
@@ -64,7 +63,7 @@ if __name__ == '__main__':
         )
         graph_fname = pathlib.Path(f'/data/neural_collision_detection/results/2020_07_29/graph_{neuron_name}_with_collisions.gml')
         try:
-            points, g = main(neuron_fname, neuron_name, py3dn_folder, graph_fname)
+            points, g = main(neuron_fname, neuron_name, graph_fname)
         except FileNotFoundError:
             continue
         plot_alpha_vs_density(points, neuron_name)
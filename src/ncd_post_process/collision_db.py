@@ -0,0 +1,226 @@
+"""
+A binary, columnar format for the aggregator's DB.
+
+The CSV DB stores the collisions of every placement as a "x y z|x y z..."
+string, which is slow and memory-hungry to parse. A collision DB is instead
+a folder (named *.ncdb) of raw, fixed-width columns:
+
+- run_code, neuron_code, vasc_code: int16 codes into the names listed in
+  meta.json, one per placement.
+- location, rotation: int16 (N, 3), one row per placement.
+- coll_count: int32, one per placement.
+- offsets: int64 (N + 1). The collisions of placement i are
+  collisions[offsets[i]:offsets[i + 1]].
+- collisions: float32 (K, 3), the colliding neuron balls of all placements.
+
+meta.json is written last, so a folder without it is an unfinished DB.
+The columns are memory-mapped when the DB is opened, so it can be larger
+than the available memory.
+"""
+import json
+import pathlib
+
+import attr
+from attr.validators import instance_of
+import numpy as np
+import pandas as pd
+
+DB_SUFFIX = ".ncdb"
+META_FNAME = "meta.json"
+WRITER_BUFFER_SIZE = 20000
+COLUMNS = {
+    "run_code": (np.int16, ()),
+    "neuron_code": (np.int16, ()),
+    "vasc_code": (np.int16, ()),
+    "location": (np.int16, (3,)),
+    "rotation": (np.int16, (3,)),
+    "coll_count": (np.int32, ()),
+    "offsets": (np.int64, ()),
+    "collisions": (np.float32, (3,)),
+}
+CATEGORIES = ("run_id", "neuron", "vasc")
+INDEX_NAMES = ["run_id", "neuron", "vasc", "x", "y", "z", "roll", "pitch", "yaw", "coll_count"]
+
+
+def _column_fname(path, name):
+    return pathlib.Path(path) / f"{name}.bin"
+
+
+@attr.s
+class CollisionDBWriter:
+    """
+    Writes a collision DB, appending to its columns in batches. It has the
+    same interface as the sinks in result_sink.py, so the aggregator can
+    write to it directly.
+
+    :param pathlib.Path path: Folder of the DB. It's created if needed, and
+    existing columns in it are overwritten.
+    :param int buffer_size: Number of placements to keep before writing.
+    """
+
+    path = attr.ib(converter=pathlib.Path)
+    buffer_size = attr.ib(default=WRITER_BUFFER_SIZE, validator=instance_of(int))
+    _rows = attr.ib(factory=list, init=False, repr=False)
+    _categories = attr.ib(init=False, repr=False)
+    _num_placements = attr.ib(default=0, init=False, repr=False)
+    _num_collisions = attr.ib(default=0, init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        # The metadata is written last, so a DB without it is incomplete
+        if (self.path / META_FNAME).exists():
+            (self.path / META_FNAME).unlink()
+        for name in COLUMNS:
+            _column_fname(self.path, name).write_bytes(b"")
+        self._categories = {name: {} for name in CATEGORIES}
+        self._append("offsets", np.zeros(1, np.int64))
+
+    def _code(self, category, value):
+        codes = self._categories[category]
+        return codes.setdefault(value, len(codes))
+
+    def _append(self, name, arr):
+        dtype, _ = COLUMNS[name]
+        with open(_column_fname(self.path, name), "ab") as f:
+            f.write(np.ascontiguousarray(arr, dtype=dtype).tobytes())
+
+    def add(self, neuron_id, vascular_id, location, rotation, collisions, run_id="run_1"):
+        self._rows.append((run_id, neuron_id, vascular_id, location, rotation, np.asarray(collisions, np.float32)))
+        if len(self._rows) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        run_ids, neuron_ids, vascular_ids, locations, rotations, collisions = zip(*self._rows)
+        self._rows = []
+        placement = np.array([locations, rotations], dtype=np.int64).reshape(2, -1, 3)
+        if np.any(np.abs(placement) > np.iinfo(np.int16).max):
+            raise ValueError("Locations and rotations must fit into int16.")
+        counts = np.array([len(c) for c in collisions], dtype=np.int32)
+        self._append("run_code", [self._code("run_id", v) for v in run_ids])
+        self._append("neuron_code", [self._code("neuron", v) for v in neuron_ids])
+        self._append("vasc_code", [self._code("vasc", v) for v in vascular_ids])
+        self._append("location", placement[0])
+        self._append("rotation", placement[1])
+        self._append("coll_count", counts)
+        self._append("offsets", self._num_collisions + np.cumsum(counts, dtype=np.int64))
+        self._append("collisions", np.concatenate(collisions).reshape(-1, 3))
+        self._num_placements += len(counts)
+        self._num_collisions += int(counts.sum())
+
+    def close(self):
+        """Flushes the data and writes meta.json, which marks the DB as complete."""
+        self.flush()
+        meta = {
+            "num_placements": self._num_placements,
+            "num_collisions": self._num_collisions,
+            "categories": {name: list(codes) for name, codes in self._categories.items()},
+        }
+        with open(self.path / META_FNAME, "w") as f:
+            json.dump(meta, f)
+
+    def abort(self):
+        """Drops the buffered data without writing meta.json, so the DB stays
+        marked as incomplete. The columns are only opened while appending to
+        them, so there are no file handles to release."""
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+@attr.s
+class CollisionDB:
+    """
+    A read-only view of a collision DB. Use ``open`` to create it.
+
+    :param pathlib.Path path: Folder of the DB.
+    :param dict meta: Contents of its meta.json.
+    :param dict columns: Memory-mapped columns, by name.
+    """
+
+    path = attr.ib(converter=pathlib.Path)
+    meta = attr.ib(validator=instance_of(dict))
+    columns = attr.ib(validator=instance_of(dict), repr=False)
+
+    @classmethod
+    def open(cls, path):
+        path = pathlib.Path(path)
+        meta_fname = path / META_FNAME
+        if not meta_fname.exists():
+            raise FileNotFoundError(f"{path} isn't a complete collision DB, {META_FNAME} is missing.")
+        with open(meta_fname) as f:
+            meta = json.load(f)
+        lengths = {"offsets": meta["num_placements"] + 1, "collisions": meta["num_collisions"]}
+        columns = {}
+        for name, (dtype, shape) in COLUMNS.items():
+            length = lengths.get(name, meta["num_placements"])
+            if length == 0:
+                columns[name] = np.zeros((0, *shape), dtype)
+                continue
+            columns[name] = np.memmap(_column_fname(path, name), dtype=dtype, mode="r", shape=(length, *shape))
+        return cls(path, meta, columns)
+
+    def __len__(self):
+        return self.meta["num_placements"]
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def categorical(self, category):
+        """A categorical column of the DB, e.g. 'neuron'."""
+        code_column = {"run_id": "run_code", "neuron": "neuron_code", "vasc": "vasc_code"}[category]
+        return pd.Categorical.from_codes(self.columns[code_column], self.meta["categories"][category])
+
+    def collisions_of(self, placement_idx):
+        """The (K, 3) collisions of a single placement."""
+        offsets = self.columns["offsets"]
+        return self.columns["collisions"][offsets[placement_idx] : offsets[placement_idx + 1]]
+
+    def placements(self) -> pd.DataFrame:
+        """One row per placement, with the same columns as the index of
+        ``db_to_dataframe.parse_raw_df``."""
+        location = np.asarray(self.columns["location"], dtype=np.float64)
+        rotation = np.asarray(self.columns["rotation"], dtype=np.float64)
+        return pd.DataFrame({
+            **{category: self.categorical(category) for category in CATEGORIES},
+            "x": location[:, 0], "y": location[:, 1], "z": location[:, 2],
+            "roll": rotation[:, 0], "pitch": rotation[:, 1], "yaw": rotation[:, 2],
+            "coll_count": np.asarray(self.columns["coll_count"], dtype=np.int64),
+        })
+
+    def to_collisions_frame(self) -> pd.DataFrame:
+        """
+        The same frame ``db_to_dataframe.parse_raw_df`` builds from a CSV DB:
+        a row per collision with the placement as its MultiIndex, and a single
+        NaN row for placements without collisions.
+        """
+        counts = np.asarray(self.columns["coll_count"], dtype=np.int64)
+        rows_per_placement = np.maximum(counts, 1)
+        rows = np.full((rows_per_placement.sum(), 3), np.nan)
+        has_colls = np.repeat(counts > 0, rows_per_placement)
+        rows[has_colls] = self.columns["collisions"]
+        index = self.placements().iloc[np.repeat(np.arange(len(self)), rows_per_placement)]
+        return pd.DataFrame(
+            {"coll_x": rows[:, 0], "coll_y": rows[:, 1], "coll_z": rows[:, 2]},
+            index=pd.MultiIndex.from_frame(index[INDEX_NAMES]),
+        )
+
+
+def csv_to_collision_db(csv_fname, db_path):
+    """Converts an aggregator CSV DB into a collision DB, one line at a time."""
+    with open(csv_fname) as f, CollisionDBWriter(db_path) as writer:
+        for line in f:
+            run_id, neuron_id, vascular_id, location, rotation, _, collisions = line.rstrip("\n").split(",", 6)
+            collisions = np.array(collisions.replace("|", " ").split(), dtype=np.float32).reshape(-1, 3)
+            location = [int(a) for a in location.split()]
+            rotation = [int(a) for a in rotation.split()]
+            writer.add(neuron_id, vascular_id, location, rotation, collisions, run_id)
+    return CollisionDB.open(db_path)
@@ -8,7 +8,6 @@ import itertools
 
 import attr
 from attr.validators import instance_of
-import networkx as nx
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -16,7 +15,7 @@ import numba
 import seaborn as sns
 import scipy.spatial.distance
 
-from ncd_post_process.graph_parsing import CollisionNode
+from ncd_post_process.neuron_graph import NeuronGraph, as_neuron_graph, load_neuron_graph
 
 
 plt.rcParams.update({"font.size": 22})
@@ -54,16 +53,16 @@ class CollisionsDistNaive:
 
     Parameters
     ----------
-    graph : nx.Graph
-        A parsed graph that was generated by networkx and ``NeuronToGraph`` in
-        ``graph_parsing.py``.
+    graph : NeuronGraph
+        A parsed graph that was generated by ``NeuronToGraph`` in
+        ``graph_parsing.py``. networkx graphs of it are converted.
     neuron_name : str
         The label of the neuron
     normalize_collisions_by : int
         Number of possible locations that the neuron could've been in. This factor turns
         the number of collisions into the probability of collision.
     """
-    graph = attr.ib(validator=instance_of(nx.Graph))
+    graph = attr.ib(converter=as_neuron_graph, validator=instance_of(NeuronGraph))
     neuron_name = attr.ib(default="neuron", validator=instance_of(str))
     normalize_collisions_by = attr.ib(default=100_000, validator=instance_of(int))
     results_folder = attr.ib(
@@ -76,7 +75,7 @@ class CollisionsDistNaive:
     labels_and_colors = attr.ib(init=False)
 
     def __attrs_post_init__(self):
-        self.num_of_nodes = self.graph.number_of_nodes()
+        self.num_of_nodes = self.graph.num_of_nodes
         idxx = np.zeros(self.num_of_nodes, dtype=np.uint16)
         dist_ax = np.zeros(self.num_of_nodes, dtype=np.float32)
         df_columns = {
@@ -100,10 +99,7 @@ class CollisionsDistNaive:
     @classmethod
     def from_graph(cls, fname: pathlib.Path, neuron: str, **kwargs):
         """Instantiate from an existing graph file by deserializing it."""
-        graph = nx.readwrite.gml.read_gml(
-            str(fname), destringizer=CollisionNode.from_str
-        )
-        return cls(graph, neuron, **kwargs)
+        return cls(load_neuron_graph(fname), neuron, **kwargs)
 
     def run(self):
         """Run analysis pipeline."""
@@ -117,29 +113,23 @@ class CollisionsDistNaive:
         collisions in it as a function of the topological distance
         from the cell body.
         """
-        idx_axon, idx_dend = 0, 0
-        for idx, node in enumerate(self.graph.nodes()):
-            row_data = (
-                idx,
-                node.collision_chance,
-                node.dist_to_body,
-                node.loc[0],
-                node.loc[1],
-                node.loc[2],
-                node.alpha,
-                node.tree_type,
-            )
-            self.all_colls.loc[idx, :] = row_data
-            if 'Axon' in node.tree_type:
-                self.parsed_axon.loc[idx_axon, :] = row_data[:-1]
-                idx_axon += 1
-            else:
-                self.parsed_dend.loc[idx_dend, :] = row_data[:-1]
-                idx_dend += 1
-
-        self.parsed_axon = self.parsed_axon.loc[:idx_axon - 1, :]
-        self.parsed_dend = self.parsed_dend.loc[:idx_dend - 1, :]
-        self.all_colls["type"] = self.all_colls["type"].astype('category')
+        graph = self.graph
+        self.all_colls = pd.DataFrame(
+            {
+                "orig_row": np.arange(self.num_of_nodes),
+                "coll": graph.collision_chance,
+                "dist": graph.dist_to_body,
+                "x": graph.loc[:, 0].astype(np.float32),
+                "y": graph.loc[:, 1].astype(np.float32),
+                "z": graph.loc[:, 2].astype(np.float32),
+                "alpha": graph.alpha,
+                "type": pd.Categorical(graph.tree_type_names),
+            }
+        )
+        is_axon = graph.is_axon
+        numeric_columns = self.all_colls.columns.drop("type")
+        self.parsed_axon = self.all_colls.loc[is_axon, numeric_columns].reset_index(drop=True)
+        self.parsed_dend = self.all_colls.loc[~is_axon, numeric_columns].reset_index(drop=True)
 
     def _normalize_by_density(self, data):
         """Takes the parsed graph data and normalizes the collision counts by the
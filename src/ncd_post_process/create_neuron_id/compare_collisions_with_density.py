@@ -6,7 +6,6 @@ import attr
 from attr.validators import instance_of
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
-import networkx as nx
 import numpy as np
 import pandas as pd
 import scipy.fftpack
@@ -14,6 +13,7 @@ import scipy.spatial.distance
 
 from ncd_post_process.lib.find_branching_density import BranchDensity
 from ncd_post_process.graph_parsing import load_neuron
+from ncd_post_process.neuron_graph import NeuronGraph, as_neuron_graph
 from ncd_post_process.create_neuron_id.collisions_vs_dist_naive import CollisionsDistNaive
 
 neuron_names = [
@@ -59,7 +59,7 @@ class BranchDensityAndCollisions:
     """
 
     bdens = attr.ib(validator=instance_of(BranchDensity))
-    graph = attr.ib(validator=instance_of(nx.Graph))
+    graph = attr.ib(converter=as_neuron_graph, validator=instance_of(NeuronGraph))
     r = attr.ib(default=10, validator=instance_of(int))
     counts = attr.ib(init=False)
 
@@ -102,11 +102,8 @@ class BranchDensityAndCollisions:
         return counts
 
     def _pop_counts_with_colls(self):
-        self.counts["collisions"] = 0
-        row_idx = 0
-        for node in self.graph.nodes():
-            self.counts.iloc[row_idx, -1] = node.collision_chance
-            row_idx += 1
+        self.counts["collisions"] = 0.0
+        self.counts.iloc[: self.graph.num_of_nodes, -1] = self.graph.collision_chance
 
     def _prepare_colls_dens_data(self):
         """
@@ -200,7 +197,7 @@ class BranchDensityAndDist:
     """
 
     bdens = attr.ib(validator=instance_of(BranchDensity))
-    graph = attr.ib(validator=instance_of(nx.Graph))
+    graph = attr.ib(converter=as_neuron_graph, validator=instance_of(NeuronGraph))
     r = attr.ib(default=10, validator=instance_of(int))
     window = attr.ib(default=10, validator=instance_of(int))
     ur = attr.ib(init=False)
@@ -263,13 +260,9 @@ class BranchDensityAndDist:
         """Create an array of the topological distance of each
         point on the graph.
         """
-        dists_ax = np.zeros(self.graph.number_of_nodes())
-        dists_dend = dists_ax.copy()
-        for idx, node in enumerate(self.graph.nodes()):
-            if "Axon" in node.tree_type:
-                dists_ax[idx] = node.dist_to_body
-            elif "Dend" in node.tree_type:
-                dists_dend[idx] = node.dist_to_body
+        dist_to_body = self.graph.dist_to_body.astype(np.float64)
+        dists_ax = np.where(self.graph.is_axon, dist_to_body, 0)
+        dists_dend = np.where(self.graph.is_dendrite, dist_to_body, 0)
 
         return dists_ax, dists_dend
 
@@ -374,7 +367,7 @@ class DensityCollisionsDistance:
     """
 
     bdens = attr.ib(validator=instance_of(BranchDensity))
-    graph = attr.ib(validator=instance_of(nx.Graph))
+    graph = attr.ib(converter=as_neuron_graph, validator=instance_of(NeuronGraph))
     r = attr.ib(default=10, validator=instance_of(int))
     ur = attr.ib(init=False)
     topodist_ax = attr.ib(init=False)
@@ -401,20 +394,15 @@ class DensityCollisionsDistance:
         """Create an array of the topological distance of each
         point on the graph.
         """
-        dists_ax = np.zeros(self.graph.number_of_nodes())
-        dists_dend = dists_ax.copy()
-        for idx, node in enumerate(self.graph.nodes()):
-            if "Axon" in node.tree_type:
-                dists_ax[idx] = node.dist_to_body
-            elif "Dend" in node.tree_type:
-                dists_dend[idx] = node.dist_to_body
+        dist_to_body = self.graph.dist_to_body.astype(np.float64)
+        dists_ax = np.where(self.graph.is_axon, dist_to_body, 0)
+        dists_dend = np.where(self.graph.is_dendrite, dist_to_body, 0)
 
         return dists_ax, dists_dend
 
     def _populate_ur_with_colls(self):
-        self.ur["collisions"] = 0
-        for row_idx, node in enumerate(self.graph.nodes()):
-            self.ur.iloc[row_idx, -1] = node.collision_chance
+        self.ur["collisions"] = 0.0
+        self.ur.iloc[: self.graph.num_of_nodes, -1] = self.graph.collision_chance
 
     def _scatter(self):
         """Genereates a 3D scatter plot of the density, collision count and
@@ -553,8 +541,7 @@ def _instantiate_bdens(neuron_name, branch_class=BranchDensityAndCollisions, r=1
         / "neurons"
         / f"{neuron_name}.xml"
     )
-    py3dn_folder = pathlib.Path('/data/neural_collision_detection') / "py3DN"
-    bdens = BranchDensity(neuron_fname, py3dn_folder)
+    bdens = BranchDensity(neuron_fname)
     neuron_graph = (
         pathlib.Path('/data/neural_collision_detection')
         / "results"
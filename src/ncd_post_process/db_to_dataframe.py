@@ -1,3 +1,4 @@
+import functools
 import multiprocessing
 import pathlib
 import multiprocessing as mp
@@ -9,11 +10,19 @@ from mpl_toolkits.mplot3d import Axes3D
 import numba
 import scipy.io
 
+from ncd_post_process.aggregator import rotation_matrix
+from ncd_post_process.collision_db import CollisionDB, DB_SUFFIX
+from ncd_post_process.voxel_accumulator import VoxelAccumulator
 
-def read_db_into_raw_df(fname) -> pd.DataFrame:
+DB_CHUNK_SIZE = 50000
+
+
+def read_db_into_raw_df(fname, chunksize=None) -> pd.DataFrame:
     """
     Basic functionality to read the current
     DB format into an unprocessed DataFrame.
+    If chunksize is given an iterator over DataFrames of
+    chunksize rows is returned instead.
     """
     column_names = [
         "run_id",
@@ -34,7 +43,8 @@ def read_db_into_raw_df(fname) -> pd.DataFrame:
         column_names[6]: str,
     }
     df = pd.read_csv(
-        fname, header=None, names=column_names, index_col=column_names[:3], dtype=dtypes
+        fname, header=None, names=column_names, index_col=column_names[:3], dtype=dtypes,
+        chunksize=chunksize,
     )
     return df
 
@@ -82,38 +92,36 @@ def parse_raw_df(df) -> pd.DataFrame:
     assert set(ordered_index_cols) == set(index_cols)
     df.set_index(ordered_index_cols, inplace=True, append=True)
 
-    # Parse collision coordinates into a new DataFrame, x-y-z as columns and the neuron name
-    # as a categorical index
+    # Parse collision coordinates into a new DataFrame, x-y-z as columns and the
+    # index of the row they came from as their index. Rows with no collisions
+    # get a single NaN collision.
     print("Parsing collisions...")
-    cols_list = []
-    for idx, data in df.collisions.items():
-        try:
-            split = data.replace("|", " ").split(" ")
-        except AttributeError:  # no collisions
-            arr = np.array([[np.nan, np.nan, np.nan]], dtype="float64")
-        else:
-            assert len(split) % 3 == 0  # x-y-z coords
-            arr = np.array(split, dtype="float64").reshape((-1, 3))
-        index_dict = {k: v for k, v in zip(df.index.names, idx)}
-        new_df = pd.DataFrame(
-            {
-                "coll_x": arr[:, 0],
-                "coll_y": arr[:, 1],
-                "coll_z": arr[:, 2],
-                **index_dict,
-            }
-        )
-        cols_list.append(new_df)
-
-    collisions = pd.concat(cols_list)
-
-    for col_name in ["run_id", "neuron", "vasc"]:
-        collisions[col_name] = collisions[col_name].astype("category")
-    collisions = collisions.set_index(df.index.names)
-
+    has_colls = df.collisions.notna().to_numpy()
+    colls_str = df.collisions[has_colls]
+    rows_per_placement = np.ones(len(df), dtype=np.int64)
+    rows_per_placement[has_colls] = colls_str.str.count(r"\|").to_numpy() + 1
+    parsed = np.fromstring(" ".join(colls_str).replace("|", " "), dtype="float64", sep=" ")
+    assert len(parsed) % 3 == 0  # x-y-z coords
+    arr = np.full((rows_per_placement.sum(), 3), np.nan)
+    arr[np.repeat(has_colls, rows_per_placement)] = parsed.reshape((-1, 3))
+
+    collisions = pd.DataFrame(
+        {"coll_x": arr[:, 0], "coll_y": arr[:, 1], "coll_z": arr[:, 2]},
+        index=df.index.repeat(rows_per_placement),
+    )
     return collisions
 
 
+def parse_db_in_chunks(fname, chunksize=DB_CHUNK_SIZE):
+    """
+    Reads and parses the DB chunksize rows at a time, yielding the
+    parsed collisions of each chunk. Use it for DBs that don't fit
+    into memory when parsed at once.
+    """
+    for raw_df in read_db_into_raw_df(fname, chunksize=chunksize):
+        yield parse_raw_df(raw_df)
+
+
 def get_stats(df: pd.DataFrame):
     rows = np.linspace(10000, 25000, 10, dtype=np.uint64)
     collisions_df = df.iloc[rows, :]
@@ -144,30 +152,69 @@ def convert_to_int(colls: pd.DataFrame):
     return colls
 
 
+def _pack_columns(columns):
+    keys = np.zeros(len(columns[0]), dtype=np.int64)
+    total_bits = 0
+    for column in columns:
+        column = np.asarray(column, dtype=np.int64)
+        if len(column) == 0:
+            return keys
+        low = column.min()
+        bits = max(int(column.max() - low).bit_length(), 1)
+        total_bits += bits
+        if total_bits > 63:
+            return None
+        keys = (keys << bits) | (column - low)
+    return keys
+
+
+def pack_int_columns(columns):
+    """Packs integer columns into a single int64 key per row, in a way which
+    keeps their lexicographic order. Each column gets just enough bits to hold
+    its range, or if that's too wide (e.g. NaNs cast to int), its number of
+    unique values. Returns None if they still don't fit into 63 bits."""
+    keys = _pack_columns(columns)
+    if keys is None:
+        keys = _pack_columns([np.unique(column, return_inverse=True)[1].ravel() for column in columns])
+    return keys
+
+
 def find_duplicate_colls(intcol: pd.DataFrame, colls: pd.DataFrame):
-    """Iterates over the DataFrame and finds locations which were registered
-    as having multiple collisions, while in effect they only had one collision,
-    but it was registered as more due to issues with the brute-force calc and our
-    actual resolution, which is on the order of 1 um.
+    """Finds locations which were registered as having multiple collisions,
+    while in effect they only had one collision, but it was registered as more
+    due to issues with the brute-force calc and our actual resolution, which is
+    on the order of 1 um.
+
+    Collisions are duplicates if they have the same integer coordinates and the
+    same placement (x, y, z). Each collision is packed together with its
+    placement into a single key, and the keys are deduplicated at once.
 
     This function will also change the coll_count to match the new value.
 
     Returns a filtered DF not containing these rows.
     """
-    non_dup_df = []
-    for ((_, intgroup), (_, realgroup)) in zip(intcol.groupby(['x', 'y', 'z']), colls.groupby(['x', 'y', 'z'])):
-        _, index = np.unique(intgroup.to_numpy(), return_index=True, axis=0)
-        relevant_rows = realgroup.iloc[index, :].reset_index(level='coll_count')
-        relevant_rows.loc[:, 'coll_count'] = len(relevant_rows)
-        relevant_rows = relevant_rows.set_index('coll_count', append=True)
-        non_dup_df.append(relevant_rows)
-
-    return pd.concat(non_dup_df)
+    placement = np.stack(
+        [colls.index.get_level_values(name).to_numpy() for name in ["x", "y", "z"]], axis=1
+    )
+    _, placement_id = np.unique(placement, axis=0, return_inverse=True)
+    placement_id = placement_id.ravel()
+    int_coords = intcol.to_numpy().astype(np.int64)
+    columns = [placement_id, int_coords[:, 0], int_coords[:, 1], int_coords[:, 2]]
+    keys = pack_int_columns(columns)
+    if keys is None:
+        _, index = np.unique(np.stack(columns, axis=1), axis=0, return_index=True)
+    else:
+        _, index = np.unique(keys, return_index=True)
+
+    relevant_rows = colls.iloc[index, :].reset_index(level='coll_count')
+    new_counts = np.bincount(placement_id[index])
+    relevant_rows.loc[:, 'coll_count'] = new_counts[placement_id[index]]
+    return relevant_rows.set_index('coll_count', append=True)
 
 
 def translate_colls(colls) -> np.ndarray:
     """ Translates the collisions back to the original coordinates """
-    colls_translated = colls.to_numpy()
+    colls_translated = colls.to_numpy(copy=True)
     colls_translated[:, 0] -= colls.index.get_level_values("x")
     colls_translated[:, 1] -= colls.index.get_level_values("y")
     colls_translated[:, 2] -= colls.index.get_level_values("z")
@@ -175,7 +222,12 @@ def translate_colls(colls) -> np.ndarray:
 
 
 def rotate_colls(colls: pd.DataFrame, colls_translated: np.ndarray) -> np.ndarray:
-    """ Rotates the translated collisions """
+    """ Rotates the translated collisions back into the neuron's frame.
+
+    All collisions which share a rotation are rotated by the same matrix, so the
+    matrices are computed once per unique rotation and applied in a single batch.
+    Gives the same result as calling "_rotate_single_coll" on each collision.
+    """
     rot = np.stack(
         (
             colls.index.get_level_values("roll").to_numpy(),
@@ -184,10 +236,19 @@ def rotate_colls(colls: pd.DataFrame, colls_translated: np.ndarray) -> np.ndarra
         ),
         axis=1,
     )
-    rotated_colls = [
-        _rotate_single_coll(rotx, coll) for rotx, coll in zip(rot, colls_translated)
-    ]
-    return rotated_colls
+    unique_rots, rot_idx = np.unique(rot, axis=0, return_inverse=True)
+    matrices = np.stack([inverse_rotation_matrix(*unique_rot) for unique_rot in unique_rots])
+    rotated_colls = np.einsum("nij,nj->ni", matrices[rot_idx.ravel()], np.asarray(colls_translated, dtype=np.float64))
+    return rotated_colls[:, [1, 0, 2]]
+
+
+@functools.lru_cache(maxsize=None)
+def inverse_rotation_matrix(roll, pitch, yaw) -> np.ndarray:
+    """ The inverse of the rotation the aggregator applied to the neuron.
+    Rotation matrices are orthonormal, so it's just the transpose. """
+    matrix = rotation_matrix((roll, pitch, yaw)).T
+    matrix.setflags(write=False)
+    return matrix
 
 
 def _rotate_single_coll(rot: np.ndarray, coll: np.ndarray) -> np.ndarray:
@@ -246,42 +307,78 @@ def count_collisions(colls, num_of_locs: int):
 
     Note: the return type is an array because it will be written to disk in .npy format.
     """
-    uniques, counts = np.unique(
-        colls, return_counts=True, axis=0
-    )
-    return uniques, counts / num_of_locs
+    accumulator = VoxelAccumulator()
+    accumulator.add(colls, num_of_locs)
+    return accumulator.result()
+
+
+def accumulate_db(fname: pathlib.Path, chunksize=DB_CHUNK_SIZE) -> VoxelAccumulator:
+    """Streams a CSV DB through the same steps as "mp_run", counting the
+    collisions per voxel chunk by chunk, so that memory use doesn't depend on
+    the size of the DB. Accumulators of several DBs can be combined with
+    VoxelAccumulator.merge.
+
+    Duplicates are only looked for inside a chunk, so a location which shows
+    up in two chunks (with different rotations) might keep a few more
+    collisions than "mp_run" would.
+    """
+    accumulator = VoxelAccumulator()
+    for raw_df in read_db_into_raw_df(fname, chunksize=chunksize):
+        num_of_locs = len(raw_df)
+        cols = parse_raw_df(raw_df)
+        intcols = convert_to_int(cols)
+        cols = find_duplicate_colls(intcols, cols)
+        colls_translated = translate_colls(cols)
+        colls_trans_rot = rotate_colls(cols, colls_translated).astype('int32')
+        accumulator.add(colls_trans_rot, num_of_locs)
+    return accumulator
+
+
+def find_agg_dbs(parent_folder: pathlib.Path, pattern="agg_results_*thresh_0.*"):
+    """
+    The aggregator DBs in the folder, one per DB name. A DB which was written
+    both as a CSV file and as a .ncdb file is only returned in its binary
+    form, since both give the same normalized results file.
+    """
+    dbs = {}
+    for fname in sorted(parent_folder.glob(pattern)):
+        if fname.suffix == DB_SUFFIX or (fname.suffix == ".csv" and fname.stem not in dbs):
+            dbs[fname.stem] = fname
+    return list(dbs.values())
 
 
 def mp_run(parent_folder: pathlib.Path, fname: pathlib.Path):
     """ Wrapper script to run this module on multiple cores """
     print(fname)
-    raw_df = read_db_into_raw_df(fname)
-    cols = parse_raw_df(raw_df)
+    if fname.suffix == DB_SUFFIX:
+        db = CollisionDB.open(fname)
+        num_of_locs = len(db)
+        cols = db.to_collisions_frame()
+    else:
+        raw_df = read_db_into_raw_df(fname)
+        num_of_locs = len(raw_df)
+        cols = parse_raw_df(raw_df)
     intcols = convert_to_int(cols)
     cols = find_duplicate_colls(intcols, cols)
     colls_translated = translate_colls(cols)
     colls_trans_rot = np.asarray(rotate_colls(cols, colls_translated))
     colls_trans_rot = colls_trans_rot.astype('int32')
-    num_of_locs = len(raw_df)
     unique_collisions, prob = count_collisions(colls_trans_rot, num_of_locs)
-    new_fname = pathlib.Path("normalized_" + fname.name)
+    new_fname = pathlib.Path("normalized_" + fname.stem)
     save_results(
         parent_folder / new_fname,
         np.asarray(colls_trans_rot),
         np.asarray(cols).astype('int32'),
         unique_collisions,
         prob,
-        len(raw_df),
+        num_of_locs,
     )
     return colls_trans_rot
 
 
 if __name__ == "__main__":
     parent_folder = pathlib.Path(r"/data/neural_collision_detection/results/2020_09_05")
-    all_args = [
-        (parent_folder, file)
-        for file in parent_folder.glob("agg_results_*thresh_0.csv")
-    ]
+    all_args = [(parent_folder, file) for file in find_agg_dbs(parent_folder)]
     with mp.Pool() as pool:
         colls = pool.starmap(mp_run, all_args)
     # colls = mp_run(*all_args[1])
@@ -1,16 +1,11 @@
-import enum
 import pathlib
-import sys
-import contextlib
 import multiprocessing as mp
-import functools
-import re
 
 import numpy as np
 import networkx as nx
 import attr
 import pandas as pd
-from attr.validators import instance_of, in_
+from attr.validators import instance_of
 import scipy.spatial.distance
 import matplotlib.pyplot as plt
 import numba as nb
@@ -19,88 +14,10 @@ from scipy.io import loadmat
 from ncd_post_process.alpha_shapes.alpha_shapes_cgal import (
     find_first_interior_alpha_shape_value,
 )
-
-sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "py3DN"))
-import mytools
-
-# Define basic types of points and trees - can't use an
-# Enum or class due to memory constraints
-POINTTYPE = ["standard", "node", "endpoint"]
-TREETYPE = [
-    "Axon0",
-    "Axon1",
-    "Dendrite0",
-    "Dendrite1",
-    "Dendrite2",
-    "Dendrite3",
-    "Dendrite4",
-    "Dendrite5",
-    "Dendrite6",
-]
-
-
-@attr.s(frozen=True, slots=True)
-class CollisionNode:
-    """
-    A single node on a neuronal tree.
-    It's frozen since it has to be hashable in order to
-    be allocated to a graph, and slots helps since we create thousands
-    of it.
-
-    :param int ord_number: Ordinal number of the point.
-    :param np.ndarray loc: a 3-sized vector with coordinates.
-    :param int ppid: parent point ID.
-    :param str ptype: Type of point, one of POINTTYPE's values
-    :param float radius: Radius of point
-    :param str tree_type: Type of tree, one of TREETYPE's values
-    :param np.float32 collision_chance: Probability of collision for the node
-    :param np.float32 dist_to_body: topological distance to the cell body
-    :param np.float32 alpha: Highest alpha value that contains this point
-    """
-
-    ord_number = attr.ib(validator=instance_of(int))
-    loc = attr.ib(validator=instance_of(tuple))
-    ppid = attr.ib(validator=instance_of(int))
-    ptype = attr.ib(validator=in_(POINTTYPE))
-    radius = attr.ib(validator=instance_of(float))
-    tree_type = attr.ib(validator=in_(TREETYPE))
-    collision_chance = attr.ib(default=np.float32(0), validator=instance_of(np.float32))
-    dist_to_body = attr.ib(default=np.float32(0), validator=instance_of(np.float32))
-    alpha = attr.ib(default=np.float32(np.nan), validator=instance_of(np.float32))
-
-    @classmethod
-    def from_str(cls, string):
-        """
-        Create an instance from a string representation (repr)
-        of the class.
-        Usually used when deserializing data.
-        """
-        all_matches_regex = re.compile(
-            r"ord_number=(\d+), loc=(\(.+?\)), ppid=(.+?), ptype='(\w+)', radius=(.+?), tree_type='(\w+)', collision_chance=(.+?), dist_to_body=(.+?), alpha=(.+?)\)"
-        )
-        matches = all_matches_regex.findall(string)[0]
-        ord_number = int(matches[0])
-        loc = eval(matches[1], {"__builtins__": tuple}, {})  # ¯\_(ツ)_/¯
-        ppid = int(matches[2])
-        ptype = matches[3]
-        radius = float(matches[4])
-        tree_type = matches[5]
-        collision_chance = np.float32(matches[6])
-        dist_to_body = np.float32(matches[7])
-        alpha = np.float32(matches[8])
-
-        return cls(
-            ord_number,
-            loc,
-            ppid,
-            ptype,
-            radius,
-            tree_type,
-            collision_chance,
-            dist_to_body,
-            alpha,
-        )
-
+from ncd_post_process.neuron_graph import GRAPH_SUFFIX, NeuronGraph
+# Re-exported for the scripts which used to find them here
+from ncd_post_process.neuron_graph import POINTTYPE, TREETYPE, CollisionNode  # noqa: F401
+from ncd_post_process.neuron_loader import ParsedNeuron, load_neurolucida_xml
 
 @attr.s
 class NeuronToGraph:
@@ -133,8 +50,8 @@ class NeuronToGraph:
     coll_prob = attr.ib(init=False)
     neuronal_points = attr.ib(init=False)
     closest_cell = attr.ib(init=False)
+    neuron_graph = attr.ib(init=False)
     graph = attr.ib(init=False)
-    collisions_df = attr.ib(init=False)
     closest_coll = attr.ib(init=False)
     alpha = attr.ib(init=False)
 
@@ -155,46 +72,45 @@ class NeuronToGraph:
             self.parent_folder, self.neuron_name, self.result_folder, self.thresh
         )
         # TODO: Find out why AP120412_s3c2 has weird probabilities in its graph
-        with load_neuron(self.parent_folder / "py3DN", neuron_fname) as neuron:
-            self.num_of_nodes = self._get_num_of_nodes(neuron)
-            self.neuronal_points = self._extract_neuronal_coords(
-                self.num_of_nodes, neuron
+        neuron = load_neuron(neuron_fname)
+        self.num_of_nodes = self._get_num_of_nodes(neuron)
+        self.neuronal_points = self._extract_neuronal_coords(
+            self.num_of_nodes, neuron
+        )
+        if self.with_collisions:
+            self.collisions = np.load(str(collisions_fname))["unique_coords"]
+            self.coll_prob = np.float32(np.load(str(collisions_fname))["coll_prob"])
+            self.closest_coll = connect_collisions_to_neural_points(
+                self.collisions, self.neuronal_points, self.inner_multiprocess
             )
-            if self.with_collisions:
-                self.collisions = np.load(str(collisions_fname))["unique_coords"]
-                self.coll_prob = np.float32(np.load(str(collisions_fname))["coll_prob"])
-                self.closest_coll = connect_collisions_to_neural_points(
-                    self.collisions, self.neuronal_points, self.inner_multiprocess
+            self.alpha = self._get_alpha_vec(
+                pathlib.Path(
+                    "/data/neural_collision_detection/results/with_alpha"
                 )
-                self.alpha = self._get_alpha_vec(
-                    pathlib.Path(
-                        "/data/neural_collision_detection/results/with_alpha"
-                    )
-                )
-                coll_prob = coerce_collisions_to_neural_coords(
-                    len(self.neuronal_points), self.closest_coll, self.coll_prob,
-                )
-
-            else:
-                coll_prob = np.zeros(self.num_of_nodes, dtype=np.float32)
-            self.collision_df = self._make_collision_df(
-                coll_prob, neuron, self.num_of_nodes, self.alpha
             )
+            coll_prob = coerce_collisions_to_neural_coords(
+                len(self.neuronal_points), self.closest_coll, self.coll_prob,
+            )
+
+        else:
+            coll_prob = np.zeros(self.num_of_nodes, dtype=np.float32)
+            self.alpha = None
+        self.neuron_graph = self._make_neuron_graph(
+            coll_prob, neuron, self.alpha
+        )
 
-        self.graph = self._generate_graph(self.collision_df)
         if self.with_plot:
+            # networkx graphs are only needed for plotting, and are slow to create
+            self.graph = self.neuron_graph.to_networkx()
             self._show_graph(
                 self.graph, title=self.neuron_name, fname=image_graph_fname
             )
         if self.with_serialize:
-            self._serialize_graph(self.graph, graph_fname)
+            self._serialize_graph(self.neuron_graph, graph_fname)
 
     def _get_num_of_nodes(self, neuron) -> int:
         """ Count number of nodes on an XML neuron """
-        num_of_nodes = 0
-        for tree in neuron.tree:
-            num_of_nodes += tree.total_rawpoints
-        return num_of_nodes
+        return neuron.total_rawpoints
 
     def _get_alpha_vec(self, path: pathlib.Path) -> np.ndarray:
         """Returns the smallest alpha shape per point which englufs it.
@@ -227,7 +143,7 @@ class NeuronToGraph:
             / f"normalized_agg_results_{neuron_name}_thresh_{thresh}.npz"
         )
         image_graph_fname = full_res_folder / f"image_graph_{neuron_name}"
-        graph_fname = full_res_folder / f"graph_{neuron_name}.gml"
+        graph_fname = full_res_folder / f"graph_{neuron_name}{GRAPH_SUFFIX}"
         return neuron_fname, collisions_fname, image_graph_fname, graph_fname
 
     def _extract_neuronal_coords(self, num_of_nodes: int, neuron):
@@ -238,19 +154,15 @@ class NeuronToGraph:
         neuronal_points = np.zeros((num_of_nodes, 3), dtype=np.float32)
         idx = 0
         for tree in neuron.tree:
-            for point in tree.rawpoint:
-                neuronal_points[idx] = point.P
-                idx += 1
+            neuronal_points[idx:idx + tree.total_rawpoints] = tree.P
+            idx += tree.total_rawpoints
         return pd.DataFrame(neuronal_points, columns=["x", "y", "z"])
 
-    def _make_collision_df(
-        self, collisions, neuron, num_of_nodes, alpha
-    ) -> pd.DataFrame:
+    def _make_neuron_graph(self, collisions, neuron, alpha) -> NeuronGraph:
         """
         Traverses the neuronal tree and the corresponding
-        collisions and generates a DF that will be transformed
-        into a graph, with its nodes being the metadata of that
-        point on the neuronal tree (the CollisionNode class).
+        collisions and generates the neuron's graph, with its
+        nodes being the metadata of that point on the neuronal tree.
         Edge weight in this graph is the topological distance
         between the two points.
 
@@ -259,74 +171,8 @@ class NeuronToGraph:
         :param Neuron neuron: A serialized neuron from py3DN.
         :param np.ndarray alpha: Alpha value per neuronal point.
         """
-        assert num_of_nodes == collisions.shape[0]
-
-        df = pd.DataFrame(
-            {
-                "source": np.zeros(num_of_nodes - neuron.total_trees, dtype=object),
-                "target": np.zeros(num_of_nodes - neuron.total_trees, dtype=object),
-                "weight": np.zeros(num_of_nodes - neuron.total_trees),
-            }
-        )
         print("Starting the tree parsing...")
-        pair_number = 0
-        for tree_idx, tree in enumerate(neuron.tree):
-            tree_type = f"{tree.type}{tree_idx}"
-            print(f"Parsing tree {tree_type}")
-            parent_node = CollisionNode(
-                ord_number=0,
-                loc=tuple(tree.rawpoint[0].P),
-                ppid=-1,
-                ptype="standard",
-                collision_chance=collisions[pair_number],
-                radius=tree.rawpoint[0].r,
-                tree_type=tree_type,
-                dist_to_body=np.float32(0),
-                alpha=np.float32(alpha[0]),
-            )
-            new_node = CollisionNode(
-                ord_number=1,
-                loc=tuple(tree.rawpoint[1].P),
-                ppid=0,
-                ptype=tree.rawpoint[1].ptype,
-                collision_chance=collisions[1],
-                radius=tree.rawpoint[1].r,
-                tree_type=tree_type,
-                dist_to_body=np.float32(0),
-                alpha=alpha[1],
-            )
-            weight = np.float32(0)
-            df.iloc[pair_number] = [parent_node, new_node, weight]
-            pair_number += 1
-            for point in tree.rawpoint[2:]:
-                prev_node = new_node
-                del new_node
-                try:
-                    weight = np.float32(mytools.Get_FiberDistance_Between_RawPoints(
-                        tree, 0, point.ppid
-                    ))
-                except IndexError:
-                    weight = np.float32(0)
-                new_node = CollisionNode(
-                    ord_number=pair_number + 1,
-                    loc=tuple(point.P),
-                    ppid=point.ppid,
-                    ptype=point.ptype,
-                    collision_chance=collisions[pair_number],
-                    radius=point.r,
-                    tree_type=tree_type,
-                    dist_to_body=weight,
-                    alpha=alpha[pair_number],
-                )
-
-                df.iloc[pair_number] = [prev_node, new_node, weight]
-                pair_number += 1
-        return df
-
-    def _generate_graph(self, df: pd.DataFrame):
-        return nx.convert_matrix.from_pandas_edgelist(
-            df, source="source", target="target", edge_attr=True, create_using=nx.Graph
-        )
+        return NeuronGraph.from_neuron(neuron, collisions, alpha)
 
     def _show_graph(self, g: nx.Graph, title: str = "Neuron", fname=None):
         fig, ax = plt.subplots()
@@ -341,14 +187,10 @@ class NeuronToGraph:
             for suffix in [".eps", ".png", ".pdf"]:
                 fig.savefig(str(fname) + suffix, transparent=True, dpi=300)
 
-    def _serialize_graph(self, g: nx.Graph, fname: pathlib.Path):
-        """ Write graph g to disk """
-        fname: str = str(fname)
-        if self.with_collisions:
-            fname = fname.replace(".gml", "_with_collisions.gml")
-        else:
-            fname = fname.replace(".gml", "_no_collisions.gml")
-        nx.write_gml(g, fname, repr)
+    def _serialize_graph(self, g: NeuronGraph, fname: pathlib.Path):
+        """ Write graph g to disk, see neuron_graph.load_neuron_graph """
+        suffix = "_with_collisions" if self.with_collisions else "_no_collisions"
+        g.save(fname.with_name(fname.stem + suffix + fname.suffix))
 
 
 @attr.s
@@ -403,17 +245,14 @@ class CsvNeuronToGraph:
         are attributed to the same neural point.
 
         Returns:
-        neural_points: Array of coordinates that make up the neuron.
-        closest_cell_idx: Index to the closest point on the cell contour to the given collision.
+        The collision chance of each point of the neuron.
         """
-        ntg = NeuronToGraph(neuron_name, str(self.results_folder), self.thresh)
         closest_coll = connect_collisions_to_neural_points(
             self.collisions, self.neuron_coords, multiprocessed=False
         )
-        coll_prob = coerce_collisions_to_neural_coords(
+        return coerce_collisions_to_neural_coords(
             len(self.neuron_coords), closest_coll, self.coll_prob
         )
-        collisions_df = ntg._make_collision_df(coll_prob)
 
 
 def connect_collisions_to_neural_points(
@@ -442,22 +281,13 @@ def dist_and_min(colls, neuronal_points):
     return dist.argmin(axis=0)
 
 
-@contextlib.contextmanager
-def load_neuron(py3dn_folder: pathlib.Path, fname: pathlib.Path):
+def load_neuron(fname: pathlib.Path) -> ParsedNeuron:
     """
-    Uses py3DN's Load_Neuron function to load an XML representation
-    of a NeuroLucida neuron into memory.
-    Uses a context manager since it mingles with sys.path, and
-    we wish to leave it unchanged at the end of the execution.
+    Loads the trees of a NeuroLucida XML neuron into memory, with the
+    parameters the pipeline always used for py3DN's Load_Neuron. Parsed
+    neurons are cached next to their XML file, see neuron_loader.
     """
-    sys.path.append(str(py3dn_folder))
-    import NeuroLucidaXMLParser
-
-    neuron = NeuroLucidaXMLParser.Load_Neuron(str(fname), 0.17, False)
-    try:
-        yield neuron
-    finally:
-        sys.path.pop(-1)
+    return load_neurolucida_xml(fname, minimal_d=0.17, remove_points=False)
 
 
 @nb.njit
@@ -31,12 +31,14 @@ class CollisionsAndDistance:
     """
 
     nrn_to_graph = attr.ib(validator=instance_of(NeuronToGraph))
+    graph = attr.ib(init=False)
     nodes_array = attr.ib(init=False)
     coll_topo_dist = attr.ib(init=False)
     coll_euclid_dist = attr.ib(init=False)
 
     def run(self):
         """ Main pipeline """
+        self.graph = self.nrn_to_graph.neuron_graph.to_networkx()
         self.nodes_array = self._create_nodes_array()
         print("Finding coords...")
         nodes_coords = self._find_coords_for_closest_nodes_per_coll(
@@ -57,7 +59,7 @@ class CollisionsAndDistance:
         which means that we need its size to be dynamic.
         """
         nodes_array = []
-        for node in self.nrn_to_graph.graph.nodes():
+        for node in self.graph.nodes():
             nodes_array.append(copy.deepcopy(node))
 
         nodes_array.sort(key=lambda elem: elem.ord_number)
@@ -75,7 +77,7 @@ class CollisionsAndDistance:
         to this object due to caching (AKA performance) reasons.
         """
         all_nodes_with_colls = self.nodes_array[closest_node_per_coll]
-        zipped_args = itertools.zip_longest(all_nodes_with_colls, [], fillvalue=self.nrn_to_graph.graph)
+        zipped_args = itertools.zip_longest(all_nodes_with_colls, [], fillvalue=self.graph)
         with multiprocessing.Pool() as pool:
             nodes_coords = pool.starmap(find_four_closest, zipped_args)
         return nodes_coords
@@ -22,7 +22,6 @@ class BranchDensity:
     neuron_fname = attr.ib(
         validator=instance_of(pathlib.Path)
     )  # a neuron from the NeuroLucida XML parser
-    py3dn_folder = attr.ib(validator=instance_of(pathlib.Path))
     neuron_coords = attr.ib(init=False)
     neuron_branch_coords = attr.ib(init=False)
     branch_counts = attr.ib(init=False)
@@ -34,11 +33,11 @@ class BranchDensity:
         """
         Runs the pipeline.
         """
-        with load_neuron(self.py3dn_folder, self.neuron_fname) as neuron:
-            num_of_nodes = self._get_num_of_nodes(neuron)
-            self.neuron_coords, self.neuron_branch_coords, self.tree_of_point = self._get_coords(
-                neuron, num_of_nodes
-            )
+        neuron = load_neuron(self.neuron_fname)
+        num_of_nodes = self._get_num_of_nodes(neuron)
+        self.neuron_coords, self.neuron_branch_coords, self.tree_of_point = self._get_coords(
+            neuron, num_of_nodes
+        )
         self.sphere_sizes, self.branch_counts = self._setup_data_structs()
         distances = self._calc_distance_bet_all_coords_and_branches()
         for radius in self.sphere_sizes:
@@ -47,10 +46,7 @@ class BranchDensity:
 
     def _get_num_of_nodes(self, neuron) -> int:
         """ Count number of nodes on an XML neuron """
-        num_of_nodes = 0
-        for tree in neuron.tree:
-            num_of_nodes += tree.total_rawpoints
-        return num_of_nodes
+        return neuron.total_rawpoints
 
     def _setup_data_structs(self):
         """
@@ -91,18 +87,13 @@ class BranchDensity:
         node_number = 0
         tree_names = name_neuron_trees(neuron)
         for tree, tree_name in zip(neuron.tree, tree_names):
-            for point in tree.rawpoint:
-                tree_of_point[coord_number] = tree_name
-                p = point.P
-                neuronal_coords[coord_number] = p
-                if (
-                    point.ptype == "standard"
-                    or point.ptype == "node"
-                    or point.ptype == "endpoint"
-                ):
-                    neuronal_nodes[node_number] = p
-                    node_number += 1
-                coord_number += 1
+            end = coord_number + tree.total_rawpoints
+            tree_of_point[coord_number:end] = tree_name
+            neuronal_coords[coord_number:end] = tree.P
+            nodes = tree.P[np.isin(tree.ptype, ["standard", "node", "endpoint"])]
+            neuronal_nodes[node_number:node_number + len(nodes)] = nodes
+            node_number += len(nodes)
+            coord_number = end
 
         return neuronal_coords, neuronal_nodes[:node_number], tree_of_point
 
@@ -199,8 +190,7 @@ if __name__ == "__main__":
         pathlib.Path(__file__).resolve().parents[3] / "data" / "neurons" / fname
         for fname in neuron_names
     ]
-    py3dn_folder = pathlib.Path(__file__).resolve().parents[2] / "py3DN"
     for nf in neurons[:1]:
-        branch_den = BranchDensity(nf, py3dn_folder)
+        branch_den = BranchDensity(nf)
         counts = branch_den.main()
         counts.hist()
@@ -6,35 +6,28 @@ as a function of their collision probability, as well as perhaps other independe
 import pathlib
 
 import pandas as pd
-import networkx as nx
-import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-from ncd_post_process.graph_parsing import load_neuron
-from ncd_post_process.graph_parsing import CollisionNode
+from ncd_post_process.neuron_graph import NeuronGraph, as_neuron_graph, load_neuron_graph
 
 
-def load_graph(fname: pathlib.Path):
+def load_graph(fname: pathlib.Path) -> NeuronGraph:
     """Loads a graph representation of a neuron."""
-    try:
-        graph = nx.readwrite.gml.read_gml(
-                str(fname), destringizer=CollisionNode.from_str
-                )
-    except FileNotFoundError:
-        raise
-    return graph
-
-
-def extract_collision_radius_from_graph(g: nx.Graph) -> pd.DataFrame:
-    """Iterates over a graph and extracts some properties of it to a
-    DataFrame."""
-    num_of_nodes = g.number_of_nodes()
-    columns = ['dist_to_body', 'radius', 'collision', 'tree_type']
-    data = pd.DataFrame(np.zeros((num_of_nodes, len(columns))), columns=columns)
-    for row, node in enumerate(g.nodes()):
-        data.iloc[row, :] = (node.dist_to_body, node.radius, node.collision_chance, node.tree_type)
-    return data
+    return load_neuron_graph(fname)
+
+
+def extract_collision_radius_from_graph(g: NeuronGraph) -> pd.DataFrame:
+    """Extracts some properties of a graph to a DataFrame."""
+    g = as_neuron_graph(g)
+    return pd.DataFrame(
+        {
+            'dist_to_body': g.dist_to_body,
+            'radius': g.radius,
+            'collision': g.collision_chance,
+            'tree_type': g.tree_type_names,
+        }
+    )
 
 
 def plot_radius_colls(df):
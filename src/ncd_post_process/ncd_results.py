@@ -0,0 +1,95 @@
+"""
+Reads ncd's binary output files (*.ncdr), written when ncd's output filename
+ends with .ncdr.
+
+The file is a fixed-size header, holding the neuron and vascular names and
+the angle grid of the rotations, followed by a fixed-size record for every
+rotation of every location. The layout is defined in
+src/ncd_core/result_writer.hpp. The records are memory-mapped as a NumPy
+structured array, so they can be filtered with vectorized masks instead of
+parsing text lines.
+"""
+import pathlib
+
+import attr
+from attr.validators import instance_of
+import numpy as np
+
+RESULTS_SUFFIX = ".ncdr"
+MAGIC = b"NCDRES"
+VERSION = 1
+NAME_LENGTH = 256
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("record_size", "<u4"),
+        ("min_x", "<i4"),
+        ("max_x", "<i4"),
+        ("min_y", "<i4"),
+        ("max_y", "<i4"),
+        ("min_z", "<i4"),
+        ("max_z", "<i4"),
+        ("max_num_of_collisions", "<i4"),
+        ("minimal_only", "<u4"),
+        ("neuron_name", f"S{NAME_LENGTH}"),
+        ("vascular_name", f"S{NAME_LENGTH}"),
+    ]
+)
+RECORD_DTYPE = np.dtype(
+    [
+        ("x", "<i4"),
+        ("y", "<i4"),
+        ("z", "<i4"),
+        ("r_x", "<i2"),
+        ("r_y", "<i2"),
+        ("r_z", "<i2"),
+        ("is_min", "u1"),
+        ("reserved", "u1"),
+        ("num_of_collisions", "<i4"),
+    ]
+)
+TEXT_COLUMNS = ("x", "y", "z", "r_x", "r_y", "r_z", "num_of_collisions", "is_min")
+
+
+@attr.s(frozen=True)
+class NcdResults:
+    """
+    The results of an ncd run.
+
+    :param np.void header: A HEADER_DTYPE record.
+    :param np.ndarray records: RECORD_DTYPE records, one per checked rotation.
+    """
+
+    header = attr.ib(validator=instance_of(np.void))
+    records = attr.ib(validator=instance_of(np.ndarray))
+
+    @classmethod
+    def open(cls, fname):
+        fname = pathlib.Path(fname)
+        header = np.fromfile(fname, dtype=HEADER_DTYPE, count=1)
+        if len(header) == 0 or header["magic"][0] != MAGIC:
+            raise ValueError(f"{fname} isn't an ncd results file")
+        if header["version"][0] != VERSION or header["record_size"][0] != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{fname} has an unsupported version")
+        if fname.stat().st_size > HEADER_DTYPE.itemsize:
+            records = np.memmap(fname, dtype=RECORD_DTYPE, mode="r", offset=HEADER_DTYPE.itemsize)
+        else:
+            records = np.zeros(0, RECORD_DTYPE)
+        return cls(header[0], records)
+
+    @property
+    def neuron_name(self):
+        return self.header["neuron_name"].decode()
+
+    @property
+    def vascular_name(self):
+        return self.header["vascular_name"].decode()
+
+    def to_lines(self, mask=None):
+        """The (masked) records as lines of ncd's text output. The collisions
+        filename isn't kept in the binary format, so that column is empty."""
+        records = self.records if mask is None else self.records[mask]
+        columns = np.stack([records[name].astype(np.int64) for name in TEXT_COLUMNS], axis=1)
+        prefix = self.neuron_name + ","
+        return [prefix + ",".join(map(str, row)) + ",\n" for row in columns.tolist()]
@@ -0,0 +1,398 @@
+"""
+A neuron's graph, as created by graph_parsing.NeuronToGraph, kept as NumPy
+arrays.
+
+Every point on the neuronal trees is a node, numbered by its position in the
+neuron (the trees' raw points one after the other), and each of its
+properties is kept in an array indexed by that number. The edges are kept as
+a CSR adjacency (indptr, indices and weights). A networkx graph of
+CollisionNode objects, which is what the pipeline used to pass around, is
+only created on demand by to_networkx.
+
+Graphs are saved as uncompressed .npz files, holding an array per field and
+the format version. Loading them memory-maps the arrays, so nothing is
+parsed and only the parts of the graph in use are read from the disk.
+"""
+import pathlib
+import re
+
+import attr
+from attr.validators import instance_of, in_
+import numpy as np
+import networkx as nx
+
+from ncd_post_process.neuron_loader import as_parsed_tree
+from ncd_post_process.npz_io import memmap_npz, save_npz
+from ncd_post_process.tree_distance import TreeDistance
+
+GRAPH_SUFFIX = ".npz"
+GRAPH_FORMAT_VERSION = 1
+
+# Define basic types of points and trees - can't use an
+# Enum or class due to memory constraints
+POINTTYPE = ["standard", "node", "endpoint"]
+TREETYPE = [
+    "Axon0",
+    "Axon1",
+    "Dendrite0",
+    "Dendrite1",
+    "Dendrite2",
+    "Dendrite3",
+    "Dendrite4",
+    "Dendrite5",
+    "Dendrite6",
+]
+
+
+def _float32_from_repr(text: str) -> np.float32:
+    """Parses a float32, which NumPy 2 reprs as np.float32(value)"""
+    prefix = "np.float32("
+    if text.startswith(prefix):
+        text = text[len(prefix):]
+    if text.endswith(")"):
+        text = text[:-1]
+    return np.float32(text)
+
+
+@attr.s(frozen=True, slots=True)
+class CollisionNode:
+    """
+    A single node on a neuronal tree.
+    It's frozen since it has to be hashable in order to
+    be allocated to a graph, and slots helps since we create thousands
+    of it.
+
+    :param int ord_number: Ordinal number of the point.
+    :param np.ndarray loc: a 3-sized vector with coordinates.
+    :param int ppid: parent point ID.
+    :param str ptype: Type of point, one of POINTTYPE's values
+    :param float radius: Radius of point
+    :param str tree_type: Type of tree, one of TREETYPE's values
+    :param np.float32 collision_chance: Probability of collision for the node
+    :param np.float32 dist_to_body: topological distance to the cell body
+    :param np.float32 alpha: Highest alpha value that contains this point
+    """
+
+    ord_number = attr.ib(validator=instance_of(int))
+    loc = attr.ib(validator=instance_of(tuple))
+    ppid = attr.ib(validator=instance_of(int))
+    ptype = attr.ib(validator=in_(POINTTYPE))
+    radius = attr.ib(validator=instance_of(float))
+    tree_type = attr.ib(validator=in_(TREETYPE))
+    collision_chance = attr.ib(default=np.float32(0), validator=instance_of(np.float32))
+    dist_to_body = attr.ib(default=np.float32(0), validator=instance_of(np.float32))
+    alpha = attr.ib(default=np.float32(np.nan), validator=instance_of(np.float32))
+
+    @classmethod
+    def from_str(cls, string):
+        """
+        Create an instance from a string representation (repr)
+        of the class.
+        Usually used when deserializing data.
+        """
+        all_matches_regex = re.compile(
+            r"ord_number=(\d+), loc=(\(.+?\)), ppid=(.+?), ptype='(\w+)', radius=(.+?), tree_type='(\w+)', collision_chance=(.+?), dist_to_body=(.+?), alpha=(.+?)\)"
+        )
+        matches = all_matches_regex.findall(string)[0]
+        ord_number = int(matches[0])
+        loc = eval(matches[1], {"__builtins__": tuple}, {})  # ¯\_(ツ)_/¯
+        ppid = int(matches[2])
+        ptype = matches[3]
+        radius = float(matches[4])
+        tree_type = matches[5]
+        collision_chance = _float32_from_repr(matches[6])
+        dist_to_body = _float32_from_repr(matches[7])
+        alpha = _float32_from_repr(matches[8])
+
+        return cls(
+            ord_number,
+            loc,
+            ppid,
+            ptype,
+            radius,
+            tree_type,
+            collision_chance,
+            dist_to_body,
+            alpha,
+        )
+
+
+def _type_codes(names, types) -> np.ndarray:
+    """Indices of the given names in the types list"""
+    lookup = {name: code for code, name in enumerate(types)}
+    try:
+        return np.array([lookup[name] for name in names], dtype=np.uint8)
+    except KeyError as e:
+        raise ValueError(f"Unknown type {e.args[0]}, expected one of {types}")
+
+
+def _make_csr(num_of_nodes: int, sources: np.ndarray, targets: np.ndarray, weights: np.ndarray):
+    """Symmetric CSR adjacency of the given undirected edges"""
+    rows = np.concatenate([sources, targets])
+    cols = np.concatenate([targets, sources])
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(num_of_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_of_nodes), out=indptr[1:])
+    return indptr, cols[order].astype(np.int64), np.concatenate([weights, weights])[order]
+
+
+@attr.s(frozen=True)
+class NeuronGraph:
+    """
+    A structure-of-arrays graph of a neuron. All arrays have an entry per
+    node, except for the adjacency ones. Use from_neuron or from_networkx to
+    create an instance.
+
+    :param np.ndarray ord_number: Ordinal number of each point.
+    :param np.ndarray ppid: Parent point ID of each point in its tree, -1 for
+        the first point of a tree.
+    :param np.ndarray parents: Index of each point's parent node, -1 for the
+        first point of a tree.
+    :param np.ndarray loc: (N, 3) array of the points' coordinates.
+    :param np.ndarray ptype: Type of each point, as an index into POINTTYPE.
+    :param np.ndarray radius: Radius of each point.
+    :param np.ndarray tree_type: Type of each point's tree, as an index into TREETYPE.
+    :param np.ndarray collision_chance: Probability of collision for each point.
+    :param np.ndarray dist_to_body: Topological distance of each point to the cell body.
+    :param np.ndarray alpha: Highest alpha value that contains each point.
+    :param np.ndarray indptr: The edges of node i are indices[indptr[i]:indptr[i + 1]].
+    :param np.ndarray indices: Neighbors of each node, sorted.
+    :param np.ndarray weights: Weight of each edge in indices.
+    """
+
+    ord_number = attr.ib(validator=instance_of(np.ndarray))
+    ppid = attr.ib(validator=instance_of(np.ndarray))
+    parents = attr.ib(validator=instance_of(np.ndarray))
+    loc = attr.ib(validator=instance_of(np.ndarray))
+    ptype = attr.ib(validator=instance_of(np.ndarray))
+    radius = attr.ib(validator=instance_of(np.ndarray))
+    tree_type = attr.ib(validator=instance_of(np.ndarray))
+    collision_chance = attr.ib(validator=instance_of(np.ndarray))
+    dist_to_body = attr.ib(validator=instance_of(np.ndarray))
+    alpha = attr.ib(validator=instance_of(np.ndarray))
+    indptr = attr.ib(validator=instance_of(np.ndarray))
+    indices = attr.ib(validator=instance_of(np.ndarray))
+    weights = attr.ib(validator=instance_of(np.ndarray))
+
+    @classmethod
+    def from_neuron(cls, neuron, collisions: np.ndarray, alpha: np.ndarray = None):
+        """
+        Creates the graph of a neuron.
+
+        Each point is connected to the point before it on its tree, with the
+        point's distance to the cell body as the edge weight. That distance is
+        the fiber distance from the tree's first point to the point's parent.
+
+        :param neuron: A ParsedNeuron, or a serialized neuron from py3DN.
+        :param np.ndarray collisions: Collision chance of each point of the
+            neuron, including the zeros.
+        :param np.ndarray alpha: Alpha value per neuronal point, or None if
+            it wasn't calculated.
+        """
+        trees = [as_parsed_tree(tree) for tree in neuron.tree]
+        num_of_nodes = sum(tree.total_rawpoints for tree in trees)
+        assert num_of_nodes == collisions.shape[0]
+        if alpha is None:
+            alpha = np.full(num_of_nodes, np.nan, dtype=np.float32)
+
+        ppid = np.full(num_of_nodes, -1, dtype=np.int64)
+        parents = np.full(num_of_nodes, -1, dtype=np.int64)
+        loc = np.zeros((num_of_nodes, 3), dtype=np.float64)
+        ptype = np.zeros(num_of_nodes, dtype=np.uint8)
+        radius = np.zeros(num_of_nodes, dtype=np.float64)
+        tree_type = np.zeros(num_of_nodes, dtype=np.uint8)
+        dist_to_body = np.zeros(num_of_nodes, dtype=np.float32)
+        sources, targets = [], []
+        start = 0
+        for tree_idx, tree in enumerate(trees):
+            end = start + tree.total_rawpoints
+            distances = TreeDistance.from_tree(tree)
+            tree_ppid = distances.parents
+            ppid[start:end] = tree_ppid
+            parents[start:end] = np.where(tree_ppid >= 0, tree_ppid + start, -1)
+            loc[start:end] = tree.P
+            # The first point is the root of the tree, whatever its type is
+            ptype[start + 1:end] = _type_codes(tree.ptype[1:], POINTTYPE)
+            radius[start:end] = tree.r
+            tree_type[start:end] = _type_codes([f"{tree.type}{tree_idx}"], TREETYPE)[0]
+            dist_to_body[start:end] = np.where(
+                tree_ppid >= 0, distances.fiber_distance(0, np.maximum(tree_ppid, 0)), 0
+            )
+            sources.append(np.arange(start, end - 1))
+            targets.append(np.arange(start + 1, end))
+            start = end
+
+        sources = np.concatenate(sources) if sources else np.zeros(0, dtype=np.int64)
+        targets = np.concatenate(targets) if targets else np.zeros(0, dtype=np.int64)
+        weights = dist_to_body[targets]
+        indptr, indices, weights = _make_csr(num_of_nodes, sources, targets, weights)
+        return cls(
+            np.arange(num_of_nodes, dtype=np.int64),
+            ppid,
+            parents,
+            loc,
+            ptype,
+            radius,
+            tree_type,
+            np.asarray(collisions, dtype=np.float32),
+            dist_to_body,
+            np.asarray(alpha, dtype=np.float32)[:num_of_nodes],
+            indptr,
+            indices,
+            weights,
+        )
+
+    @classmethod
+    def from_networkx(cls, graph: nx.Graph):
+        """Converts a networkx graph of CollisionNode instances, like the
+        ones serialized to .gml files by NeuronToGraph."""
+        nodes = list(graph.nodes())
+        num_of_nodes = len(nodes)
+        node_idx = {node: idx for idx, node in enumerate(nodes)}
+        ppid = np.array([node.ppid for node in nodes], dtype=np.int64)
+        tree_type = _type_codes([node.tree_type for node in nodes], TREETYPE)
+        # The points of each tree are consecutive, starting at its first point
+        codes, tree_starts = np.unique(tree_type, return_index=True)
+        first_node = np.zeros(len(TREETYPE), dtype=np.int64)
+        first_node[codes] = tree_starts
+        parents = np.where(ppid >= 0, first_node[tree_type] + ppid, -1)
+
+        edges = [(node_idx[u], node_idx[v], weight) for u, v, weight in graph.edges(data="weight", default=0)]
+        sources = np.array([edge[0] for edge in edges], dtype=np.int64)
+        targets = np.array([edge[1] for edge in edges], dtype=np.int64)
+        weights = np.array([edge[2] for edge in edges], dtype=np.float32)
+        indptr, indices, weights = _make_csr(num_of_nodes, sources, targets, weights)
+        return cls(
+            np.array([node.ord_number for node in nodes], dtype=np.int64),
+            ppid,
+            parents,
+            np.array([node.loc for node in nodes], dtype=np.float64).reshape(-1, 3),
+            _type_codes([node.ptype for node in nodes], POINTTYPE),
+            np.array([node.radius for node in nodes], dtype=np.float64),
+            tree_type,
+            np.array([node.collision_chance for node in nodes], dtype=np.float32),
+            np.array([node.dist_to_body for node in nodes], dtype=np.float32),
+            np.array([node.alpha for node in nodes], dtype=np.float32),
+            indptr,
+            indices,
+            weights,
+        )
+
+    @classmethod
+    def load(cls, fname):
+        """Loads a graph saved by save, memory-mapping its arrays."""
+        arrays = memmap_npz(fname)
+        version = arrays.pop("format_version", None)
+        if version is None or int(version) != GRAPH_FORMAT_VERSION:
+            raise ValueError(f"{fname} has an unsupported version")
+        fields = [field.name for field in attr.fields(cls)]
+        if sorted(arrays) != sorted(fields):
+            raise ValueError(f"{fname} isn't a neuron graph file")
+        return cls(**arrays)
+
+    def save(self, fname):
+        """Saves the graph to an .npz file."""
+        save_npz(
+            fname,
+            format_version=np.array(GRAPH_FORMAT_VERSION),
+            **attr.asdict(self, recurse=False),
+        )
+
+    @property
+    def num_of_nodes(self) -> int:
+        return len(self.ord_number)
+
+    @property
+    def tree_type_names(self) -> np.ndarray:
+        return np.array(TREETYPE)[self.tree_type]
+
+    @property
+    def is_axon(self) -> np.ndarray:
+        return np.char.startswith(np.array(TREETYPE), "Axon")[self.tree_type]
+
+    @property
+    def is_dendrite(self) -> np.ndarray:
+        return np.char.startswith(np.array(TREETYPE), "Dend")[self.tree_type]
+
+    def neighbors(self, idx: int) -> np.ndarray:
+        return self.indices[self.indptr[idx]:self.indptr[idx + 1]]
+
+    def to_nodes(self) -> list:
+        """A CollisionNode per node"""
+        return [
+            CollisionNode(
+                ord_number=ord_number,
+                loc=tuple(loc),
+                ppid=ppid,
+                ptype=POINTTYPE[ptype],
+                radius=radius,
+                tree_type=TREETYPE[tree_type],
+                collision_chance=collision_chance,
+                dist_to_body=dist_to_body,
+                alpha=alpha,
+            )
+            for ord_number, loc, ppid, ptype, radius, tree_type, collision_chance, dist_to_body, alpha in zip(
+                self.ord_number.tolist(),
+                self.loc.tolist(),
+                self.ppid.tolist(),
+                self.ptype.tolist(),
+                self.radius.tolist(),
+                self.tree_type.tolist(),
+                self.collision_chance,
+                self.dist_to_body,
+                self.alpha,
+            )
+        ]
+
+    def to_networkx(self) -> nx.Graph:
+        """A networkx graph of CollisionNode instances, with the weight of
+        every edge as its attribute"""
+        nodes = self.to_nodes()
+        graph = nx.Graph()
+        graph.add_nodes_from(nodes)
+        sources = np.repeat(np.arange(self.num_of_nodes), np.diff(self.indptr))
+        is_first = sources < self.indices
+        graph.add_edges_from(
+            (nodes[source], nodes[target], {"weight": weight})
+            for source, target, weight in zip(
+                sources[is_first].tolist(),
+                self.indices[is_first].tolist(),
+                self.weights[is_first].astype(np.float64).tolist(),
+            )
+        )
+        return graph
+
+
+def load_neuron_graph(fname) -> NeuronGraph:
+    """
+    Loads a graph that NeuronToGraph serialized, either to an .npz file or to
+    a .gml file. A .gml file is converted once to an .npz file next to it,
+    which is used from then on unless the .gml file changes.
+    """
+    fname = pathlib.Path(fname)
+    if fname.suffix == GRAPH_SUFFIX:
+        return NeuronGraph.load(fname)
+
+    cached = fname.with_suffix(GRAPH_SUFFIX)
+    if cached.exists() and (
+        not fname.exists() or cached.stat().st_mtime >= fname.stat().st_mtime
+    ):
+        try:
+            return NeuronGraph.load(cached)
+        except ValueError:
+            pass
+    graph = nx.readwrite.gml.read_gml(str(fname), destringizer=CollisionNode.from_str)
+    neuron_graph = NeuronGraph.from_networkx(graph)
+    try:
+        neuron_graph.save(cached)
+    except OSError:
+        pass
+    return neuron_graph
+
+
+def as_neuron_graph(graph) -> NeuronGraph:
+    """Converter for attributes holding a neuron's graph, which may be given
+    as a networkx graph of CollisionNode instances."""
+    if isinstance(graph, nx.Graph):
+        return NeuronGraph.from_networkx(graph)
+    return graph
@@ -0,0 +1,369 @@
+"""
+Loading NeuroLucida XML neurons, with a cache of the parsed trees.
+
+The XML file is parsed with a streaming parser that follows the rules of
+py3DN's Load_Neuron for the raw points of the neuron's trees: their
+coordinates, radii, parent points, bifurcation levels and point types. Each
+tree's points are kept as arrays instead of a RAWPOINT object per point.
+
+The parsed neuron is cached in an uncompressed .npz file next to the XML file,
+with the arrays of all trees concatenated. Later loads memory-map the cache
+instead of parsing the XML again. The cache holds the XML file's size,
+modification time and SHA-256 hash, and is only used while the file is
+unchanged, checking the hash only if the modification time differs.
+"""
+import collections
+import hashlib
+import pathlib
+import xml.etree.ElementTree as ET
+
+import attr
+from attr.validators import instance_of
+import numpy as np
+
+from ncd_post_process.npz_io import memmap_npz, save_npz
+
+NEURON_CACHE_SUFFIX = ".neuron.npz"
+NEURON_CACHE_FORMAT_VERSION = 1
+DEFAULT_MINIMAL_D = 0.17
+
+# The arrays of a tree with an entry per point
+_POINT_FIELDS = ("P", "r", "ppid", "level", "ptype", "contact")
+
+RawPoint = collections.namedtuple("RawPoint", "P r ppid level ptype contact")
+
+
+class _RawPoints:
+    """A read-only sequence of RawPoint tuples, created on access from the
+    arrays of a ParsedTree. It stands in for a py3DN tree's rawpoint list."""
+
+    def __init__(self, tree):
+        self._tree = tree
+
+    def __len__(self):
+        return len(self._tree.r)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        tree = self._tree
+        return RawPoint(
+            tree.P[idx].tolist(),
+            float(tree.r[idx]),
+            int(tree.ppid[idx]),
+            int(tree.level[idx]),
+            str(tree.ptype[idx]),
+            bool(tree.contact[idx]),
+        )
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+
+@attr.s(frozen=True)
+class ParsedTree:
+    """
+    A single tree of a neuron, with an array entry per raw point.
+
+    :param str type: The tree's type, e.g. Axon or Dendrite.
+    :param str color: Color of the tree in the XML file.
+    :param str leaf: Type of the tree's ending.
+    :param np.ndarray P: An (N, 3) array of the points' coordinates.
+    :param np.ndarray r: Radius of each point.
+    :param np.ndarray ppid: Parent point index of each point, -1 for the first.
+    :param np.ndarray level: Bifurcation level of each point.
+    :param np.ndarray ptype: Type of each point - standard, node or endpoint.
+    :param np.ndarray contact: Whether a spine or a varicosity is on the point.
+    """
+
+    type = attr.ib(validator=instance_of(str))
+    color = attr.ib(validator=instance_of(str))
+    leaf = attr.ib(validator=instance_of(str))
+    P = attr.ib(validator=instance_of(np.ndarray))
+    r = attr.ib(validator=instance_of(np.ndarray))
+    ppid = attr.ib(validator=instance_of(np.ndarray))
+    level = attr.ib(validator=instance_of(np.ndarray))
+    ptype = attr.ib(validator=instance_of(np.ndarray))
+    contact = attr.ib(validator=instance_of(np.ndarray))
+
+    @classmethod
+    def from_points(cls, type, color, leaf, P, r, ppid, level, ptype, contact):
+        """From a sequence of values per point for each of the arrays."""
+        return cls(
+            str(type),
+            str(color),
+            str(leaf),
+            np.array(P, dtype=np.float64).reshape(-1, 3),
+            np.array(r, dtype=np.float64),
+            np.array(ppid, dtype=np.int64),
+            np.array(level, dtype=np.int64),
+            np.array(ptype, dtype="<U8"),
+            np.array(contact, dtype=bool),
+        )
+
+    @classmethod
+    def from_py3dn(cls, tree):
+        """From a py3DN tree, using its raw points."""
+        points = tree.rawpoint
+        return cls.from_points(
+            tree.type,
+            tree.color,
+            tree.leaf,
+            [point.P for point in points],
+            [point.r for point in points],
+            [point.ppid for point in points],
+            [point.level for point in points],
+            [point.ptype for point in points],
+            [bool(point.contact) for point in points],
+        )
+
+    @property
+    def total_rawpoints(self) -> int:
+        return len(self.r)
+
+    @property
+    def rawpoint(self) -> _RawPoints:
+        """The points as py3DN-like raw points, for code that iterates them."""
+        return _RawPoints(self)
+
+
+def as_parsed_tree(tree) -> ParsedTree:
+    """A ParsedTree of either a ParsedTree or a py3DN tree."""
+    if isinstance(tree, ParsedTree):
+        return tree
+    return ParsedTree.from_py3dn(tree)
+
+
+@attr.s(frozen=True)
+class ParsedNeuron:
+    """
+    The trees of a NeuroLucida neuron.
+
+    :param list tree: The neuron's ParsedTree instances, in the XML file's order.
+    """
+
+    tree = attr.ib(validator=instance_of(list))
+
+    @property
+    def total_trees(self) -> int:
+        return len(self.tree)
+
+    @property
+    def total_rawpoints(self) -> int:
+        return sum(tree.total_rawpoints for tree in self.tree)
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        """From the arrays to_arrays created, with the points of all trees
+        concatenated. Each tree gets views of the arrays."""
+        offsets = arrays["tree_offsets"]
+        trees = []
+        for idx, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+            trees.append(
+                ParsedTree(
+                    str(arrays["tree_type"][idx]),
+                    str(arrays["tree_color"][idx]),
+                    str(arrays["tree_leaf"][idx]),
+                    *(arrays[name][start:end] for name in _POINT_FIELDS),
+                )
+            )
+        return cls(trees)
+
+    def to_arrays(self) -> dict:
+        """The neuron's trees as arrays, their points concatenated."""
+        arrays = {
+            "tree_offsets": np.cumsum([0] + [tree.total_rawpoints for tree in self.tree], dtype=np.int64),
+            "tree_type": np.array([tree.type for tree in self.tree], dtype=str),
+            "tree_color": np.array([tree.color for tree in self.tree], dtype=str),
+            "tree_leaf": np.array([tree.leaf for tree in self.tree], dtype=str),
+        }
+        # An empty tree gives the arrays their dtypes when there are no trees
+        empty = ParsedTree.from_points("", "", "", *([] for _ in _POINT_FIELDS))
+        for name in _POINT_FIELDS:
+            arrays[name] = np.concatenate(
+                [getattr(empty, name)] + [getattr(tree, name) for tree in self.tree]
+            )
+        return arrays
+
+
+class _TreeBuilder:
+    """Collects the raw points of a single tree during parsing, following
+    the rules of py3DN's Trees_Handle."""
+
+    def __init__(self, attrib: dict, minimal_radius: float, remove_points: bool):
+        self.attrib = dict(attrib)
+        self.minimal_radius = minimal_radius
+        self.remove_points = remove_points
+        self.P, self.r, self.ppid, self.level, self.ptype, self.contact = [], [], [], [], [], []
+        self.ppid_stack = [-1]
+        self.branch_trigger = False
+
+    def add_point(self, attrib: dict):
+        P = [float(attrib["x"]), float(attrib["y"]), float(attrib["z"])]
+        r = max(0.5 * float(attrib["d"]), self.minimal_radius)
+        if self.branch_trigger:
+            ppid = self.ppid_stack[-1]
+            self.branch_trigger = False
+        else:
+            ppid = len(self.r) - 1
+        if self.remove_points and self.r:
+            if np.linalg.norm(np.subtract(P, self.P[ppid])) < self.minimal_radius:
+                return
+        self.P.append(P)
+        self.r.append(r)
+        self.ppid.append(ppid)
+        self.level.append(len(self.ppid_stack) - 1)
+        self.ptype.append("standard")
+        self.contact.append(False)
+
+    def add_branch(self, branch_level: int):
+        """:param int branch_level: Number of branches the branch is nested in."""
+        self.branch_trigger = True
+        level = len(self.ppid_stack) - 1
+        if not self.r:
+            return
+        if branch_level == level:
+            # Going down a ramification, from the last point
+            self.ppid_stack.append(len(self.r) - 1)
+            self.ptype[-1] = "node"
+        elif branch_level < level:
+            # Going up, back to the point the ramification started at
+            for _ in range(level - branch_level - 1):
+                self.ppid_stack.pop()
+            self.ptype[-1] = "endpoint"
+
+    def add_spine(self):
+        if self.contact:
+            self.contact[-1] = True
+
+    def add_varicosity(self, attrib: dict):
+        """Marks the point the varicosity is on, looking for it up the tree."""
+        P = [float(attrib["x"]), float(attrib["y"]), float(attrib["z"])]
+        ppid = len(self.r) - 1
+        while ppid > -1:
+            if self.P[ppid] == P:
+                self.contact[ppid] = True
+                break
+            ppid = self.ppid[ppid]
+
+    def build(self) -> ParsedTree:
+        if self.ptype:
+            self.ptype[-1] = "endpoint"
+        return ParsedTree.from_points(
+            self.attrib["type"],
+            self.attrib["color"],
+            self.attrib["leaf"],
+            *(getattr(self, name) for name in _POINT_FIELDS),
+        )
+
+
+def _local_name(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+
+def parse_neurolucida_xml(fname, minimal_d: float = DEFAULT_MINIMAL_D, remove_points: bool = False) -> ParsedNeuron:
+    """
+    Parses the trees of a NeuroLucida XML file, as py3DN's Load_Neuron does,
+    without keeping the document in memory. Contours aren't parsed.
+
+    :param fname: The XML file.
+    :param float minimal_d: Smaller diameters are set to this one.
+    :param bool remove_points: Whether to discard points closer than
+        minimal_d / 2 to their parent point.
+    """
+    minimal_radius = 0.5 * minimal_d
+    trees = []
+    builder = None
+    tags = []
+    for event, elem in ET.iterparse(str(fname), events=("start", "end")):
+        tag = _local_name(elem.tag)
+        if event == "start":
+            tags.append(tag)
+            if len(tags) == 2 and tag == "tree":
+                builder = _TreeBuilder(elem.attrib, minimal_radius, remove_points)
+            elif builder is None:
+                pass
+            elif tag == "point" and tags[-2] not in ("marker", "spine"):
+                builder.add_point(elem.attrib)
+            elif tag == "branch":
+                builder.add_branch(tags.count("branch") - 1)
+            elif tag == "spine":
+                builder.add_spine()
+            continue
+
+        tags.pop()
+        if builder is not None:
+            if tag == "marker" and elem.get("varicosity") == "true":
+                point = next(child for child in elem if _local_name(child.tag) == "point")
+                builder.add_varicosity(point.attrib)
+            elif len(tags) == 1 and tag == "tree":
+                trees.append(builder.build())
+                builder = None
+        # Markers and spines need their points until they end
+        if len(tags) > 0 and tags[-1] not in ("marker", "spine"):
+            elem.clear()
+    return ParsedNeuron(trees)
+
+
+def _hash_file(fname: pathlib.Path) -> str:
+    sha = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def load_neurolucida_xml(fname, minimal_d: float = DEFAULT_MINIMAL_D, remove_points: bool = False) -> ParsedNeuron:
+    """
+    Loads the trees of a NeuroLucida XML file, from its cache if it has an
+    up to date one, and otherwise parses it and caches the result. The
+    arguments are those of parse_neurolucida_xml.
+    """
+    fname = pathlib.Path(fname)
+    cached = fname.with_name(fname.stem + NEURON_CACHE_SUFFIX)
+    stat = fname.stat()
+    content_hash = None
+    try:
+        arrays = memmap_npz(cached)
+    except (OSError, ValueError):
+        arrays = {}
+    if (
+        arrays.get("format_version") == NEURON_CACHE_FORMAT_VERSION
+        and arrays["minimal_d"] == minimal_d
+        and arrays["remove_points"] == remove_points
+    ):
+        if arrays["source_size"] == stat.st_size and arrays["source_mtime_ns"] == stat.st_mtime_ns:
+            return ParsedNeuron.from_arrays(arrays)
+        content_hash = _hash_file(fname)
+        if arrays["source_hash"] == content_hash:
+            # Only the file's metadata changed, so it's updated in the cache
+            # to spare hashing the file on the next loads
+            _save_neuron_cache(
+                cached, dict(arrays, source_size=np.array(stat.st_size), source_mtime_ns=np.array(stat.st_mtime_ns))
+            )
+            return ParsedNeuron.from_arrays(arrays)
+
+    content_hash = content_hash or _hash_file(fname)
+    neuron = parse_neurolucida_xml(fname, minimal_d, remove_points)
+    _save_neuron_cache(
+        cached,
+        dict(
+            format_version=np.array(NEURON_CACHE_FORMAT_VERSION),
+            minimal_d=np.array(minimal_d, dtype=np.float64),
+            remove_points=np.array(remove_points),
+            source_size=np.array(stat.st_size),
+            source_mtime_ns=np.array(stat.st_mtime_ns),
+            source_hash=np.array(content_hash),
+            **neuron.to_arrays(),
+        ),
+    )
+    return neuron
+
+
+def _save_neuron_cache(cached, arrays):
+    """The cache is optional, so failing to write it, e.g. to a read only
+    folder, isn't an error."""
+    try:
+        save_npz(cached, **arrays)
+    except OSError:
+        pass
@@ -0,0 +1,65 @@
+"""
+Saving and memory-mapping the uncompressed .npz files the post processing
+caches its data in.
+"""
+import os
+import pathlib
+import struct
+import zipfile
+
+import numpy as np
+
+
+def memmap_npz(fname) -> dict:
+    """
+    Memory-maps the arrays of an .npz file written by np.savez, by name.
+    np.load can't memory-map .npz members, but as they're stored uncompressed,
+    each as a .npy file inside the zip, they're mapped right at their data's
+    offset in the file. Raises ValueError if the file isn't an .npz file.
+    """
+    fname = pathlib.Path(fname)
+    arrays = {}
+    try:
+        archive = zipfile.ZipFile(fname)
+    except zipfile.BadZipFile:
+        raise ValueError(f"{fname} isn't an .npz file")
+    with archive, open(fname, "rb") as f:
+        for info in archive.infolist():
+            name = os.path.splitext(info.filename)[0]
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = np.load(archive.open(info))
+                continue
+            # The data follows the local file header, whose name and extra
+            # field lengths may differ from the ones in the central directory
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError(f"{fname} holds Python objects")
+            if np.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(
+                fname, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+def save_npz(fname, **arrays):
+    """Saves the arrays to an uncompressed .npz file. It's written to a
+    temporary file and renamed, so readers never see a partial file."""
+    fname = pathlib.Path(fname)
+    tmp_fname = fname.with_name(f"{fname.name}.tmp.{os.getpid()}")
+    try:
+        with open(tmp_fname, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_fname, fname)
+    finally:
+        if tmp_fname.exists():
+            tmp_fname.unlink()
@@ -0,0 +1,208 @@
+"""
+Output stage of the aggregator.
+
+Workers don't write to the DB themselves. They push their results into a
+QueueResultSink, and a single process drains the queue into a CsvResultSink,
+an NpzResultSink or a collision_db.CollisionDBWriter, which write in large
+buffered batches.
+"""
+import pathlib
+from queue import Empty
+
+import attr
+from attr.validators import instance_of
+import numpy as np
+
+from ncd_post_process.aggregator import format_db_line
+from ncd_post_process.collision_db import CollisionDBWriter, DB_SUFFIX
+
+CSV_BUFFER_SIZE = 1000
+NPZ_SHARD_SIZE = 20000
+QUEUE_BATCH_SIZE = 64
+DRAIN_POLL_SECONDS = 5
+
+
+@attr.s
+class CsvResultSink:
+    """
+    Writes results as lines of the aggregator's CSV DB, appending them to the
+    file in batches.
+
+    :param str fname: Output DB.
+    :param int buffer_size: Number of results to keep before writing.
+    """
+
+    fname = attr.ib(converter=str)
+    buffer_size = attr.ib(default=CSV_BUFFER_SIZE, validator=instance_of(int))
+    _lines = attr.ib(factory=list, init=False, repr=False)
+
+    def add(self, neuron_id, vascular_id, location, rotation, collisions):
+        self._lines.append(format_db_line(neuron_id, vascular_id, location, rotation, collisions))
+        if len(self._lines) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            with open(self.fname, "a") as f:
+                f.write("".join(self._lines))
+            self._lines = []
+
+    def close(self):
+        self.flush()
+
+    def abort(self):
+        """Drops the buffered lines. The file is only opened while writing."""
+        self._lines = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@attr.s
+class NpzResultSink:
+    """
+    Writes results in a columnar binary form, as numbered .npz shards next to
+    the given filename (agg.npz -> agg_00000.npz, agg_00001.npz, ...).
+
+    Each shard holds one row per placement in neuron_id, vascular_id,
+    location, rotation and count, and the collisions of all placements as a
+    single float32 (K, 3) array. The collisions of placement i are
+    collisions[offsets[i]:offsets[i + 1]].
+
+    :param str fname: Base name of the shards.
+    :param int shard_size: Number of placements per shard.
+    """
+
+    fname = attr.ib(converter=pathlib.Path)
+    shard_size = attr.ib(default=NPZ_SHARD_SIZE, validator=instance_of(int))
+    _rows = attr.ib(factory=list, init=False, repr=False)
+    _shard_count = attr.ib(default=0, init=False, repr=False)
+
+    def add(self, neuron_id, vascular_id, location, rotation, collisions):
+        self._rows.append((neuron_id, vascular_id, location, rotation, np.asarray(collisions, np.float32)))
+        if len(self._rows) >= self.shard_size:
+            self.flush()
+
+    def shard_fname(self, shard_idx):
+        return self.fname.with_name(f"{self.fname.stem}_{shard_idx:05d}.npz")
+
+    def flush(self):
+        if not self._rows:
+            return
+        neuron_ids, vascular_ids, locations, rotations, collisions = zip(*self._rows)
+        counts = np.array([len(c) for c in collisions], dtype=np.int64)
+        np.savez(
+            self.shard_fname(self._shard_count),
+            neuron_id=np.array(neuron_ids),
+            vascular_id=np.array(vascular_ids),
+            location=np.array(locations, dtype=np.int64).reshape(-1, 3),
+            rotation=np.array(rotations, dtype=np.int64).reshape(-1, 3),
+            count=counts,
+            offsets=np.concatenate(([0], np.cumsum(counts))),
+            collisions=np.concatenate(collisions).reshape(-1, 3),
+        )
+        self._shard_count += 1
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+    def abort(self):
+        """Drops the buffered rows. Shards are only opened while writing."""
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@attr.s
+class QueueResultSink:
+    """
+    Used inside worker processes. Sends results, in small batches, to the
+    process which owns the actual sink (see ``drain_results``).
+
+    :param multiprocessing.Queue queue: Queue read by the writing process.
+    :param int batch_size: Number of results sent together.
+    """
+
+    queue = attr.ib()
+    batch_size = attr.ib(default=QUEUE_BATCH_SIZE, validator=instance_of(int))
+    _batch = attr.ib(factory=list, init=False, repr=False)
+
+    def add(self, neuron_id, vascular_id, location, rotation, collisions):
+        self._batch.append((neuron_id, vascular_id, tuple(int(a) for a in location),
+                            tuple(int(a) for a in rotation), np.asarray(collisions)))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self.queue.put(self._batch)
+            self._batch = []
+
+    def close(self):
+        """Flushes and tells the writer this worker is done."""
+        self.flush()
+        self.queue.put(None)
+
+
+def make_result_sink(fname):
+    """A CollisionDBWriter for a .ncdb filename, an NpzResultSink for a .npz
+    filename, and a CsvResultSink otherwise."""
+    suffix = pathlib.Path(fname).suffix
+    if suffix == DB_SUFFIX:
+        return CollisionDBWriter(fname)
+    if suffix == ".npz":
+        return NpzResultSink(fname)
+    return CsvResultSink(fname)
+
+
+def drain_results(queue, sink, producers, poll_seconds=DRAIN_POLL_SECONDS):
+    """Moves results from the queue into the sink until every one of the
+    producer processes closed its QueueResultSink, and then closes the sink.
+
+    While the queue is empty the producers are checked every poll_seconds,
+    and a RuntimeError is raised if one of them died without closing its
+    sink, e.g. when it was killed or crashed, instead of waiting for it forever.
+    On errors the sink is aborted rather than closed, so an .ncdb DB isn't
+    marked as complete.
+    """
+    done = 0
+
+    def handle(batch):
+        if batch is None:
+            return 1
+        for result in batch:
+            sink.add(*result)
+        return 0
+
+    try:
+        while done < len(producers):
+            try:
+                done += handle(queue.get(timeout=poll_seconds))
+                continue
+            except Empty:
+                pass
+            # A process flushes everything it sent before it exits, so once
+            # it's seen dead its sentinel is in the queue. The dead ones are
+            # found before reading the rest of the queue, as a worker may send
+            # its sentinel and exit right after the timeout.
+            dead = [p for p in producers if not p.is_alive()]
+            try:
+                while done < len(producers):
+                    done += handle(queue.get_nowait())
+            except Empty:
+                pass
+            if len(dead) > done:
+                exitcodes = [p.exitcode for p in dead]
+                raise RuntimeError(f"A worker died without sending its results, exit codes: {exitcodes}")
+    except BaseException:
+        sink.abort()
+        raise
+    sink.close()
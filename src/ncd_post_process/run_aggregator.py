@@ -4,13 +4,17 @@ import os, sys, re
 import multiprocessing
 import pathlib
 
-import numpy as np
-import pandas as pd
-
 from ncd_post_process.aggregator import aggregate, get_vascular
+from ncd_post_process.vascular_index import share_vascular_index, attach_vascular_index
+from ncd_post_process.result_sink import QueueResultSink, make_result_sink, drain_results
+from ncd_post_process.ncd_results import NcdResults, RESULTS_SUFFIX
 
 
 def get_ncd_results(ncd_output_file, max_collisions):
+    if pathlib.Path(ncd_output_file).suffix == RESULTS_SUFFIX:
+        ncd_results = NcdResults.open(ncd_output_file)
+        return ncd_results.to_lines(ncd_results.records["num_of_collisions"] <= max_collisions)
+
     results = []
     with open(ncd_output_file, "r") as f:
         for l in f:
@@ -23,93 +27,134 @@ def get_ncd_results(ncd_output_file, max_collisions):
     return results
 
 
-def process_main(results, output_fname, threshold_distance, vascular):
+DATA_FOLDER = pathlib.Path('/data/neural_collision_detection')
+CHUNK_SIZE = 8
+
+
+def ncd_result_cost(result):
+    """
+    A rough estimate of how long aggregating a single NCD result line takes.
+    The number of collisions NCD found is a good proxy for how dense the
+    vasculature around the placement is.
+    """
+    return int(result.split(",")[7])
+
+
+def neuron_balls_fname(neuron_name, data_folder):
+    if neuron_name.endswith("_yz_flipped.obj"):
+        balls_name = neuron_name.replace("_yz_flipped.obj", "_balls_yz_flipped.csv")
+    else:
+        balls_name = neuron_name.replace(".obj", "_balls.csv")
+    return str(pathlib.Path(data_folder) / "data" / "neurons" / balls_name)
+
+
+def process_main(results, output_fname, threshold_distance, vascular, data_folder=DATA_FOLDER, sink=None):
+    """Aggregates each of the given NCD result lines into the output DB, or
+    into the sink if one is given."""
+    vascular_fname = str(pathlib.Path(data_folder) / "data" / "vascular" / "vascular_balls.csv")
     for res in results:
         splitted = res.split(",")
 
-        neuron_name = splitted[0].replace("_yz_flipped.obj", "_balls_yz_flipped.csv")
+        neuron_fname = neuron_balls_fname(splitted[0], data_folder)
         location = [int(splitted[1]), int(splitted[2]), int(splitted[3])]
         rotation = [int(splitted[4]), int(splitted[5]), int(splitted[6])]
 
-        parent_folder = pathlib.Path('/data/neural_collision_detection')
-        neuron_fname = str(parent_folder / "data" / "neurons" / f"{neuron_name}")
-        vascular_fname = str(parent_folder / "data" / "vascular" / f"vascular_balls.csv")
+        aggregate(vascular_fname, neuron_fname, location, rotation, output_fname, threshold_distance, vascular, sink)
 
-        aggregate(vascular_fname, neuron_fname, location, rotation, output_fname, threshold_distance, vascular)
+
+def worker_main(queue, result_queue, threshold_distance, vascular_handle, data_folder):
+    """
+    Each process spawned by "run_workers" runs this function. It attaches to
+    the shared vasculature once, and then keeps taking chunks of NCD results
+    off the queue until it reaches a None sentinel. The results are sent to
+    the parent process, which is the only one writing the output.
+    """
+    vascular = attach_vascular_index(vascular_handle)
+    sink = QueueResultSink(result_queue)
+    try:
+        for chunk in iter(queue.get, None):
+            process_main(chunk, None, threshold_distance, vascular, data_folder, sink)
+    finally:
+        sink.close()
 
 
-def process_main_from_mem(results: pd.DataFrame, output_fname, threshold_distance, vascular):
+def make_chunks(ncd_results, chunk_size=CHUNK_SIZE, estimate_cost=True):
     """
-    Each process spawned from "main_from_mem" runs this function on all of the collision
-    data it was assigned to.
+    Splits the NCD result lines into small chunks. When estimate_cost is set
+    the most expensive placements come first, so that the cheap ones fill in
+    the gaps at the end of the run instead of a heavy one straggling.
     """
-    location = results.loc[:, 'x':'z'].to_numpy().astype(np.int64)
-    rotation = results.loc[:, 'tip':'yaw'].to_numpy().astype(np.int64)
-    neuron_name = results['neuron_name'].iloc[0].replace('.obj', '_balls.csv')
-    parent_folder = pathlib.Path(__file__).resolve().parents[2]
-    neuron_fname = str(parent_folder / "data" / "neurons" / neuron_name)
-    vascular_fname = str(parent_folder / "data" / "vascular" / "vascular_balls.csv")
-    for loc, rot in zip(location, rotation):
-        aggregate(vascular_fname, neuron_fname, loc, rot, output_fname, threshold_distance, vascular)
+    if estimate_cost:
+        ncd_results = sorted(ncd_results, key=ncd_result_cost, reverse=True)
+    return [ncd_results[i : i + chunk_size] for i in range(0, len(ncd_results), chunk_size)]
 
 
-def main_from_mem(ncd_results_fname, max_collisions, threshold_distance, output_fname, vascular_fname):
+def run_workers(ncd_results, output_fname, threshold_distance, vascular_fname, data_folder=DATA_FOLDER,
+                worker_count=None, chunk_size=CHUNK_SIZE, estimate_cost=True):
+    """
+    Aggregates all of the NCD results using a pool of worker processes which
+    pull small chunks of work from a shared queue, so that a few dense
+    placements don't hold up the whole run. The output is written by this
+    process alone; a .npz output_fname selects the binary format.
+    """
+    worker_count = worker_count or os.cpu_count()
+    chunks = make_chunks(ncd_results, chunk_size, estimate_cost)
+    worker_count = max(1, min(worker_count, len(chunks)))
+    print(f"Running {len(chunks)} chunks on {worker_count} workers")
+    queue = multiprocessing.Queue()
+    for chunk in chunks:
+        queue.put(chunk)
+    for _ in range(worker_count):
+        queue.put(None)
+
+    vascular = get_vascular(vascular_fname)
+    with share_vascular_index(vascular) as vascular_handle:
+        del vascular
+        result_queue = multiprocessing.Queue()
+        params = (queue, result_queue, threshold_distance, vascular_handle, data_folder)
+        processes = [multiprocessing.Process(target=worker_main, args=params) for _ in range(worker_count)]
+        for p in processes:
+            p.start()
+        try:
+            drain_results(result_queue, make_result_sink(output_fname), processes)
+        except BaseException:
+            for p in processes:
+                p.terminate()
+            raise
+        finally:
+            for p in processes:
+                p.join()
+
+
+def main_from_mem(ncd_results_fname, max_collisions, threshold_distance, output_fname, vascular_fname,
+                  worker_count=None):
     """
     Aggregate the NCD result files into a parsable DB while filtering it
     based on the threshold distance of the collisions.
-    Receives the NCD data as an in-memory object, rather than
-    a filename.
+    Neurons are looked up relative to this repository rather than
+    the /data folder.
     """
-    process_count = 20
     ncd_results = get_ncd_results(ncd_results_fname, max_collisions)
-    results_per_process = 1.0 * len(ncd_results) / process_count
-    processes = []
-    last_idx = 0
-    vascular = get_vascular(vascular_fname)
-    for i in range(process_count):
-        next_idx = int(results_per_process * (i + 1))
-        if i == process_count - 1:
-            next_idx = len(ncd_results)
-        params = (ncd_results.iloc[last_idx:next_idx, :], output_fname, threshold_distance, vascular)
-        p = multiprocessing.Process(target=process_main_from_mem, args=params)
-        processes.append(p)
-        p.start()
-        last_idx = next_idx
-    for i in range(process_count):
-        processes[i].join()
+    data_folder = pathlib.Path(__file__).resolve().parents[2]
+    run_workers(ncd_results, output_fname, threshold_distance, vascular_fname, data_folder,
+                worker_count=worker_count)
 
 
 def main(argv):
-    if len(argv) < 4:
-        print("Usage: %s <ncd output file> <max collisions> <threshold distance> <output file>" % argv[0])
+    if len(argv) < 5:
+        print("Usage: %s <ncd output file> <max collisions> <threshold distance> <output file> [worker count]" % argv[0])
         return 1
     ncd_output_file = argv[1]
     max_collisions = int(argv[2])
     threshold_distance = int(argv[3])
     output_fname = argv[4]
+    worker_count = int(argv[5]) if len(argv) > 5 else None
     ncd_results = get_ncd_results(ncd_output_file, max_collisions)
     print("Running over {0} results".format(len(ncd_results)))
-    process_count = 20
-    results_per_process = 1.0 * len(ncd_results) / process_count
-    processes = []
-    last_idx = 0
     # was ../../data/vascular/vascular_balls.csv
-    vascular_fname = pathlib.Path(r"/data/neural_collision_detection/data/vascular/vascular_balls.csv")
+    vascular_fname = DATA_FOLDER / "data" / "vascular" / "vascular_balls.csv"
     print(f"Vascular fname: ", vascular_fname)
-    vascular = get_vascular(vascular_fname)
-
-    for i in range(process_count):
-        next_idx = int(results_per_process * (i + 1))
-        if i == process_count - 1:
-            next_idx = len(ncd_results)
-        params = (ncd_results[last_idx : next_idx], output_fname, threshold_distance, vascular)
-        print(len(params[0]))
-        p = multiprocessing.Process(target=process_main, args=params)
-        processes.append(p)
-        p.start()
-        last_idx = next_idx
-    for i in range(process_count):
-        processes[i].join()
+    run_workers(ncd_results, output_fname, threshold_distance, vascular_fname, worker_count=worker_count)
 
 
 if __name__ == "__main__":
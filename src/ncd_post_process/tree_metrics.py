@@ -0,0 +1,129 @@
+"""
+Length, surface and volume of neuronal trees and their subtrees.
+
+Each point of a tree, other than the root, ends a segment that starts at its
+parent. The segment is a frustum with the radii of its two points, and its
+length, lateral surface and volume are calculated for all segments at once.
+
+Subtree queries use an Euler-tour index: the points are numbered by a
+pre-order walk of the tree, so the subtree of a point is a contiguous range
+of that order, and its total is the difference of two prefix sums. This
+replaces py3DN's Get_Tree_Length, Get_Tree_Surface and Get_Tree_Volume,
+which walk the points of the subtree on every call.
+"""
+import attr
+from attr.validators import instance_of
+import numpy as np
+import numba as nb
+
+from ncd_post_process.neuron_loader import as_parsed_tree
+
+
+@nb.njit
+def _euler_tour(parents: np.ndarray):
+    """Pre-order position and subtree size of every point. Relies on parents
+    preceding their children, so each pass over the points is a single loop."""
+    num_of_points = len(parents)
+    subtree_size = np.ones(num_of_points, dtype=np.int64)
+    for idx in range(num_of_points - 1, -1, -1):
+        if parents[idx] >= 0:
+            subtree_size[parents[idx]] += subtree_size[idx]
+
+    # A point is placed right after its parent and the subtrees of its
+    # earlier siblings
+    tour_position = np.zeros(num_of_points, dtype=np.int64)
+    next_free = np.zeros(num_of_points, dtype=np.int64)
+    next_root = 0
+    for idx in range(num_of_points):
+        parent = parents[idx]
+        if parent >= 0:
+            tour_position[idx] = next_free[parent]
+            next_free[parent] += subtree_size[idx]
+        else:
+            tour_position[idx] = next_root
+            next_root += subtree_size[idx]
+        next_free[idx] = tour_position[idx] + 1
+    return tour_position, subtree_size
+
+
+@attr.s(frozen=True)
+class TreeMetrics:
+    """
+    Morphometrics of a single neuronal tree. Use from_points or from_tree to
+    create an instance.
+
+    :param np.ndarray length: Length of the segment ending at each point, 0 for roots.
+    :param np.ndarray surface: Lateral surface of the frustum ending at each point.
+    :param np.ndarray volume: Volume of the frustum ending at each point.
+    :param np.ndarray tour_position: Position of each point in a pre-order walk of the tree.
+    :param np.ndarray subtree_size: Number of points in the subtree of each point,
+        including itself.
+    """
+
+    length = attr.ib(validator=instance_of(np.ndarray))
+    surface = attr.ib(validator=instance_of(np.ndarray))
+    volume = attr.ib(validator=instance_of(np.ndarray))
+    tour_position = attr.ib(validator=instance_of(np.ndarray))
+    subtree_size = attr.ib(validator=instance_of(np.ndarray))
+    _prefix_sums = attr.ib(init=False, repr=False, eq=False)
+
+    def __attrs_post_init__(self):
+        # Row k is the prefix sum of the k-th metric in pre-order
+        in_order = np.empty_like(self.tour_position)
+        in_order[self.tour_position] = np.arange(len(self.tour_position))
+        metrics = np.stack([self.length, self.surface, self.volume])[:, in_order]
+        prefix_sums = np.zeros((3, len(in_order) + 1), dtype=np.float64)
+        np.cumsum(metrics, axis=1, out=prefix_sums[:, 1:])
+        object.__setattr__(self, "_prefix_sums", prefix_sums)
+
+    @classmethod
+    def from_points(cls, parents, coords, radii):
+        """
+        :param parents: Parent index of each point, -1 for roots. Every point's
+            parent must precede it.
+        :param coords: An (N, 3) array of the points' coordinates.
+        :param radii: Radius of each point.
+        """
+        parents = np.asarray(parents, dtype=np.int64)
+        coords = np.asarray(coords, dtype=np.float64)
+        radii = np.asarray(radii, dtype=np.float64)
+        if coords.shape != (len(parents), 3) or radii.shape != parents.shape:
+            raise ValueError("coords and radii must match parents")
+        if np.any(parents >= np.arange(len(parents))) or np.any(parents < -1):
+            raise ValueError("Every point's parent must precede it")
+        is_root = parents < 0
+        r = radii
+        R = np.where(is_root, radii, radii[parents])
+        h = np.where(is_root, 0.0, np.linalg.norm(coords - coords[parents], axis=1))
+        g = np.sqrt(h * h + (R - r) * (R - r))
+        surface = np.where(is_root, 0.0, np.pi * g * (R + r))
+        volume = np.pi * h / 3 * (R * R + r * r + R * r)
+        tour_position, subtree_size = _euler_tour(parents)
+        return cls(h, surface, volume, tour_position, subtree_size)
+
+    @classmethod
+    def from_tree(cls, tree):
+        """From a ParsedTree or a py3DN tree, using its raw points."""
+        tree = as_parsed_tree(tree)
+        return cls.from_points(tree.ppid, tree.P, tree.r)
+
+    def _subtree_sums(self, start_point_id) -> np.ndarray:
+        """Sums of the metrics over the segments below each starting point.
+        The segment ending at the starting point itself isn't included."""
+        start_point_id = np.asarray(start_point_id, dtype=np.int64)
+        first = self.tour_position[start_point_id] + 1
+        last = self.tour_position[start_point_id] + self.subtree_size[start_point_id]
+        return self._prefix_sums[:, last] - self._prefix_sums[:, first]
+
+    def tree_length(self, start_point_id=0) -> np.ndarray:
+        """Total length of the subtree of each starting point, in um. The
+        default is the whole tree."""
+        return self._subtree_sums(start_point_id)[0]
+
+    def tree_surface(self, start_point_id=0) -> np.ndarray:
+        """Total surface of the subtree of each starting point, in square um."""
+        return self._subtree_sums(start_point_id)[1]
+
+    def tree_volume(self, start_point_id=0) -> np.ndarray:
+        """Total volume of the subtree of each starting point, in cubic um."""
+        return self._subtree_sums(start_point_id)[2]
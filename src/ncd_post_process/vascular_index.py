@@ -0,0 +1,232 @@
+"""
+A spatial index over the vascular balls, used by the aggregator to find the
+neuron balls which touch a blood vessel.
+
+The index is built once per vascular file and then queried for every
+placement of a neuron. The vascular balls are split into radius tiers, each
+with its own uniform grid keyed on the balls' centers, so that the few thick
+vessels don't inflate the search radius of every query.
+
+The index is made only of NumPy arrays, so it can be published once into
+shared memory (see ``share_vascular_index``) and attached by worker processes
+without copying it.
+"""
+import contextlib
+from multiprocessing import shared_memory
+
+import attr
+from attr.validators import instance_of
+import numpy as np
+
+RADIUS_TIERS = (2.0, 4.0, 8.0)
+MIN_CELL_SIZE = 2.0
+# Grid cells a single query looks up at once
+MAX_NEIGHBOR_CELLS = 1 << 16
+
+
+@attr.s
+class VascularTier:
+    """
+    The vascular balls with radii in a given range, bucketed into a uniform
+    grid. The balls are sorted by their cell, and the cells are stored in a
+    CSR-like layout: the balls of cell_keys[i] are
+    balls[cell_offsets[i]:cell_offsets[i + 1]].
+
+    :param np.ndarray balls: (N, 4) float32 array of x, y, z, r, sorted by cell.
+    :param np.ndarray cell_keys: Sorted unique keys of the non-empty cells.
+    :param np.ndarray cell_offsets: Start of each cell in balls, plus the end.
+    :param np.ndarray grid_meta: float64 array of origin (3), dims (3), cell size, max r.
+    """
+
+    balls = attr.ib(validator=instance_of(np.ndarray))
+    cell_keys = attr.ib(validator=instance_of(np.ndarray))
+    cell_offsets = attr.ib(validator=instance_of(np.ndarray))
+    grid_meta = attr.ib(validator=instance_of(np.ndarray))
+
+    @classmethod
+    def from_balls(cls, balls):
+        max_r = float(balls[:, 3].max())
+        cell_size = max(2 * max_r, MIN_CELL_SIZE)
+        origin = balls[:, :3].min(axis=0).astype(np.float64)
+        dims = np.floor((balls[:, :3].max(axis=0) - origin) / cell_size).astype(np.int64) + 1
+        grid_meta = np.concatenate((origin, dims, [cell_size, max_r]))
+        tier = cls(balls, np.empty(0, np.int64), np.zeros(1, np.int64), grid_meta)
+        keys, _ = tier._pack(tier._cells_of(balls[:, :3]))
+        order = np.argsort(keys, kind="stable")
+        tier.balls = np.ascontiguousarray(balls[order])
+        tier.cell_keys, starts = np.unique(keys[order], return_index=True)
+        tier.cell_offsets = np.append(starts, len(balls)).astype(np.int64)
+        return tier
+
+    @property
+    def max_r(self):
+        return self.grid_meta[7]
+
+    def arrays(self):
+        """All of the tier's data, by field name."""
+        return {field.name: getattr(self, field.name) for field in attr.fields(type(self))}
+
+    def _cells_of(self, points):
+        """Integer grid coordinates of the cells containing points."""
+        origin, cell_size = self.grid_meta[:3], self.grid_meta[6]
+        return np.floor((points - origin) / cell_size).astype(np.int64)
+
+    def _pack(self, cells):
+        """Packs integer cell coordinates into a single key. Returns the keys and
+        a mask of the cells which are inside the grid."""
+        dims = self.grid_meta[3:6].astype(np.int64)
+        inside = np.all((cells >= 0) & (cells < dims), axis=-1)
+        keys = (cells[..., 0] * dims[1] + cells[..., 1]) * dims[2] + cells[..., 2]
+        return keys, inside
+
+    def candidate_pairs(self, points, max_distance):
+        """Finds all (point, ball) pairs whose centers might be closer than
+        max_distance, by looking at every cell within reach of each point.
+        max_distance is either a single distance or one per point.
+
+        Points are grouped by the number of cells they reach, and each group
+        is looked up in chunks of at most MAX_NEIGHBOR_CELLS cells, so a few
+        thick neuron balls don't blow up the temporary arrays of the rest.
+
+        Returns two index arrays, into points and into self.balls.
+        """
+        dims = self.grid_meta[3:6].astype(np.int64)
+        max_distance = np.broadcast_to(max_distance, (len(points),))
+        # Cells further than the grid's size are all outside of it
+        reach = np.minimum(np.ceil(max_distance / self.grid_meta[6]), dims.max()).astype(np.int64)
+        pair_points, pair_balls = [], []
+        for group_reach in np.unique(reach):
+            group = np.nonzero(reach == group_reach)[0]
+            chunk_size = max(1, MAX_NEIGHBOR_CELLS // (2 * int(group_reach) + 1) ** 3)
+            for start in range(0, len(group), chunk_size):
+                chunk = group[start : start + chunk_size]
+                pair_point, pair_ball = self._candidate_pairs_in_reach(points[chunk], group_reach)
+                pair_points.append(chunk[pair_point])
+                pair_balls.append(pair_ball)
+        if not pair_points:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        return np.concatenate(pair_points), np.concatenate(pair_balls)
+
+    def _candidate_pairs_in_reach(self, points, reach):
+        """candidate_pairs for points which all look reach cells away."""
+        steps = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+        neighbors = self._cells_of(points)[:, np.newaxis, :] + offsets[np.newaxis, :, :]
+        keys, inside = self._pack(neighbors)
+        point_idx = np.nonzero(inside)[0]
+        keys = keys[inside]
+
+        cell_idx = np.searchsorted(self.cell_keys, keys)
+        cell_idx[cell_idx == len(self.cell_keys)] = 0
+        found = self.cell_keys[cell_idx] == keys if len(self.cell_keys) else np.zeros(len(keys), bool)
+        point_idx, cell_idx = point_idx[found], cell_idx[found]
+        starts = self.cell_offsets[cell_idx]
+        counts = self.cell_offsets[cell_idx + 1] - starts
+
+        pair_point = np.repeat(point_idx, counts)
+        first_of_run = np.repeat(np.cumsum(counts) - counts, counts)
+        pair_ball = np.arange(len(pair_point)) - first_of_run + np.repeat(starts, counts)
+        return pair_point, pair_ball
+
+
+@attr.s
+class VascularIndex:
+    """
+    Spatial index over the vasculature, answering "which neuron balls
+    collide with the vasculature" for a whole transformed neuron at once.
+    Use ``from_balls`` to build it.
+
+    Parameters:
+    :param list tiers: VascularTier instances, one per radius range.
+    """
+
+    tiers = attr.ib(validator=instance_of(list))
+    _shared_blocks = attr.ib(factory=list, repr=False)
+
+    @classmethod
+    def from_balls(cls, balls, radius_tiers=RADIUS_TIERS):
+        """
+        :param np.ndarray balls: (N, 4) array of vascular balls.
+        :param tuple radius_tiers: Upper radius bounds used to split the balls into
+        tiers. Balls thicker than the last bound go into one last tier.
+        """
+        balls = np.ascontiguousarray(balls, dtype=np.float32)
+        tier_of_ball = np.digitize(balls[:, 3], radius_tiers)
+        tiers = []
+        for tier_idx in range(len(radius_tiers) + 1):
+            tier_balls = balls[tier_of_ball == tier_idx]
+            if len(tier_balls) > 0:
+                tiers.append(VascularTier.from_balls(tier_balls))
+        return cls(tiers)
+
+    def __len__(self):
+        return sum(len(tier.balls) for tier in self.tiers)
+
+    def find_colliding_balls(self, neuron, threshold_distance, box=None):
+        """Returns a boolean mask of the neuron balls which are closer than
+        threshold_distance to at least one vascular ball.
+
+        :param np.ndarray neuron: (N, 4) array of the transformed neuron.
+        :param int threshold_distance: Extra distance that still counts as a collision.
+        :param tuple box: Optional (min_xyz, max_xyz) corners. Vascular balls
+        with a center outside of it are ignored.
+        """
+        collided = np.zeros(len(neuron), dtype=bool)
+        if len(neuron) == 0:
+            return collided
+        for tier in self.tiers:
+            max_distance = neuron[:, 3] + tier.max_r + threshold_distance
+            neuron_idx, vasc_idx = tier.candidate_pairs(neuron[:, :3], max_distance)
+            if len(neuron_idx) == 0:
+                continue
+            vasc = tier.balls[vasc_idx]
+            diff = neuron[neuron_idx, :3] - vasc[:, :3]
+            dist_sq = np.einsum("ij,ij->i", diff, diff)
+            rsum = neuron[neuron_idx, 3] + vasc[:, 3] + threshold_distance
+            touching = dist_sq <= rsum * rsum
+            if box is not None:
+                touching &= np.all((vasc[:, :3] >= box[0]) & (vasc[:, :3] <= box[1]), axis=1)
+            collided[neuron_idx[touching]] = True
+        return collided
+
+
+@contextlib.contextmanager
+def share_vascular_index(index):
+    """
+    Copies the index's arrays into shared memory blocks which live as long as
+    the context. Yields a small, picklable handle which worker processes pass
+    to ``attach_vascular_index``.
+    """
+    blocks = []
+    handle = []
+    try:
+        for tier in index.tiers:
+            tier_handle = {}
+            for name, arr in tier.arrays().items():
+                block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+                blocks.append(block)
+                np.ndarray(arr.shape, arr.dtype, buffer=block.buf)[...] = arr
+                tier_handle[name] = (block.name, arr.shape, arr.dtype.str)
+            handle.append(tier_handle)
+        yield handle
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def attach_vascular_index(handle):
+    """Builds a read-only VascularIndex on top of the shared memory blocks
+    described by handle, without copying them."""
+    blocks = []
+    tiers = []
+    for tier_handle in handle:
+        arrays = {}
+        for name, (block_name, shape, dtype) in tier_handle.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            arr = np.ndarray(shape, dtype, buffer=block.buf)
+            arr.setflags(write=False)
+            arrays[name] = arr
+        tiers.append(VascularTier(**arrays))
+    return VascularIndex(tiers, blocks)
@@ -0,0 +1,103 @@
+"""
+Counts how many times each voxel had a collision, without keeping the
+collisions themselves.
+
+Voxels are packed into int64 keys, 21 bits per axis, and kept as a sorted
+array of unique keys with their counts. Batches of collisions are merged
+into it as they come, by binary search rather than sorting it again, and
+accumulators of different DBs or processes can be merged together. Voxels outside the packable range (e.g. NaN coordinates
+which were cast to int) are counted separately in a dict.
+"""
+import attr
+from attr.validators import instance_of
+import numpy as np
+
+AXIS_BITS = 21
+AXIS_OFFSET = 1 << (AXIS_BITS - 1)
+AXIS_MASK = (1 << AXIS_BITS) - 1
+
+
+def pack_voxels(coords):
+    """Packs (N, 3) integer coordinates into int64 keys which sort like the
+    coordinates do. Returns the keys and a mask of the packable rows."""
+    shifted = np.asarray(coords, dtype=np.int64) + AXIS_OFFSET
+    inside = np.all((shifted >= 0) & (shifted <= AXIS_MASK), axis=1)
+    shifted = shifted[inside]
+    keys = (shifted[:, 0] << (2 * AXIS_BITS)) | (shifted[:, 1] << AXIS_BITS) | shifted[:, 2]
+    return keys, inside
+
+
+def unpack_voxels(keys):
+    coords = np.stack(
+        ((keys >> (2 * AXIS_BITS)) & AXIS_MASK, (keys >> AXIS_BITS) & AXIS_MASK, keys & AXIS_MASK), axis=1
+    )
+    return coords - AXIS_OFFSET
+
+
+@attr.s
+class VoxelAccumulator:
+    """
+    Sparse collision counts per voxel.
+
+    :param np.ndarray keys: Sorted, unique packed voxels.
+    :param np.ndarray counts: Number of collisions in each of the voxels.
+    :param dict outliers: Counts of the voxels which can't be packed, by coordinate.
+    :param int num_of_locs: Number of neuron placements the collisions came from.
+    """
+
+    keys = attr.ib(factory=lambda: np.zeros(0, np.int64), validator=instance_of(np.ndarray))
+    counts = attr.ib(factory=lambda: np.zeros(0, np.int64), validator=instance_of(np.ndarray))
+    outliers = attr.ib(factory=dict, validator=instance_of(dict))
+    num_of_locs = attr.ib(default=0, validator=instance_of(int))
+
+    def _merge_keys(self, keys, counts):
+        """Merges sorted, unique keys and their counts in place: counts of
+        known voxels are added to, and new voxels are inserted where they sort."""
+        counts = np.asarray(counts, dtype=np.int64)
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        self.counts[positions[found]] += counts[found]
+        new = ~found
+        if new.any():
+            self.keys = np.insert(self.keys, positions[new], keys[new])
+            self.counts = np.insert(self.counts, positions[new], counts[new])
+
+    def add(self, coords, num_of_locs=0):
+        """Adds a batch of (N, 3) integer collision coordinates, which came from
+        num_of_locs placements."""
+        coords = np.asarray(coords).reshape(-1, 3)
+        keys, inside = pack_voxels(coords)
+        batch_keys, batch_counts = np.unique(keys, return_counts=True)
+        self._merge_keys(batch_keys, batch_counts)
+        if not inside.all():
+            outliers, counts = np.unique(coords[~inside].astype(np.int64), axis=0, return_counts=True)
+            for coord, count in zip(map(tuple, outliers), counts):
+                self.outliers[coord] = self.outliers.get(coord, 0) + int(count)
+        self.num_of_locs += int(num_of_locs)
+
+    def merge(self, other):
+        """Adds the counts of another accumulator to this one."""
+        self._merge_keys(other.keys, other.counts)
+        for coord, count in other.outliers.items():
+            self.outliers[coord] = self.outliers.get(coord, 0) + count
+        self.num_of_locs += other.num_of_locs
+        return self
+
+    def unique_counts(self):
+        """The unique voxels, sorted like np.unique(axis=0) sorts them,
+        and the number of collisions in each."""
+        coords = unpack_voxels(self.keys)
+        counts = self.counts
+        if self.outliers:
+            coords = np.concatenate((coords, np.array(list(self.outliers), dtype=np.int64)))
+            counts = np.concatenate((counts, np.array(list(self.outliers.values()), dtype=np.int64)))
+            order = np.lexsort(coords.T[::-1])
+            coords, counts = coords[order], counts[order]
+        return coords, counts
+
+    def result(self):
+        """Same as "db_to_dataframe.count_collisions": the unique voxels and the
+        probability for a collision in each."""
+        coords, counts = self.unique_counts()
+        return coords.astype(np.int32), counts / self.num_of_locs
@@ -16,6 +16,7 @@ import DrawingFun
 from InterpolateFun import Normalize_Vector
 
 import myconfig
+import mytools
 import GUI
 
 
@@ -1088,6 +1089,7 @@ def Transform_Neuron( neuron_id, origin_vec, target_vec, rot_vec, rot_ang, scale
         for pid in range(0, tree.total_rawpoints ) :
             tree.rawpoint[pid].P = Transform_Point_RotMat( tree.rawpoint[pid].P, origin_vec, target_vec, M, scale )
             tree.rawpoint[pid].r = scale * tree.rawpoint[pid].r
+        mytools.Reset_Tree_Arrays( tree )
         # go to all points
         for pid in range(0, tree.total_points ) :
             tree.point[pid].P = Transform_Point_RotMat( tree.point[pid].P, origin_vec, target_vec, M, scale )
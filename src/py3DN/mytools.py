@@ -25,6 +25,10 @@ from myconfig import *
 # *functions for basic morphometric analysis*
 # Get_LineDistance_Between_Points
 # Get_FiberDistance_Between_RawPoints
+# Get_Tree_Arrays
+# Reset_Tree_Arrays
+# Find_Subtree_End
+# Get_Tree_Segments
 # Get_Tree_Length
 # Get_Tree_Surface
 # Get_Tree_Volume
@@ -330,31 +334,73 @@ def Reload() :
 #------------------------------------------------------------------------------------------
 
 
+def Get_Tree_Arrays(tree):
+    """Returns the arrays of the segments ending at each raw point of the tree: length, radius at the point, radius at its parent, parent id and level. They're built once and kept in the tree, see Reset_Tree_Arrays."""
+    N = tree.total_rawpoints
+    cached = getattr(tree, 'segment_arrays', None)
+    if cached is not None and len(cached[0]) == N:
+        return cached
+    if isinstance(getattr(tree, 'P', None), numpy.ndarray):
+        # trees loaded by ncd_post_process.neuron_loader already hold the arrays, and can't be changed
+        P, r = numpy.asarray(tree.P, dtype=float), numpy.asarray(tree.r, dtype=float)
+        ppid, level = numpy.asarray(tree.ppid), numpy.asarray(tree.level)
+    else:
+        rawpoints = tree.rawpoint[:N]
+        P = numpy.array([rawpoint.P for rawpoint in rawpoints], dtype=float).reshape(-1, 3)
+        r = numpy.array([rawpoint.r for rawpoint in rawpoints], dtype=float)
+        ppid = numpy.array([rawpoint.ppid for rawpoint in rawpoints], dtype=int)
+        level = numpy.array([rawpoint.level for rawpoint in rawpoints], dtype=int)
+    # the root's segment is never used, as the (sub)trees start after their first point
+    h = numpy.sqrt(numpy.sum((P - P[ppid])**2, axis=1))
+    arrays = (h, r, r[ppid], ppid, level)
+    try:
+        tree.segment_arrays = arrays
+    except AttributeError:
+        pass
+    return arrays
+
+
+def Reset_Tree_Arrays(tree):
+    """Drops the arrays kept by Get_Tree_Arrays. Call it after changing the raw points of a tree in place."""
+    if getattr(tree, 'segment_arrays', None) is not None:
+        tree.segment_arrays = None
+
+
+def Find_Subtree_End(ppid, level, start_point_id):
+    """Returns the id after the last point of the subtree of the starting point: the subtree continues until a point has a parent before it or a lower level. Windows of growing size are searched, so only about the subtree's points are checked."""
+    N = len(ppid)
+    first = start_point_id + 1
+    size = 64
+    while first < N:
+        window = slice(first, first + size)
+        stop = numpy.flatnonzero((ppid[window] < start_point_id) | (level[window] < level[start_point_id]))
+        if len(stop) > 0:
+            return first + int(stop[0])
+        first += size
+        size *= 2
+    return N
+
+
+def Get_Tree_Segments(tree, start_point_id=0):
+    """Returns the arrays of the segments of the (sub)tree after the specified node id (default=0, i.e. root node): the length of each segment and the radii at its two ends."""
+    h, r, R, ppid, level = Get_Tree_Arrays(tree)
+    first = start_point_id + 1
+    if start_point_id == 0:
+        # complete tree: every point but the first one ends a segment
+        last = len(h)
+    else:
+        last = Find_Subtree_End(ppid, level, start_point_id)
+    return h[first:last], r[first:last], R[first:last]
+
+
+#------------------------------------------------------------------------------------------
+
+
 def Get_Tree_Length( tree, start_point_id = 0):
     """Calculates the total length of the (sub)tree after the specified node id (default=0, i.e. root node). Units in um."""
     # start_point_id is an optional argument to specify a starting tree point id
-    N = tree.total_rawpoints
-    tree_length = 0.0
-    if start_point_id == 0:
-        # in case of no second argument, calculate length for complete tree
-        for i in range(1,N) :
-            pid = tree.rawpoint[i].ppid
-            dist = Get_LineDistance_Between_Points( tree.rawpoint[i].P, tree.rawpoint[pid].P)
-            tree_length =  tree_length + dist
-    else :
-        # calculate length tree from a starting point
-        l = tree.rawpoint[start_point_id].level
-        pty = tree.rawpoint[start_point_id].ptype
-        i = start_point_id + 1
-        while i < N:
-            pid = tree.rawpoint[i].ppid
-            l1 = tree.rawpoint[i].level
-            if  pid < start_point_id or l1 < l:
-                break
-            dist = Get_LineDistance_Between_Points( tree.rawpoint[i].P, tree.rawpoint[pid].P)
-            tree_length =  tree_length + dist
-            i += 1
-    return tree_length
+    h, r, R = Get_Tree_Segments( tree, start_point_id )
+    return float( numpy.sum( h ) )
   
   
             
@@ -364,37 +410,10 @@ def Get_Tree_Length( tree, start_point_id = 0):
 def Get_Tree_Surface( tree, start_point_id = 0):
     """Calculates the total surface of the (sub)tree after the specified node id (default=0, i.e. root node). Units in square um."""
     # start_point_id is an optional argument to specify a starting tree point id
-    
-    N = tree.total_rawpoints
-    tree_surface = 0.0
-    if start_point_id == 0:
-        # in case of no second argument, calculate complete tree surface area 
-        for i in range(1,N) :
-            pid = tree.rawpoint[i].ppid
-            r = tree.rawpoint[i].r
-            R = tree.rawpoint[pid].r
-            h = Get_LineDistance_Between_Points( tree.rawpoint[i].P, tree.rawpoint[pid].P)
-            g = numpy.sqrt(h*h + (R-r)*(R-r))
-            area = numpy.pi * g * (R + r)
-            tree_surface =  tree_surface + area
-    else:
-        # calculate tree surface area from a starting point
-        l = tree.rawpoint[start_point_id].level
-        pty = tree.rawpoint[start_point_id].ptype
-        i = start_point_id + 1
-        while i < N:
-            pid = tree.rawpoint[i].ppid
-            l1 = tree.rawpoint[i].level
-            if  pid < start_point_id or l1 < l:
-                break
-            r = tree.rawpoint[i].r
-            R = tree.rawpoint[pid].r
-            h = Get_LineDistance_Between_Points( tree.rawpoint[i].P, tree.rawpoint[pid].P)
-            g = numpy.sqrt(h*h + (R-r)*(R-r))
-            area = numpy.pi * g * (R + r)
-            tree_surface =  tree_surface + area
-            i += 1
-    return tree_surface
+    # each segment is the lateral surface of a frustum
+    h, r, R = Get_Tree_Segments( tree, start_point_id )
+    g = numpy.sqrt( h*h + (R-r)*(R-r) )
+    return float( numpy.sum( numpy.pi * g * (R + r) ) )
 
             
 #------------------------------------------------------------------------------------------
@@ -403,34 +422,9 @@ def Get_Tree_Surface( tree, start_point_id = 0):
 def Get_Tree_Volume( tree, start_point_id = 0 ):
     """Calculates the total volume of the (sub)tree after the specified node id (default=0, i.e. root node). Units in cubic um."""
     # start_point_id is an optional argument to specify a starting tree point id
-    N = tree.total_rawpoints
-    tree_volume = 0.0
-    if start_point_id == 0:
-        # in case of no second argument, calculate complete tree volume
-        for i in range(1,N) :
-            pid = tree.rawpoint[i].ppid
-            r = tree.rawpoint[i].r
-            R = tree.rawpoint[pid].r
-            h = Get_LineDistance_Between_Points( tree.rawpoint[i].P, tree.rawpoint[pid].P)
-            volume = numpy.pi * h / 3 * (R*R + r*r + R*r)
-            tree_volume =  tree_volume + volume
-    else:
-        # calculate tree volume from a starting point
-        l = tree.rawpoint[start_point_id].level
-        pty = tree.rawpoint[start_point_id].ptype
-        i = start_point_id + 1
-        while i < N:
-            pid = tree.rawpoint[i].ppid
-            l1 = tree.rawpoint[i].level
-            if  pid < start_point_id or l1 < l:
-                break
-            r = tree.rawpoint[i].r
-            R = tree.rawpoint[pid].r
-            h = Get_LineDistance_Between_Points( tree.rawpoint[i].P, tree.rawpoint[pid].P)
-            volume = numpy.pi * h / 3 * (R*R + r*r + R*r)
-            tree_volume =  tree_volume + volume
-            i += 1
-    return tree_volume
+    # each segment is a frustum
+    h, r, R = Get_Tree_Segments( tree, start_point_id )
+    return float( numpy.sum( numpy.pi * h / 3 * (R*R + r*r + R*r) ) )
 
 
 #------------------------------------------------------------------------------------------
@@ -0,0 +1,122 @@
+import pytest
+import numpy as np
+
+from ncd_post_process.aggregator import (
+    aggregate,
+    rotate_array,
+    translate_array,
+    find_placement_collisions,
+)
+from ncd_post_process import vascular_index
+from ncd_post_process.vascular_index import VascularIndex, share_vascular_index, attach_vascular_index
+
+
+def _random_balls(rng, num, low, high, max_r):
+    centers = rng.uniform(low, high, size=(num, 3))
+    radii = rng.uniform(0.1, max_r, size=(num, 1))
+    return np.hstack((centers, radii)).astype(np.float32)
+
+
+def _brute_force_collisions(vascular, neuron, threshold_distance):
+    collided = []
+    for n in neuron:
+        dists = np.linalg.norm(vascular[:, :3] - n[:3], axis=1)
+        collided.append(np.any(dists <= vascular[:, 3] + n[3] + threshold_distance))
+    return np.array(collided, dtype=bool)
+
+
+@pytest.fixture()
+def balls():
+    rng = np.random.default_rng(42)
+    vascular = _random_balls(rng, 2000, 0, 100, 6)
+    neuron = _random_balls(rng, 700, 20, 80, 1.5)
+    return vascular, neuron
+
+
+def test_rotate_array_matches_rotation_matrices(balls):
+    _, neuron = balls
+    x, y, z = np.radians([3, -4, 217])
+    m_x = np.array([[1, 0, 0], [0, np.cos(x), -np.sin(x)], [0, np.sin(x), np.cos(x)]])
+    m_y = np.array([[np.cos(y), 0, np.sin(y)], [0, 1, 0], [-np.sin(y), 0, np.cos(y)]])
+    m_z = np.array([[np.cos(z), -np.sin(z), 0], [np.sin(z), np.cos(z), 0], [0, 0, 1]])
+    expected = neuron.astype(np.float64)
+    # Each center, as a column vector, is rotated by Rx * Ry * Rz
+    expected[:, :3] = (m_x @ m_y @ m_z @ expected[:, :3].T).T + [10, 20, 30]
+    as_array = translate_array(rotate_array(neuron, [3, -4, 217]), [10, 20, 30])
+    np.testing.assert_array_almost_equal(as_array, expected, decimal=4)
+
+
+def test_rotate_array_doesnt_change_input(balls):
+    _, neuron = balls
+    orig = neuron.copy()
+    rotate_array(neuron, [0, 0, 90])
+    np.testing.assert_array_equal(orig, neuron)
+
+
+def test_placement_collisions_match_brute_force(balls, tmp_path):
+    vascular, neuron = balls
+    neuron_fname = tmp_path / "neuron_balls.csv"
+    np.savetxt(neuron_fname, neuron, delimiter=",")
+    location, rotation = [1, 2, 3], [0, 0, 10]
+    found = find_placement_collisions(str(neuron_fname), location, rotation, 2, VascularIndex.from_balls(vascular))
+    placed = translate_array(rotate_array(neuron, rotation), location)
+    expected = placed[_brute_force_collisions(vascular, placed, 2)]
+    assert len(expected) > 0
+    np.testing.assert_array_equal(found, expected)
+
+
+def test_aggregate_line_format(balls, tmp_path):
+    vascular, neuron = balls
+    neuron_fname = tmp_path / "neuron_balls.csv"
+    np.savetxt(neuron_fname, neuron, delimiter=",")
+    results_fname = tmp_path / "agg.csv"
+    aggregate("vascular_balls.csv", str(neuron_fname), [1, 2, 3], [0, 0, 10], str(results_fname), 0, vascular)
+    line = results_fname.read_text().splitlines()[0]
+    run_id, neuron_id, vasc_id, location, rotation, count, colls = line.split(",")
+    assert (run_id, neuron_id, vasc_id) == ("run_1", "neuron_balls.csv", "vascular_balls.csv")
+    assert (location, rotation) == ("1 2 3", "0 0 10")
+    assert int(count) == len(colls.split("|"))
+    assert all(len(coll.split(" ")) == 3 for coll in colls.split("|"))
+    # The coordinates are written in full float64 precision, like the list
+    # based code wrote them
+    placed = translate_array(rotate_array(np.loadtxt(neuron_fname, delimiter=","), [0, 0, 10]), [1, 2, 3])
+    written = [[float(c) for c in coll.split(" ")] for coll in colls.split("|")]
+    np.testing.assert_array_equal(written, placed[_brute_force_collisions(vascular, placed, 0), :3])
+
+
+@pytest.mark.parametrize("threshold_distance", [0, 2])
+def test_vascular_index_matches_brute_force(balls, threshold_distance):
+    vascular, neuron = balls
+    index = VascularIndex.from_balls(vascular, radius_tiers=(1.0, 3.0))
+    found = index.find_colliding_balls(neuron, threshold_distance)
+    expected = _brute_force_collisions(vascular, neuron, threshold_distance)
+    np.testing.assert_array_equal(found, expected)
+
+
+def test_vascular_index_respects_box(balls):
+    vascular, neuron = balls
+    mins, maxs = neuron[:, :3].min(axis=0) - 5, neuron[:, :3].max(axis=0) + 5
+    found = VascularIndex.from_balls(vascular).find_colliding_balls(neuron, 0, (mins, maxs))
+    inside = np.all((vascular[:, :3] >= mins) & (vascular[:, :3] <= maxs), axis=1)
+    assert not inside.all()
+    np.testing.assert_array_equal(found, _brute_force_collisions(vascular[inside], neuron, 0))
+
+
+def test_shared_vascular_index_matches_original(balls):
+    vascular, neuron = balls
+    index = VascularIndex.from_balls(vascular)
+    with share_vascular_index(index) as handle:
+        attached = attach_vascular_index(handle)
+        assert len(attached) == len(index)
+        np.testing.assert_array_equal(
+            attached.find_colliding_balls(neuron, 1), index.find_colliding_balls(neuron, 1)
+        )
+
+
+def test_vascular_index_with_a_thick_neuron_ball(balls, monkeypatch):
+    vascular, neuron = balls
+    neuron = neuron.copy()
+    neuron[100, 3] = 15
+    monkeypatch.setattr(vascular_index, "MAX_NEIGHBOR_CELLS", 1000)
+    found = VascularIndex.from_balls(vascular).find_colliding_balls(neuron, 1)
+    np.testing.assert_array_equal(found, _brute_force_collisions(vascular, neuron, 1))
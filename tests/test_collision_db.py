@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from ncd_post_process.aggregator import format_db_line
+from ncd_post_process.collision_db import CollisionDB, CollisionDBWriter, csv_to_collision_db
+from ncd_post_process.db_to_dataframe import read_db_into_raw_df, parse_raw_df
+
+
+def _placements():
+    rng = np.random.default_rng(3)
+    placements = []
+    for i in range(20):
+        count = 0 if i % 7 == 0 else rng.integers(1, 30)
+        collisions = np.round(rng.uniform(0, 500, (count, 3)), 2).astype(np.float32)
+        placements.append((f"neuron_{i % 2}.csv", "vascular_balls.csv", [i, 2 * i, 300], [0, -3, 10 * i], collisions))
+    return placements
+
+
+def test_writer_roundtrip(tmp_path):
+    placements = _placements()
+    with CollisionDBWriter(tmp_path / "agg.ncdb", buffer_size=6) as writer:
+        for placement in placements:
+            writer.add(*placement)
+    db = CollisionDB.open(tmp_path / "agg.ncdb")
+    assert len(db) == len(placements)
+    for idx, (neuron, _, location, rotation, collisions) in enumerate(placements):
+        np.testing.assert_array_equal(db.collisions_of(idx), collisions)
+        np.testing.assert_array_equal(db["location"][idx], location)
+        np.testing.assert_array_equal(db["rotation"][idx], rotation)
+        assert db.categorical("neuron")[idx] == neuron
+
+
+def test_collisions_frame_matches_csv_parsing(tmp_path):
+    csv_fname = tmp_path / "agg.csv"
+    with open(csv_fname, "w") as f:
+        for placement in _placements():
+            f.write(format_db_line(*placement))
+    expected = parse_raw_df(read_db_into_raw_df(csv_fname))
+    found = csv_to_collision_db(csv_fname, tmp_path / "agg.ncdb").to_collisions_frame()
+    # The DB keeps the collisions as float32, the CSV parser reads them as float64
+    pd.testing.assert_frame_equal(found, expected, check_categorical=False, check_index_type=False, rtol=1e-6)
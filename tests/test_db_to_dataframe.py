@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+from ncd_post_process.aggregator import format_db_line
+from ncd_post_process.db_to_dataframe import (
+    read_db_into_raw_df,
+    parse_raw_df,
+    parse_db_in_chunks,
+    translate_colls,
+    rotate_colls,
+    _rotate_single_coll,
+    convert_to_int,
+    find_duplicate_colls,
+    pack_int_columns,
+    find_agg_dbs,
+)
+
+
+def _write_db(fname):
+    with open(fname, "w") as f:
+        f.write(format_db_line("n.csv", "v.csv", [1, 2, 3], [0, 0, 10], np.array([[1.5, 2, 3], [4, 5, 6.25]])))
+        f.write(format_db_line("n.csv", "v.csv", [4, 5, 6], [0, 1, 20], np.zeros((0, 3))))
+        f.write(format_db_line("m.csv", "v.csv", [7, 8, 9], [1, 0, 30], np.array([[7, 8, 9]])))
+
+
+def test_parse_raw_df(tmp_path):
+    _write_db(tmp_path / "agg.csv")
+    colls = parse_raw_df(read_db_into_raw_df(tmp_path / "agg.csv"))
+    np.testing.assert_array_equal(
+        colls.to_numpy(), [[1.5, 2, 3], [4, 5, 6.25], [np.nan, np.nan, np.nan], [7, 8, 9]]
+    )
+    assert colls.index.get_level_values("neuron").tolist() == ["n.csv", "n.csv", "n.csv", "m.csv"]
+    assert colls.index.get_level_values("yaw").tolist() == [10, 10, 20, 30]
+    assert colls.index.get_level_values("coll_count").tolist() == [2, 2, 0, 1]
+
+
+def test_parse_db_in_chunks_matches_whole_db(tmp_path):
+    _write_db(tmp_path / "agg.csv")
+    whole = parse_raw_df(read_db_into_raw_df(tmp_path / "agg.csv"))
+    chunked = pd.concat(parse_db_in_chunks(tmp_path / "agg.csv", chunksize=2))
+    # Chunks have different categories, so concat turns them into plain strings
+    pd.testing.assert_frame_equal(whole.reset_index(), chunked.reset_index(), check_dtype=False, check_categorical=False)
+
+
+def test_rotate_colls_matches_single_coll_rotation(tmp_path):
+    rng = np.random.default_rng(5)
+    with open(tmp_path / "agg.csv", "w") as f:
+        for i in range(30):
+            rotation = [int(a) for a in rng.integers(-5, 360, 3)]
+            f.write(format_db_line("n.csv", "v.csv", [i, 0, 0], rotation, rng.uniform(0, 100, (5, 3))))
+    colls = parse_raw_df(read_db_into_raw_df(tmp_path / "agg.csv"))
+    translated = translate_colls(colls)
+    rot = np.stack([colls.index.get_level_values(name) for name in ["roll", "pitch", "yaw"]], axis=1)
+    expected = [_rotate_single_coll(r, c) for r, c in zip(rot, translated)]
+    np.testing.assert_allclose(rotate_colls(colls, translated), expected, atol=1e-9)
+
+
+def test_pack_int_columns_keeps_order():
+    rng = np.random.default_rng(2)
+    columns = [rng.integers(0, 5, 1000), rng.integers(-50, 50, 1000), rng.integers(0, 3, 1000)]
+    keys = pack_int_columns(columns)
+    np.testing.assert_array_equal(np.argsort(keys, kind="stable"), np.lexsort(columns[::-1]))
+    columns[1][0] = np.iinfo(np.int32).min
+    columns.append(np.full(1000, np.iinfo(np.int32).max))
+    keys = pack_int_columns(columns)
+    np.testing.assert_array_equal(np.argsort(keys, kind="stable"), np.lexsort(columns[::-1]))
+
+
+def test_find_duplicate_colls(tmp_path):
+    with open(tmp_path / "agg.csv", "w") as f:
+        f.write(format_db_line("n.csv", "v.csv", [1, 2, 3], [0, 0, 10], np.array([[5.2, 2, 3], [1, 1, 1], [5.7, 2, 3.1]])))
+        f.write(format_db_line("n.csv", "v.csv", [4, 5, 6], [0, 1, 20], np.array([[5.2, 2, 3], [1, 1, 1]])))
+    colls = convert_to_int(parse_raw_df(read_db_into_raw_df(tmp_path / "agg.csv")))
+    dedup = find_duplicate_colls(colls, colls)
+    np.testing.assert_array_equal(dedup.to_numpy(), [[1, 1, 1], [5, 2, 3], [1, 1, 1], [5, 2, 3]])
+    assert dedup.index.get_level_values("coll_count").tolist() == [2, 2, 2, 2]
+
+
+def test_find_agg_dbs_prefers_binary_db(tmp_path):
+    for name in ("agg_results_a_thresh_0.csv", "agg_results_a_thresh_0.ncdb", "agg_results_b_thresh_0.csv",
+                 "agg_results_c_thresh_0.ncdb", "agg_results_c_thresh_0.txt"):
+        (tmp_path / name).touch()
+    assert sorted(f.name for f in find_agg_dbs(tmp_path)) == [
+        "agg_results_a_thresh_0.ncdb", "agg_results_b_thresh_0.csv", "agg_results_c_thresh_0.ncdb",
+    ]
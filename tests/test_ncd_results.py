@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from ncd_post_process.ncd_results import HEADER_DTYPE, MAGIC, RECORD_DTYPE, VERSION, NcdResults
+from ncd_post_process.run_aggregator import get_ncd_results
+
+
+def _write_results(fname, records):
+    header = np.zeros(1, HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["record_size"] = RECORD_DTYPE.itemsize
+    header["min_x"], header["max_x"] = -5, 5
+    header["min_y"], header["max_y"] = -5, 5
+    header["min_z"], header["max_z"] = 0, 359
+    header["max_num_of_collisions"] = 500
+    header["neuron_name"] = b"neuron.obj"
+    header["vascular_name"] = b"vascular.obj"
+    with open(fname, "wb") as f:
+        f.write(header.tobytes())
+        f.write(records.tobytes())
+
+
+@pytest.fixture()
+def records():
+    rng = np.random.default_rng(4)
+    records = np.zeros(50, RECORD_DTYPE)
+    records["x"], records["y"], records["z"] = 10, 20, 30
+    records["r_x"] = rng.integers(-5, 6, 50)
+    records["r_y"] = rng.integers(-5, 6, 50)
+    records["r_z"] = rng.integers(0, 360, 50)
+    records["num_of_collisions"] = rng.choice([0, 3, 100, 500, 3333333], 50)
+    records["is_min"] = records["num_of_collisions"] < 5
+    return records
+
+
+def test_open(tmp_path, records):
+    _write_results(tmp_path / "res.ncdr", records)
+    results = NcdResults.open(tmp_path / "res.ncdr")
+    assert results.neuron_name == "neuron.obj"
+    assert results.vascular_name == "vascular.obj"
+    np.testing.assert_array_equal(results.records, records)
+
+
+def test_open_rejects_other_files(tmp_path):
+    (tmp_path / "res.ncdr").write_text("neuron.obj,1,2,3,0,0,0,5,1,f\n" * 40)
+    with pytest.raises(ValueError):
+        NcdResults.open(tmp_path / "res.ncdr")
+
+
+def test_get_ncd_results_same_as_text(tmp_path, records):
+    _write_results(tmp_path / "res.ncdr", records)
+    text_lines = [
+        "neuron.obj,{x},{y},{z},{r_x},{r_y},{r_z},{num_of_collisions},{is_min},\n".format(
+            **dict(zip(RECORD_DTYPE.names, rec.tolist()))
+        )
+        for rec in records
+    ]
+    (tmp_path / "res.csv").write_text("".join(text_lines))
+    binary = get_ncd_results(tmp_path / "res.ncdr", 100)
+    assert binary == get_ncd_results(tmp_path / "res.csv", 100)
+    assert 0 < len(binary) < len(records)
@@ -0,0 +1,100 @@
+import pathlib
+import sys
+
+import attr
+import pytest
+import numpy as np
+import networkx as nx
+
+from ncd_post_process.neuron_graph import NeuronGraph, load_neuron_graph
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src" / "py3DN"))
+from DataContainers import RAWPOINT, TREE, NEURON
+
+
+def make_neuron(tree_types=("Axon", "Dendrite"), num_of_points=(30, 20)):
+    """A py3DN neuron of random trees, each point's parent preceding it"""
+    rng = np.random.default_rng(0)
+    neuron = NEURON()
+    for tree_type, num in zip(tree_types, num_of_points):
+        tree = TREE()
+        tree.type = tree_type
+        for idx in range(num):
+            ppid = int(rng.integers(max(0, idx - 3), idx)) if idx > 0 else -1
+            ptype = "node" if idx % 5 == 0 else "standard"
+            tree.rawpoint.append(RAWPOINT(list(rng.uniform(0, 100, 3)), 1.0 + idx, ppid, 0, ptype))
+        tree.total_rawpoints = num
+        neuron.tree.append(tree)
+    neuron.total_trees = len(tree_types)
+    return neuron
+
+
+@pytest.fixture()
+def neuron_graph():
+    neuron = make_neuron()
+    collisions = np.linspace(0, 1, 50, dtype=np.float32)
+    return NeuronGraph.from_neuron(neuron, collisions, np.arange(50, dtype=np.float32))
+
+
+def test_from_neuron(neuron_graph):
+    assert neuron_graph.num_of_nodes == 50
+    np.testing.assert_array_equal(neuron_graph.tree_type_names[[0, 29, 30, 49]], ["Axon0"] * 2 + ["Dendrite1"] * 2)
+    assert neuron_graph.parents[0] == -1 and neuron_graph.parents[30] == -1
+    np.testing.assert_array_equal(neuron_graph.parents[31:], neuron_graph.ppid[31:] + 30)
+    np.testing.assert_array_equal(neuron_graph.neighbors(30), [31])
+    np.testing.assert_array_equal(neuron_graph.neighbors(31), [30, 32])
+    np.testing.assert_array_equal(neuron_graph.is_axon, np.arange(50) < 30)
+    # dist_to_body of a point is its parent's distance from the tree's first point
+    np.testing.assert_allclose(neuron_graph.dist_to_body, chain_dist_to_body(neuron_graph), rtol=1e-6)
+
+
+def chain_dist_to_body(graph):
+    """dist_to_body by walking the parent chain of each point's parent"""
+    distances = []
+    for node in range(graph.num_of_nodes):
+        length = 0.0
+        pid = graph.parents[node]
+        while pid >= 0 and graph.parents[pid] >= 0:
+            length += np.linalg.norm(graph.loc[pid] - graph.loc[graph.parents[pid]])
+            pid = graph.parents[pid]
+        distances.append(length)
+    return distances
+
+
+def test_networkx_round_trip(neuron_graph):
+    graph = neuron_graph.to_networkx()
+    assert graph.number_of_nodes() == 50
+    assert graph.number_of_edges() == 48
+    converted = NeuronGraph.from_networkx(graph)
+    for field in ("ppid", "parents", "loc", "ptype", "radius", "tree_type", "collision_chance",
+                  "dist_to_body", "alpha", "indptr", "indices", "weights"):
+        np.testing.assert_array_equal(getattr(converted, field), getattr(neuron_graph, field))
+
+
+def test_load_gml(neuron_graph, tmp_path):
+    fname = tmp_path / "graph.gml"
+    nx.write_gml(neuron_graph.to_networkx(), str(fname), repr)
+    loaded = load_neuron_graph(fname)
+    np.testing.assert_array_equal(loaded.collision_chance, neuron_graph.collision_chance)
+    np.testing.assert_array_equal(loaded.parents, neuron_graph.parents)
+    # The converted graph is kept next to the .gml file, and used from then on
+    assert (tmp_path / "graph.npz").exists()
+    fname.unlink()
+    assert isinstance(load_neuron_graph(fname).loc, np.memmap)
+
+
+def test_save_and_load(neuron_graph, tmp_path):
+    fname = tmp_path / "graph.npz"
+    neuron_graph.save(fname)
+    loaded = NeuronGraph.load(fname)
+    assert isinstance(loaded.dist_to_body, np.memmap)
+    for field in attr.fields(NeuronGraph):
+        np.testing.assert_array_equal(getattr(loaded, field.name), getattr(neuron_graph, field.name))
+    assert [path.name for path in tmp_path.iterdir()] == ["graph.npz"]
+
+
+def test_load_other_version(neuron_graph, tmp_path):
+    fname = tmp_path / "graph.npz"
+    np.savez(fname, format_version=np.array(0), **attr.asdict(neuron_graph, recurse=False))
+    with pytest.raises(ValueError):
+        NeuronGraph.load(fname)
@@ -0,0 +1,85 @@
+import os
+import pathlib
+import sys
+import time
+
+import pytest
+import numpy as np
+
+from ncd_post_process import neuron_loader
+from ncd_post_process.neuron_loader import (
+    ParsedTree,
+    load_neurolucida_xml,
+    parse_neurolucida_xml,
+)
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src" / "py3DN"))
+import NeuroLucidaXMLParser
+
+
+def make_branch(rng, depth):
+    """Points of a random branch, holding spines, markers and sub-branches"""
+    items = []
+    for _ in range(int(rng.integers(2, 5))):
+        x, y, z = np.round(rng.uniform(0, 100, 3), 2)
+        d = round(float(rng.uniform(0.05, 2)), 2)
+        items.append(f'<point x="{x}" y="{y}" z="{z}" d="{d}"/>')
+        if rng.random() < 0.2:
+            items.append(f'<spine><point x="{x + 1}" y="{y}" z="{z}" d="0.5"/></spine>')
+        if rng.random() < 0.2:
+            items.append(f'<marker type="Dot" varicosity="true"><point x="{x}" y="{y}" z="{z}" d="1"/></marker>')
+    if depth < 4:
+        for _ in range(int(rng.integers(0, 3))):
+            items.append(f"<branch>{make_branch(rng, depth + 1)}</branch>")
+    return "".join(items)
+
+
+@pytest.fixture()
+def xml_fname(tmp_path):
+    rng = np.random.default_rng(0)
+    trees = "".join(
+        f'<tree color="#FF0000" type="{tree_type}" leaf="Normal">{make_branch(rng, 0)}</tree>'
+        for tree_type in ("Axon", "Dendrite", "Dendrite")
+    )
+    fname = tmp_path / "neuron.xml"
+    fname.write_text(
+        '<?xml version="1.0" encoding="ISO-8859-1"?>'
+        '<mbf xmlns="http://www.mbfbioscience.com/2007/neurolucida" version="4.0">'
+        '<contour name="Soma" color="#00FF00" closed="true">'
+        '<point x="0" y="0" z="0" d="1"/><point x="1" y="0" z="0" d="1"/></contour>'
+        f"{trees}</mbf>"
+    )
+    return fname
+
+
+@pytest.mark.parametrize("remove_points", [False, True])
+def test_parse_matches_py3dn(xml_fname, monkeypatch, remove_points):
+    monkeypatch.setattr(time, "clock", time.perf_counter, raising=False)
+    expected = NeuroLucidaXMLParser.Load_Neuron(str(xml_fname), 0.5, remove_points)
+    neuron = parse_neurolucida_xml(xml_fname, 0.5, remove_points)
+    assert neuron.total_trees == expected.total_trees == 3
+    for tree, expected_tree in zip(neuron.tree, expected.tree):
+        assert (tree.type, tree.color, tree.leaf) == (expected_tree.type, expected_tree.color, expected_tree.leaf)
+        expected_arrays = ParsedTree.from_py3dn(expected_tree)
+        for name in ("P", "r", "ppid", "level", "ptype", "contact"):
+            np.testing.assert_array_equal(getattr(tree, name), getattr(expected_arrays, name))
+
+
+def test_load_uses_cache(xml_fname, monkeypatch):
+    neuron = load_neurolucida_xml(xml_fname)
+    cached = xml_fname.with_name("neuron.neuron.npz")
+    assert cached.exists()
+    loaded = load_neurolucida_xml(xml_fname)
+    assert isinstance(loaded.tree[1].P, np.memmap)
+    assert loaded.tree[1].rawpoint[1] == neuron.tree[1].rawpoint[1]
+    # Touching the file keeps the cache, as its contents are the same
+    os.utime(xml_fname, ns=(0, 0))
+    assert isinstance(load_neurolucida_xml(xml_fname).tree[0].r, np.memmap)
+    # and records the new mtime, so the file isn't hashed again
+    monkeypatch.setattr(neuron_loader, "_hash_file", None)
+    assert isinstance(load_neurolucida_xml(xml_fname).tree[0].r, np.memmap)
+    monkeypatch.undo()
+    # Other parameters or contents parse the file again
+    assert not isinstance(load_neurolucida_xml(xml_fname, minimal_d=1.0).tree[0].r, np.memmap)
+    xml_fname.write_text(xml_fname.read_text().replace('type="Axon"', 'type="Dendrite"'))
+    assert load_neurolucida_xml(xml_fname).tree[0].type == "Dendrite"
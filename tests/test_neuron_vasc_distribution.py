@@ -2,7 +2,7 @@ import pytest
 import numpy as np
 
 from ncd_post_process.neuron_to_vasc_dist_distrib import *
-from ncd_post_process.aggregator import rotate, translate, swap_x_y
+from ncd_post_process.aggregator import rotate_array, translate_array
 
 
 
@@ -15,6 +15,18 @@ ROT_Y_90 = np.array([0, 90, 0], dtype=np.float64)
 ROT_Z_90 = np.array([0, 0, 90], dtype=np.float64)
 
 
+def rotate(coords, rotation):
+    coords[:] = rotate_array(np.array(coords, dtype=np.float64), rotation).tolist()
+
+
+def translate(coords, location):
+    coords[:] = translate_array(np.array(coords, dtype=np.float64), location).tolist()
+
+
+def swap_x_y(coords):
+    coords[:] = [[y, x, z, r] for x, y, z, r in coords]
+
+
 @pytest.fixture()
 def rotation_mat():
     def _make_rotation_mat(rot):
@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import queue
+
+import pytest
+import numpy as np
+
+from ncd_post_process.aggregator import aggregate, find_placement_collisions, get_vascular
+from ncd_post_process.collision_db import META_FNAME, CollisionDB, CollisionDBWriter
+from ncd_post_process.result_sink import QueueResultSink, drain_results
+from ncd_post_process.run_aggregator import make_chunks, run_workers
+
+
+def _ncd_line(neuron_name, location, rotation, count):
+    return ",".join([neuron_name, *map(str, location), *map(str, rotation), str(count), "0", "f"]) + "\n"
+
+
+def test_make_chunks_puts_expensive_results_first():
+    lines = [_ncd_line("n.obj", [0, 0, 0], [0, 0, i], i) for i in range(10)]
+    chunks = make_chunks(lines, chunk_size=3)
+    assert [len(c) for c in chunks] == [3, 3, 3, 1]
+    assert chunks[0][0] == lines[-1]
+    assert sorted(sum(chunks, [])) == sorted(lines)
+
+
+@pytest.fixture()
+def ncd_data(tmp_path):
+    rng = np.random.default_rng(1)
+    vascular = np.hstack((rng.uniform(0, 60, (3000, 3)), rng.uniform(0.5, 3, (3000, 1))))
+    neuron = np.hstack((rng.uniform(-10, 10, (200, 3)), rng.uniform(0.5, 1, (200, 1))))
+    (tmp_path / "data" / "neurons").mkdir(parents=True)
+    (tmp_path / "data" / "vascular").mkdir(parents=True)
+    neuron_fname = tmp_path / "data" / "neurons" / "n_balls.csv"
+    vascular_fname = tmp_path / "data" / "vascular" / "vascular_balls.csv"
+    np.savetxt(neuron_fname, neuron, delimiter=",")
+    np.savetxt(vascular_fname, vascular, delimiter=",")
+
+    placements = [([20 + i, 30, 30], [0, 0, 10 * i]) for i in range(12)]
+    lines = [_ncd_line("n.obj", loc, rot, i) for i, (loc, rot) in enumerate(placements)]
+    return tmp_path, neuron_fname, vascular_fname, placements, lines
+
+
+def test_run_workers_matches_serial_aggregate(ncd_data):
+    tmp_path, neuron_fname, vascular_fname, placements, lines = ncd_data
+    output = tmp_path / "agg.csv"
+    run_workers(lines, str(output), 0, str(vascular_fname), tmp_path, worker_count=3, chunk_size=2)
+
+    expected = tmp_path / "expected.csv"
+    for loc, rot in placements:
+        aggregate(str(vascular_fname), str(neuron_fname), loc, rot, str(expected), 0, None)
+    assert sorted(output.read_text().splitlines()) == sorted(expected.read_text().splitlines())
+
+
+def test_run_workers_npz_output(ncd_data):
+    tmp_path, neuron_fname, vascular_fname, placements, lines = ncd_data
+    run_workers(lines, str(tmp_path / "agg.npz"), 0, str(vascular_fname), tmp_path, worker_count=2, chunk_size=5)
+    shards = [np.load(f) for f in sorted(tmp_path.glob("agg_*.npz"))]
+    assert len(shards) == 1
+    shard = shards[0]
+    assert len(shard["count"]) == len(placements)
+    assert shard["offsets"][-1] == len(shard["collisions"]) == shard["count"].sum()
+    for loc, rot, count in zip(shard["location"], shard["rotation"], shard["count"]):
+        expected = find_placement_collisions(str(neuron_fname), loc, rot, 0, get_vascular(str(vascular_fname)))
+        assert count == len(expected)
+
+
+def _send_and_close(result_queue):
+    sink = QueueResultSink(result_queue)
+    sink.add("n.obj", "v.csv", [0, 0, 0], [0, 0, 0], np.zeros((1, 3)))
+    sink.close()
+
+
+def _die(result_queue):
+    os._exit(1)
+
+
+def test_drain_results_raises_when_a_worker_dies(tmp_path):
+    result_queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=f, args=(result_queue,)) for f in (_send_and_close, _die)]
+    for p in processes:
+        p.start()
+    sink = CollisionDBWriter(tmp_path / "agg.ncdb")
+    with pytest.raises(RuntimeError):
+        drain_results(result_queue, sink, processes, poll_seconds=0.1)
+    for p in processes:
+        p.join()
+    # The DB isn't marked as complete
+    assert not (tmp_path / "agg.ncdb" / META_FNAME).exists()
+
+
+class _LateQueue(queue.Queue):
+    """A worker's results and sentinel arrive right after the first timeout"""
+
+    def get(self, block=True, timeout=None):
+        if block and self.empty():
+            self.put([("n.obj", "v.csv", (0, 0, 0), (0, 0, 0), np.zeros((1, 3), np.float32))])
+            self.put(None)
+            raise queue.Empty
+        return super().get(block, timeout)
+
+
+class _ExitedWorker:
+    exitcode = 0
+
+    def is_alive(self):
+        return False
+
+
+def test_drain_results_reads_sentinels_of_exited_workers(tmp_path):
+    drain_results(_LateQueue(), CollisionDBWriter(tmp_path / "agg.ncdb"), [_ExitedWorker()], poll_seconds=0)
+    assert len(CollisionDB.open(tmp_path / "agg.ncdb")) == 1
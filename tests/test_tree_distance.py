@@ -0,0 +1,81 @@
+import pathlib
+import sys
+
+import pytest
+import numpy as np
+
+from ncd_post_process.tree_distance import TreeDistance
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src" / "py3DN"))
+import mytools
+from DataContainers import RAWPOINT, TREE
+
+
+def make_tree(num_of_points, seed=0):
+    """A random py3DN tree, with each point's parent preceding it"""
+    rng = np.random.default_rng(seed)
+    tree = TREE()
+    for idx in range(num_of_points):
+        ppid = int(rng.integers(max(0, idx - 5), idx)) if idx > 0 else -1
+        tree.rawpoint.append(RAWPOINT(list(rng.uniform(0, 100, 3)), 1.0, ppid, 0, "standard"))
+    tree.total_rawpoints = num_of_points
+    return tree
+
+
+@pytest.fixture()
+def tree():
+    return make_tree(200)
+
+
+def test_dist_to_root_of_chain():
+    coords = np.array([[0, 0, 0], [3, 4, 0], [3, 4, 12]])
+    distances = TreeDistance.from_parents([-1, 0, 1], coords)
+    np.testing.assert_array_almost_equal(distances.dist_to_root, [0, 5, 17])
+    np.testing.assert_array_equal(distances.depth, [0, 1, 2])
+
+
+def chain_fiber_distance(tree, first, second):
+    """Fiber distance by walking both points' parent chains"""
+    def path_lengths(pid):
+        lengths = {pid: 0.0}
+        while tree.rawpoint[pid].ppid != -1:
+            ppid = tree.rawpoint[pid].ppid
+            step = mytools.Get_LineDistance_Between_Points(tree.rawpoint[pid].P, tree.rawpoint[ppid].P)
+            lengths[ppid] = lengths[pid] + step
+            pid = ppid
+        return lengths
+
+    first_lengths = path_lengths(first)
+    second_lengths = path_lengths(second)
+    return min(first_lengths[pid] + second_lengths[pid] for pid in first_lengths if pid in second_lengths)
+
+
+def test_dist_to_first_point_matches_py3dn(tree):
+    distances = TreeDistance.from_tree(tree)
+    expected = [
+        mytools.Get_FiberDistance_Between_RawPoints(tree, 0, pid)
+        for pid in range(len(tree.rawpoint))
+    ]
+    np.testing.assert_allclose(distances.fiber_distance(0, np.arange(len(tree.rawpoint))), expected)
+
+
+def test_fiber_distance(tree):
+    distances = TreeDistance.from_tree(tree)
+    rng = np.random.default_rng(1)
+    first = rng.integers(0, len(tree.rawpoint), 300)
+    second = rng.integers(0, len(tree.rawpoint), 300)
+    expected = [chain_fiber_distance(tree, int(a), int(b)) for a, b in zip(first, second)]
+    np.testing.assert_allclose(distances.fiber_distance(first, second), expected)
+
+
+def test_lowest_common_ancestor():
+    # 0 -> 1 -> 2, 0 -> 3 -> 4, and 5 is a separate root
+    distances = TreeDistance.from_parents([-1, 0, 1, 0, 3, -1], np.zeros((6, 3)))
+    lca = distances.lowest_common_ancestor([2, 2, 4, 1, 2], [4, 1, 3, 1, 5])
+    np.testing.assert_array_equal(lca, [0, 1, 3, 1, -1])
+    assert distances.fiber_distance(2, 5) == -1
+
+
+def test_children_before_parents_raise():
+    with pytest.raises(ValueError):
+        TreeDistance.from_parents([-1, 2, 0], np.zeros((3, 3)))
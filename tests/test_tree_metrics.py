@@ -0,0 +1,111 @@
+import pathlib
+import sys
+
+import pytest
+import numpy as np
+
+from ncd_post_process.neuron_loader import ParsedTree
+from ncd_post_process.tree_metrics import TreeMetrics
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src" / "py3DN"))
+import mytools
+from DataContainers import RAWPOINT, TREE
+
+
+def make_preorder_tree(num_of_points, seed=0):
+    """A random py3DN tree with its points in pre-order, as the XML parser
+    creates them: each point's parent is on the path to the previous point"""
+    rng = np.random.default_rng(seed)
+    tree = TREE()
+    path = []
+    for idx in range(num_of_points):
+        if len(path) > 1 and rng.random() < 0.1:
+            del path[-int(rng.integers(1, len(path))):]
+        ppid = path[-1] if path else -1
+        tree.rawpoint.append(RAWPOINT(list(rng.uniform(0, 100, 3)), float(rng.uniform(0.1, 2)), ppid, 0, "standard"))
+        path.append(idx)
+    tree.total_rawpoints = num_of_points
+    return tree
+
+
+@pytest.fixture()
+def tree():
+    return make_preorder_tree(300)
+
+
+def segment_loop_metrics(tree, start_point_id=0):
+    """Length, surface and volume of a (sub)tree, segment by segment, as
+    py3DN's Get_Tree_Length, Get_Tree_Surface and Get_Tree_Volume did"""
+    N = tree.total_rawpoints
+    if start_point_id == 0:
+        indices = range(1, N)
+    else:
+        start_level = tree.rawpoint[start_point_id].level
+        indices = []
+        i = start_point_id + 1
+        while i < N:
+            if tree.rawpoint[i].ppid < start_point_id or tree.rawpoint[i].level < start_level:
+                break
+            indices.append(i)
+            i += 1
+    length = surface = volume = 0.0
+    for i in indices:
+        pid = tree.rawpoint[i].ppid
+        r = tree.rawpoint[i].r
+        R = tree.rawpoint[pid].r
+        h = mytools.Get_LineDistance_Between_Points(tree.rawpoint[i].P, tree.rawpoint[pid].P)
+        g = np.sqrt(h * h + (R - r) * (R - r))
+        length += h
+        surface += np.pi * g * (R + r)
+        volume += np.pi * h / 3 * (R * R + r * r + R * r)
+    return length, surface, volume
+
+
+def test_whole_tree_matches_segment_loop(tree):
+    expected = segment_loop_metrics(tree)
+    metrics = TreeMetrics.from_tree(tree)
+    assert (metrics.tree_length(), metrics.tree_surface(), metrics.tree_volume()) == pytest.approx(expected)
+    py3dn = (mytools.Get_Tree_Length(tree), mytools.Get_Tree_Surface(tree), mytools.Get_Tree_Volume(tree))
+    assert py3dn == pytest.approx(expected)
+
+
+def test_subtrees_match_segment_loop(tree):
+    metrics = TreeMetrics.from_tree(tree)
+    starts = np.arange(1, 300, 7)
+    expected = np.array([segment_loop_metrics(tree, s) for s in starts]).T
+    np.testing.assert_allclose(metrics.tree_length(starts), expected[0])
+    np.testing.assert_allclose(metrics.tree_surface(starts), expected[1])
+    np.testing.assert_allclose(metrics.tree_volume(starts), expected[2])
+    py3dn = [[f(tree, s) for s in starts] for f in (mytools.Get_Tree_Length, mytools.Get_Tree_Surface, mytools.Get_Tree_Volume)]
+    np.testing.assert_allclose(py3dn, expected)
+
+
+def test_py3dn_arrays_follow_changed_points(tree):
+    expected = segment_loop_metrics(tree, 7)[0]
+    assert mytools.Get_Tree_Length(tree, 7) == pytest.approx(expected)
+    for rawpoint in tree.rawpoint:
+        rawpoint.P = [2 * c for c in rawpoint.P]
+    mytools.Reset_Tree_Arrays(tree)
+    assert mytools.Get_Tree_Length(tree, 7) == pytest.approx(2 * expected)
+
+
+def test_py3dn_subtrees_end_at_lower_levels(tree):
+    rng = np.random.default_rng(1)
+    for rawpoint in tree.rawpoint:
+        rawpoint.level = int(rng.integers(0, 3))
+    starts = np.arange(1, 300, 7)
+    expected = np.array([segment_loop_metrics(tree, s) for s in starts]).T
+    np.testing.assert_allclose([mytools.Get_Tree_Volume(tree, s) for s in starts], expected[2])
+    # Trees of neuron_loader are used through their arrays
+    parsed = ParsedTree.from_py3dn(tree)
+    np.testing.assert_allclose([mytools.Get_Tree_Volume(parsed, s) for s in starts], expected[2])
+
+
+def test_subtree_of_unordered_points():
+    # 0 -> 1 -> 3, 0 -> 2 -> 4, with the branches interleaved
+    coords = np.array([[0, 0, 0], [1, 0, 0], [0, 2, 0], [4, 0, 0], [0, 6, 0]])
+    metrics = TreeMetrics.from_points([-1, 0, 0, 1, 2], coords, np.ones(5))
+    np.testing.assert_array_equal(metrics.subtree_size, [5, 2, 2, 1, 1])
+    np.testing.assert_allclose(metrics.tree_length([0, 1, 2, 3]), [10, 3, 4, 0])
+    # A cylinder of radius 1 and length 4
+    assert metrics.tree_volume(2) == pytest.approx(4 * np.pi)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from ncd_post_process.voxel_accumulator import VoxelAccumulator
+
+
+def _expected(coords, num_of_locs):
+    uniques, counts = np.unique(coords, return_counts=True, axis=0)
+    return uniques, counts / num_of_locs
+
+
+def test_accumulator_matches_unique():
+    rng = np.random.default_rng(0)
+    coords = rng.integers(-30, 30, (5000, 3)).astype(np.int32)
+    coords[:10] = np.iinfo(np.int32).min
+    accumulator = VoxelAccumulator()
+    for batch in np.array_split(coords, 7):
+        accumulator.add(batch, 3)
+    found = accumulator.result()
+    expected = _expected(coords, 21)
+    np.testing.assert_array_equal(found[0], expected[0])
+    np.testing.assert_allclose(found[1], expected[1])
+
+
+def test_merged_accumulators():
+    rng = np.random.default_rng(1)
+    first, second = rng.integers(0, 10, (2, 300, 3))
+    merged = VoxelAccumulator()
+    merged.add(first, 4)
+    other = VoxelAccumulator()
+    other.add(second, 6)
+    found = merged.merge(other).result()
+    expected = _expected(np.concatenate((first, second)), 10)
+    np.testing.assert_array_equal(found[0], expected[0])
+    np.testing.assert_allclose(found[1], expected[1])